@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Finds auto paths that are similar, but not exactly the same.
+
+auto_paths only groups pims with the same scores and intakes, so an auto with one missed intake or
+with its scores in a different order becomes a different path. The similarity index encodes each
+auto timeline as a sequence of action codes, and compares them with the edit distance: the number of
+actions that need to be added, removed or replaced to turn one timeline into the other.
+"""
+
+import logging
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+server_log = logging.FileHandler("server.log")
+log.addHandler(server_log)
+
+
+class AutoPathIndex:
+    """Holds the encoded auto timelines of paths, grouped by the number of actions
+
+    Timelines with lengths that differ by more than the max distance can't be similar, so only the
+    groups with close lengths are compared. Each group is a 2D array, so a timeline is compared with
+    every timeline in a group at once.
+    """
+
+    def __init__(self, max_distance: int = 1):
+        """max_distance: the largest edit distance between two similar timelines"""
+        self.max_distance = max_distance
+        # Integer code of each action type, assigned in the order they are first seen
+        self.action_codes: Dict[str, int] = {}
+        # Keys and encoded timelines of each length, looks like {length: {key: sequence}}
+        self.groups: Dict[int, Dict[Hashable, np.ndarray]] = {}
+        # Stacked timelines of each length, cleared when a group changes
+        self.group_arrays: Dict[int, Tuple[List[Hashable], np.ndarray]] = {}
+        self.key_lengths: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.key_lengths)
+
+    def encode_timeline(self, timeline: List[dict]) -> np.ndarray:
+        """Encodes the action types of an auto timeline as integers,
+        actions without an action type are skipped"""
+        return np.array(
+            [
+                self.action_codes.setdefault(action["action_type"], len(self.action_codes))
+                for action in timeline
+                if action.get("action_type") is not None
+            ],
+            dtype=np.int32,
+        )
+
+    def add(self, key: Hashable, timeline: List[dict]) -> None:
+        """Adds the timeline of a path, replacing the timeline if the key was already added"""
+        self.remove(key)
+        sequence = self.encode_timeline(timeline)
+        self.groups.setdefault(len(sequence), {})[key] = sequence
+        self.group_arrays.pop(len(sequence), None)
+        self.key_lengths[key] = len(sequence)
+
+    def remove(self, key: Hashable) -> None:
+        """Removes the timeline of a path, if it was added"""
+        if (length := self.key_lengths.pop(key, None)) is None:
+            return
+        del self.groups[length][key]
+        if self.groups[length] == {}:
+            del self.groups[length]
+        self.group_arrays.pop(length, None)
+
+    def get_group_array(self, length: int) -> Tuple[List[Hashable], np.ndarray]:
+        """Returns the keys and the 2D array of timelines with a length"""
+        if length not in self.group_arrays:
+            group = self.groups[length]
+            self.group_arrays[length] = (
+                list(group),
+                np.array(list(group.values()), dtype=np.int32).reshape(len(group), length),
+            )
+        return self.group_arrays[length]
+
+    @staticmethod
+    def edit_distances(sequence: np.ndarray, sequences: np.ndarray) -> np.ndarray:
+        """Calculates the edit distance from a sequence to each row of a 2D array of sequences,
+        for every row at once"""
+        num_sequences, length = sequences.shape
+        positions = np.arange(length + 1)
+        # distances[:, j] is the distance from the first i codes of sequence
+        # to the first j codes of each row
+        distances = np.tile(positions, (num_sequences, 1))
+        for i, code in enumerate(sequence, 1):
+            # Best of replacing (or keeping) a code and removing a code
+            best = np.empty_like(distances)
+            best[:, 0] = i
+            best[:, 1:] = np.minimum(distances[:, :-1] + (sequences != code), distances[:, 1:] + 1)
+            # Adding codes: distances[:, j] = min(best[:, k] + j - k) for k <= j
+            distances = np.minimum.accumulate(best - positions, axis=1) + positions
+        return distances[:, length]
+
+    def find_similar(
+        self, timeline: List[dict], max_distance: Optional[int] = None
+    ) -> List[Tuple[Hashable, int]]:
+        """Finds the paths with timelines within max_distance of a timeline.
+        Returns a list of (key, distance), sorted from most to least similar"""
+        if max_distance is None:
+            max_distance = self.max_distance
+        sequence = self.encode_timeline(timeline)
+        similar = []
+        for length in range(max(len(sequence) - max_distance, 0), len(sequence) + max_distance + 1):
+            if length not in self.groups:
+                continue
+            keys, sequences = self.get_group_array(length)
+            distances = self.edit_distances(sequence, sequences)
+            similar.extend(
+                (keys[row], int(distances[row]))
+                for row in np.flatnonzero(distances <= max_distance)
+            )
+        return sorted(similar, key=lambda key_distance: (key_distance[1], str(key_distance[0])))
+
+    def cluster(self, max_distance: Optional[int] = None) -> Dict[Hashable, int]:
+        """Groups paths that are connected by similar timelines.
+        Returns the cluster number of each key, starting at 1 in the order the keys were added"""
+        if max_distance is None:
+            max_distance = self.max_distance
+        # Union find, each key points towards the first key of its cluster
+        parents = {key: key for key in self.key_lengths}
+
+        def find_root(key):
+            while parents[key] != key:
+                parents[key] = parents[parents[key]]
+                key = parents[key]
+            return key
+
+        order = {key: position for position, key in enumerate(self.key_lengths)}
+        for length, group in self.groups.items():
+            for other_length in range(length, length + max_distance + 1):
+                if other_length not in self.groups:
+                    continue
+                other_keys, other_sequences = self.get_group_array(other_length)
+                for key, sequence in group.items():
+                    distances = self.edit_distances(sequence, other_sequences)
+                    for row in np.flatnonzero(distances <= max_distance):
+                        root, other_root = find_root(key), find_root(other_keys[row])
+                        if root != other_root:
+                            first, second = sorted([root, other_root], key=order.get)
+                            parents[second] = first
+
+        cluster_numbers = {}
+        clusters = {}
+        for key in self.key_lengths:
+            cluster_numbers[key] = clusters.setdefault(find_root(key), len(clusters) + 1)
+        return cluster_numbers
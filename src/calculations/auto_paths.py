@@ -9,10 +9,12 @@ Holds functions used to determine auto scoring and paths
 4. Add unique paths to database
 """
 
-from typing import List
+from typing import List, Union
+from calculations.auto_path_similarity import AutoPathIndex
 from calculations.base_calculations import BaseCalculations
 import logging
 import console
+import pymongo
 import utils
 import time
 
@@ -27,60 +29,135 @@ class AutoPathCalc(BaseCalculations):
     def __init__(self, server):
         super().__init__(server)
         self.watched_collections = ["auto_pim"]
+        # Largest edit distance between the auto timelines of similar paths
+        self.similarity = {"max_distance": 1, **self.schema.get("--similarity", {})}
+        # Auto timelines of every path, built the first time similar paths are looked up
+        self.similarity_index = None
 
-    def group_auto_paths(self, pim: dict, calculated_paths: List[dict]) -> dict:
+    def get_path_signature(self, path: dict) -> tuple:
+        """Returns the values of the exact_match path_groups of a pim or path"""
+        return tuple(path[field] for field in self.schema["--path_groups"]["exact_match"])
+
+    @staticmethod
+    def has_failed_score(signature: tuple) -> bool:
+        """Finds if any value in a path signature is a failed score"""
+        return any("fail" in str(value) for value in signature)
+
+    def build_path_index(self, paths: List[dict]) -> dict:
+        """Creates an index of auto paths for each team, which looks like
+        {team_number: {"paths": {path_number: path}, "signatures": {signature: [path_numbers]},
+        "failed_paths": {path_numbers}}}
+
+        A failed score matches any value, so paths with failed scores are kept in failed_paths
+        and are checked one by one instead of by signature"""
+        path_index = {}
+        for path in paths:
+            self.add_to_path_index(path_index, path)
+        return path_index
+
+    def add_to_path_index(self, path_index: dict, path: dict) -> None:
+        """Adds a path to a path index, replacing the path with the same path number"""
+        team_index = path_index.setdefault(
+            path["team_number"], {"paths": {}, "signatures": {}, "failed_paths": set()}
+        )
+        path_number = path["path_number"]
+        # Remove the outdated version of the path
+        if (old_path := team_index["paths"].get(path_number)) is not None:
+            old_signature = self.get_path_signature(old_path)
+            if self.has_failed_score(old_signature):
+                team_index["failed_paths"].discard(path_number)
+            else:
+                team_index["signatures"][old_signature].remove(path_number)
+                if team_index["signatures"][old_signature] == []:
+                    del team_index["signatures"][old_signature]
+
+        team_index["paths"][path_number] = path
+        signature = self.get_path_signature(path)
+        if self.has_failed_score(signature):
+            team_index["failed_paths"].add(path_number)
+        else:
+            team_index["signatures"].setdefault(signature, []).append(path_number)
+
+    def find_same_path(self, pim: dict, team_index: dict) -> Union[dict, None]:
+        """Finds the existing path of a team that is the same as the pim's path,
+        returns the one with the lowest path number if there are multiple"""
+        signature = self.get_path_signature(pim)
+        if self.has_failed_score(signature):
+            # A failed score in the pim can match any path
+            candidates = list(team_index["paths"])
+        else:
+            candidates = team_index["signatures"].get(signature, []) + list(
+                team_index["failed_paths"]
+            )
+        same_paths = [
+            path_number
+            for path_number in candidates
+            if self.is_same_path(pim, team_index["paths"][path_number])
+        ]
+        if same_paths == []:
+            return None
+        return team_index["paths"][min(same_paths)]
+
+    def group_auto_paths(
+        self, pim: dict, calculated_paths: List[dict], path_index: Union[dict, None] = None
+    ) -> dict:
         """
         Creates an auto path given a pim and a list of existing paths.
         Checks if the new pim already has an existing path or if it's a new path.
+
+        path_index is an index of existing paths from build_path_index. If it isn't given, it is created
+        from the team's paths in the database and calculated_paths.
         """
-        # Find all current auto paths with this team number and start position
-        current_documents: List[dict] = self.server.db.find(
-            "auto_paths",
-            {"team_number": pim["team_number"]},
-        )
-        # Add the current calculated_tims into current documents (because these tims aren't in server yet)
-        current_documents.extend(
-            [
-                calculated_path
-                for calculated_path in calculated_paths
-                if (calculated_path["team_number"] == pim["team_number"])
-            ]
+        if path_index is None:
+            # Find all current auto paths with this team number
+            current_documents: List[dict] = self.server.db.find(
+                "auto_paths",
+                {"team_number": pim["team_number"]},
+            )
+            # Add the current calculated_tims into current documents (because these tims aren't in server yet)
+            current_documents.extend(
+                [
+                    calculated_path
+                    for calculated_path in calculated_paths
+                    if (calculated_path["team_number"] == pim["team_number"])
+                ]
+            )
+            path_index = self.build_path_index(current_documents)
+        team_index = path_index.get(
+            pim["team_number"], {"paths": {}, "signatures": {}, "failed_paths": set()}
         )
 
         path = {"team_number": pim["team_number"]}
 
         # Finy any matching paths
-        for document in current_documents:
-            # Checks to see if it's the same path
-            if self.is_same_path(pim, document):
-                # Set path values to pim
-                for field in self.schema["--path_groups"]["exact_match"]:
-                    # Don't update if failed score unless old path doesn't have any info there
-                    if "fail" not in str(pim[field]) or document[field] == "none":
-                        path[field] = pim[field]
-                    else:
-                        path[field] = document[field]
-
-                # Add number of score successes
-                for new_datapoint, count_datapoint in self.schema["path_increment"].items():
-                    # Must have scored to increment
-                    for name, values in count_datapoint.items():
-                        if name != "type":
-                            if pim[name] in values:
-                                path[new_datapoint] = document[new_datapoint] + 1
-                            else:
-                                path[new_datapoint] = document[new_datapoint]
-
-                # Increment all information
-                path["num_matches_ran"] = document["num_matches_ran"] + 1
-                path["match_numbers_played"] = [pim["match_number"]]
-                path["match_numbers_played"].extend(document["match_numbers_played"])
-                path["path_number"] = document["path_number"]
-                break
+        if (document := self.find_same_path(pim, team_index)) is not None:
+            # Set path values to pim
+            for field in self.schema["--path_groups"]["exact_match"]:
+                # Don't update if failed score unless old path doesn't have any info there
+                if "fail" not in str(pim[field]) or document[field] == "none":
+                    path[field] = pim[field]
+                else:
+                    path[field] = document[field]
+
+            # Add number of score successes
+            for new_datapoint, count_datapoint in self.schema["path_increment"].items():
+                # Must have scored to increment
+                for name, values in count_datapoint.items():
+                    if name != "type":
+                        if pim[name] in values:
+                            path[new_datapoint] = document[new_datapoint] + 1
+                        else:
+                            path[new_datapoint] = document[new_datapoint]
+
+            # Increment all information
+            path["num_matches_ran"] = document["num_matches_ran"] + 1
+            path["match_numbers_played"] = [pim["match_number"]]
+            path["match_numbers_played"].extend(document["match_numbers_played"])
+            path["path_number"] = document["path_number"]
         else:
             # If there are no matching documents, that means this is a new auto path
             path["num_matches_ran"] = 1
-            path["path_number"] = len(current_documents) + 1
+            path["path_number"] = max(team_index["paths"], default=0) + 1
             path["match_numbers_played"] = [pim["match_number"]]
             for field in self.schema["--path_groups"]["exact_match"]:
                 path[field] = pim[field]
@@ -109,44 +186,107 @@ class AutoPathCalc(BaseCalculations):
                 return False
         return True
 
-    def update_auto_pims(self, path: dict) -> None:
-        """Updates existing auto pims with incremented path number and num matches ran"""
-        update = {"path_number": path["path_number"], "num_matches_ran": path["num_matches_ran"]}
-        query = {
-            "match_number": {"$in": path["match_numbers_played"]},
-            "team_number": path["team_number"],
-            "start_position": path["start_position"],
-        }
-        self.server.db.update_many("auto_pim", update, query)
-
-    def is_updated_path(self, new_path, old_path):
-        "Checks if new_path is an updated version of old_path. Used in calculate_auto_paths() below."
-        # Check if old path is a subset of new path
-        if new_path["team_number"] == old_path["team_number"]:
-            if set(old_path["match_numbers_played"]).issubset(
-                set(new_path["match_numbers_played"])
-            ):
-                return True
-        return False
+    def update_auto_pims(self, paths: List[dict]) -> None:
+        """Updates existing auto pims with incremented path number and num matches ran,
+        with one bulk write for all paths"""
+        if not paths:
+            return
+        self.server.db.bulk_write(
+            "auto_pim",
+            [
+                pymongo.UpdateMany(
+                    {
+                        "match_number": {"$in": path["match_numbers_played"]},
+                        "team_number": path["team_number"],
+                        "start_position": path["start_position"],
+                    },
+                    {
+                        "$set": {
+                            "path_number": path["path_number"],
+                            "num_matches_ran": path["num_matches_ran"],
+                        }
+                    },
+                    upsert=True,
+                )
+                for path in paths
+            ],
+        )
+
+    def get_similarity_index(self) -> AutoPathIndex:
+        """Returns the index of the auto timeline of every path, building it from auto_pim
+        with one query if needed. Each path uses the timeline of its most recent match"""
+        if self.similarity_index is None:
+            self.similarity_index = AutoPathIndex(self.similarity["max_distance"])
+            latest_pims = {}
+            for pim in self.server.db.find("auto_pim"):
+                # Pims without a path number haven't been grouped yet
+                if not pim.get("path_number") or "auto_timeline" not in pim:
+                    continue
+                key = (pim["team_number"], pim["path_number"])
+                if key not in latest_pims or pim["match_number"] > latest_pims[key]["match_number"]:
+                    latest_pims[key] = pim
+            for key, pim in sorted(latest_pims.items(), key=lambda item: item[1]["match_number"]):
+                self.similarity_index.add(key, pim["auto_timeline"])
+        return self.similarity_index
+
+    def find_similar_paths(
+        self, auto_timeline: List[dict], max_distance: Union[int, None] = None
+    ) -> List[dict]:
+        """Finds the paths of every team with an auto timeline similar to auto_timeline,
+        sorted from most to least similar. Returns a list which looks like
+        [{"team_number": "1678", "path_number": 2, "distance": 0}, ...]"""
+        return [
+            {"team_number": team_number, "path_number": path_number, "distance": distance}
+            for (team_number, path_number), distance in self.get_similarity_index().find_similar(
+                auto_timeline, max_distance
+            )
+        ]
+
+    def cluster_auto_paths(self, max_distance: Union[int, None] = None) -> dict:
+        """Groups paths with similar auto timelines, including paths of different teams.
+        Returns the cluster number of each path, which looks like {(team_number, path_number): 1}"""
+        return self.get_similarity_index().cluster(max_distance)
 
     def calculate_auto_paths(self, empty_pims: List[dict]) -> List[dict]:
         """Calculates auto data for the given empty pims, which looks like
         [{"team_number": "1678", "match_number": 42}, {"team_number": "1706", "match_number": 56}, ...]"""
-        calculated_paths = []
+        if not empty_pims:
+            return []
+        # Get every pim and every existing path of their teams with one query each
+        pim_keys = {(pim["team_number"], pim["match_number"]) for pim in empty_pims}
+        all_auto_pims = {}
+        for auto_pim in self.server.db.find(
+            "auto_pim",
+            {"match_number": {"$in": sorted({pim["match_number"] for pim in empty_pims})}},
+        ):
+            if (key := (auto_pim["team_number"], auto_pim["match_number"])) in pim_keys:
+                all_auto_pims.setdefault(key, []).append(auto_pim)
+        path_index = self.build_path_index(
+            self.server.db.find(
+                "auto_paths",
+                {"team_number": {"$in": list({pim["team_number"] for pim in empty_pims})}},
+            )
+        )
+
+        # Paths are keyed by team and path number, so outdated versions of a path are replaced
+        calculated_paths = {}
         for pim in empty_pims:
-            auto_pims: List[dict] = self.server.db.find("auto_pim", pim)
+            auto_pims: List[dict] = all_auto_pims.get((pim["team_number"], pim["match_number"]), [])
             if len(auto_pims) != 1:
                 log.error(f"Auto_paths: Multiple pims found for {pim}")
 
-            path = self.group_auto_paths(auto_pims[0], calculated_paths)
-            # Check to see if an outdated version of the path is in calculated_paths and remove it
-            for calculated_path in calculated_paths:
-                if self.is_updated_path(path, calculated_path):
-                    calculated_paths.remove(calculated_path)
-            calculated_paths.append(path)
+            path = self.group_auto_paths(auto_pims[0], [], path_index)
+            self.add_to_path_index(path_index, path)
+            if self.similarity_index is not None and "auto_timeline" in auto_pims[0]:
+                self.similarity_index.add(
+                    (path["team_number"], path["path_number"]), auto_pims[0]["auto_timeline"]
+                )
+            # Move the updated path to the end, so paths are in the order they were last updated
+            calculated_paths.pop((path["team_number"], path["path_number"]), None)
+            calculated_paths[(path["team_number"], path["path_number"])] = path
 
-        for path in calculated_paths:
-            self.update_auto_pims(path)
+        calculated_paths = list(calculated_paths.values())
+        self.update_auto_pims(calculated_paths)
         return calculated_paths
 
     def run(self):
@@ -184,21 +324,27 @@ class AutoPathCalc(BaseCalculations):
         # Delete and re-insert if updating all data
         if self.calc_all_data:
             self.server.db.delete_data("auto_paths")
+            self.similarity_index = None
 
         # Calculate data
         updates = self.calculate_auto_paths(unique_empty_pims)
 
-        # Upload data to MongoDB
-        for update in updates:
-            if update != {}:
-                self.server.db.update_document(
-                    "auto_paths",
-                    update,
-                    {
-                        "team_number": update["team_number"],
-                        "path_number": update["path_number"],
-                    },
-                )
+        # Upload data to MongoDB with one bulk write
+        if updates := [update for update in updates if update != {}]:
+            self.server.db.bulk_write(
+                "auto_paths",
+                [
+                    pymongo.UpdateOne(
+                        {
+                            "team_number": update["team_number"],
+                            "path_number": update["path_number"],
+                        },
+                        {"$set": update},
+                        upsert=True,
+                    )
+                    for update in updates
+                ],
+            )
         end_time = time.time()
         # Get total calc time
         total_time = end_time - start_time
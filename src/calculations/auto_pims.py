@@ -4,6 +4,7 @@
 
 from typing import List, Dict, Union, Any, Tuple
 from calculations.base_calculations import BaseCalculations
+import itertools
 import logging
 import statistics
 import utils
@@ -22,11 +23,41 @@ class AutoPIMCalc(BaseCalculations):
         super().__init__(server)
         self.watched_collections = ["unconsolidated_obj_tim", "sim_precision"]
 
+    def get_tim_documents(
+        self, collection: str, tims: List[dict]
+    ) -> Dict[Tuple[str, int], List[dict]]:
+        """Gets the documents of every tim in a collection with one query.
+        Returns a dictionary of {(team_number, match_number): [documents]}"""
+        tim_keys = {(tim["team_number"], tim["match_number"]) for tim in tims}
+        if not tim_keys:
+            return {}
+        match_numbers = sorted({match_number for _, match_number in tim_keys})
+        tim_documents = {}
+        for document in self.server.db.find(collection, {"match_number": {"$in": match_numbers}}):
+            key = (document.get("team_number"), document["match_number"])
+            if key in tim_keys:
+                tim_documents.setdefault(key, []).append(document)
+        return tim_documents
+
+    @staticmethod
+    def get_auto_timeline(timeline: List[dict]) -> List[dict]:
+        """Returns the actions in a timeline before teleop.
+        The decompressor marks every action before to_teleop as in_teleop == False,
+        so the timeline only needs to be read up to the first teleop action"""
+        return list(itertools.takewhile(lambda action: action["in_teleop"] == False, timeline))
+
     def get_unconsolidated_auto_timelines(
-        self, unconsolidated_obj_tims: List[Dict[str, List[dict]]]
+        self,
+        unconsolidated_obj_tims: List[Dict[str, List[dict]]],
+        sim_precisions: Union[Dict[Tuple[str, int], List[dict]], None] = None,
     ) -> Tuple[List[List[dict]], Union[int, None]]:
         """Given unconsolidated_obj_tims, returns unconsolidated auto timelines
-        and the index of the best scout's timeline"""
+        and the index of the best scout's timeline
+
+        sim_precisions are the sim_precision documents from get_tim_documents,
+        they are queried for the given unconsolidated_obj_tims if not given"""
+        if sim_precisions is None:
+            sim_precisions = self.get_tim_documents("sim_precision", unconsolidated_obj_tims)
 
         unconsolidated_auto_timelines = []
         best_sim_precision, best_scout_index = None, 0
@@ -37,13 +68,13 @@ class AutoPIMCalc(BaseCalculations):
                 for key in ["team_number", "match_number", "scout_name"]
             }
             unconsolidated_auto_timelines.append(
-                [
-                    action
-                    for action in unconsolidated_tim["timeline"]
-                    if action["in_teleop"] == False
-                ]
+                self.get_auto_timeline(unconsolidated_tim["timeline"])
             )
-            sim_precision: List[Dict[str, float]] = self.server.db.find("sim_precision", sim)
+            sim_precision: List[Dict[str, float]] = [
+                document
+                for document in sim_precisions.get((sim["team_number"], sim["match_number"]), [])
+                if document.get("scout_name") == sim["scout_name"]
+            ]
             if len(sim_precision) == 0:
                 continue
             elif "sim_precision" not in sim_precision[0]:
@@ -82,10 +113,32 @@ class AutoPIMCalc(BaseCalculations):
 
         return consolidated_timeline
 
-    def get_consolidated_tim_fields(self, calculated_tim: dict) -> dict:
-        "Given a calculated_tim, return tim fields directly from other collections"
+    def get_tim_field_collections(self) -> List[str]:
+        """Returns the collections other than obj_tim that tim fields are taken from"""
+        return list(
+            dict.fromkeys(
+                field.split(".")[0]
+                for field in self.schema["tim_fields"]
+                if field.split(".")[0] != "obj_tim"
+            )
+        )
+
+    def get_consolidated_tim_fields(
+        self,
+        calculated_tim: dict,
+        tim_field_documents: Union[Dict[str, Dict[Tuple[str, int], List[dict]]], None] = None,
+    ) -> dict:
+        """Given a calculated_tim, return tim fields directly from other collections
+
+        tim_field_documents are the documents of each collection from get_tim_documents,
+        they are queried for the calculated_tim if not given"""
         # Auto variables we collect
         tim_fields = self.schema["tim_fields"]
+        if tim_field_documents is None:
+            tim_field_documents = {
+                collection: self.get_tim_documents(collection, [calculated_tim])
+                for collection in self.get_tim_field_collections()
+            }
 
         tim_auto_values = {}
         for field in tim_fields:
@@ -94,12 +147,8 @@ class AutoPIMCalc(BaseCalculations):
                 tim_auto_values[datapoint] = calculated_tim[datapoint]
             else:
                 # Get data from other collections, such as subj_team or tba_tim
-                data: List[dict] = self.server.db.find(
-                    collection,
-                    {
-                        "match_number": calculated_tim["match_number"],
-                        "team_number": calculated_tim["team_number"],
-                    },
+                data: List[dict] = tim_field_documents[collection].get(
+                    (calculated_tim["team_number"], calculated_tim["match_number"]), []
                 )
                 if data == []:
                     # Handle no data
@@ -178,10 +227,18 @@ class AutoPIMCalc(BaseCalculations):
         """Calculates auto data for the given tims, which looks like
         [{"team_number": 1678, "match_number": 42}, {"team_number": 1706, "match_number": 56}, ...]"""
         calculated_pims = []
+        # Get data for every tim from MongoDB, with one query per collection
+        all_unconsolidated_obj_tims = self.get_tim_documents("unconsolidated_obj_tim", tims)
+        all_obj_tims = self.get_tim_documents("obj_tim", tims)
+        sim_precisions = self.get_tim_documents("sim_precision", tims)
+        tim_field_documents = {
+            collection: self.get_tim_documents(collection, tims)
+            for collection in self.get_tim_field_collections()
+        }
         for tim in tims:
-            # Get data for the tim from MongoDB
-            unconsolidated_obj_tims: List[dict] = self.server.db.find("unconsolidated_obj_tim", tim)
-            obj_tim: dict = self.server.db.find("obj_tim", tim)
+            key = (tim["team_number"], tim["match_number"])
+            unconsolidated_obj_tims: List[dict] = all_unconsolidated_obj_tims.get(key, [])
+            obj_tim: dict = all_obj_tims.get(key, [])
             if len(obj_tim) > 0:
                 obj_tim = obj_tim[0]
             else:
@@ -190,12 +247,12 @@ class AutoPIMCalc(BaseCalculations):
                 )
 
             # Run calculations on the team in match
-            tim.update(self.get_consolidated_tim_fields(obj_tim))
+            tim.update(self.get_consolidated_tim_fields(obj_tim, tim_field_documents))
             tim.update(
                 {
                     "auto_timeline": self.consolidate_timelines(
                         *self.get_unconsolidated_auto_timelines(
-                            self.score_fail_type(unconsolidated_obj_tims)
+                            self.score_fail_type(unconsolidated_obj_tims), sim_precisions
                         )
                     )
                 }
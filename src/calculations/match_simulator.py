@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""Simulates many matches at once to find the distributions of alliance scores and RPs.
+
+Predicted_aim only predicts one score per alliance, and RPs as 0 or 1. The simulator instead samples
+what each team does in thousands of simulated matches, so the chances of winning and of getting
+each RP can be counted.
+"""
+
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+server_log = logging.FileHandler("server.log")
+log.addHandler(server_log)
+
+
+class MatchSimulator:
+    """Samples each team's score, notes and stage actions in every simulated match
+
+    Scores and notes are sampled from normal distributions of the obj_team averages and SDs, or
+    bootstrapped (sampled with replacement) from the team's obj_tims when they are given. Stage
+    actions are sampled from the --endgame_fields success rates of predicted_aim.
+    Each team has a row in the team arrays, the last row is all zeros for teams without data.
+    """
+
+    # obj_team averages and SDs of the notes counted for the melody RP,
+    # and the obj_tim fields they are calculated from
+    NOTE_FIELDS = {
+        "auto_avg_speaker": ("auto_sd_speaker", "auto_speaker"),
+        "auto_avg_amp": ("auto_sd_amp", "auto_amp"),
+        "tele_avg_unamplified_speaker": ("tele_sd_unamplified_speaker", "tele_unamplified_speaker"),
+        "tele_avg_amplified": ("tele_sd_amplified", "tele_amplified"),
+        "tele_avg_amp": ("tele_sd_amp", "tele_amp"),
+    }
+    # Notes needed for the melody RP, the same as calc_melody_rp
+    MELODY_NOTES = 15
+    STAGE_POINTS = {"onstage": 3, "park": 1, "trap": 5, "harmony": 2}
+    # Stage points and number of teams onstage needed for the ensemble RP
+    ENSEMBLE_POINTS = 10
+    ENSEMBLE_ONSTAGE = 2
+    # RPs for winning and tying a qualification match
+    WIN_RPS = 2
+    TIE_RPS = 1
+    # Percentiles of alliance scores that are stored
+    QUANTILES = [5, 25, 50, 75, 95]
+    # Double elimination playoff bracket for 8 alliances, with each match as (round, red, blue)
+    # Alliances are from ("seed", alliance number), or the ("winner", match number) or
+    # ("loser", match number) of an earlier match
+    PLAYOFF_BRACKET = [
+        (1, ("seed", 1), ("seed", 8)),
+        (1, ("seed", 4), ("seed", 5)),
+        (1, ("seed", 2), ("seed", 7)),
+        (1, ("seed", 3), ("seed", 6)),
+        (2, ("loser", 1), ("loser", 2)),
+        (2, ("loser", 3), ("loser", 4)),
+        (2, ("winner", 1), ("winner", 2)),
+        (2, ("winner", 3), ("winner", 4)),
+        (3, ("loser", 7), ("winner", 6)),
+        (3, ("loser", 8), ("winner", 5)),
+        (4, ("winner", 7), ("winner", 8)),
+        (4, ("winner", 10), ("winner", 9)),
+        (5, ("loser", 11), ("winner", 12)),
+    ]
+    # Finals are a best of 3 between the upper and lower bracket winners
+    FINALS = (("winner", 11), ("winner", 13))
+    FINALS_MATCHES = 3
+
+    def __init__(
+        self,
+        obj_team: List[dict],
+        win_chance_fields: Dict[str, dict],
+        endgame_fields: Dict[str, dict],
+        obj_tims: Optional[List[dict]] = None,
+        num_simulations: int = 2000,
+        seed: int = 1678,
+        chunk_size: int = 128,
+    ):
+        """obj_team: obj_team data, the distributions of teams are built from it
+
+        win_chance_fields and endgame_fields: the --win_chance and --endgame_fields of the
+        predicted_aim schema
+
+        obj_tims: obj_tim data to bootstrap scores and notes from, teams without obj_tims are
+        sampled from their obj_team data instead
+
+        chunk_size: number of alliances simulated at once, limits the size of the sample arrays
+        """
+        self.num_simulations = num_simulations
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.team_indexes = {}
+        for team_data in obj_team:
+            self.team_indexes.setdefault(team_data["team_number"], len(self.team_indexes))
+        num_rows = len(self.team_indexes) + 1
+
+        self.score_means = np.zeros(num_rows)
+        self.score_sds = np.zeros(num_rows)
+        self.note_means = np.zeros(num_rows)
+        self.note_sds = np.zeros(num_rows)
+        self.stage_rates = {field: np.zeros(num_rows) for field in endgame_fields}
+        for team_data in obj_team:
+            row = self.team_indexes[team_data["team_number"]]
+            # Same mean and variance as calc_win_chance
+            score_var = 0
+            for name, attrs in win_chance_fields.items():
+                self.score_means[row] += team_data[name] * attrs["weight"]
+                score_var += (team_data[attrs["sd"]] * attrs["weight"]) ** 2
+            self.score_sds[row] = score_var**0.5
+            # Note counts are assumed to be independent
+            note_var = 0
+            for average, (sd, _) in self.NOTE_FIELDS.items():
+                self.note_means[row] += team_data[average]
+                note_var += team_data[sd] ** 2
+            self.note_sds[row] = note_var**0.5
+            for field, var in endgame_fields.items():
+                self.stage_rates[field][row] = team_data[var["var"]]
+
+        # Bootstrapped teams have their obj_tim scores and notes in a row padded with zeros
+        self.tim_counts = np.zeros(num_rows, dtype=int)
+        self.tim_scores = np.zeros((num_rows, 0))
+        self.tim_notes = np.zeros((num_rows, 0))
+        if obj_tims:
+            self.load_tims(obj_tims)
+
+    def load_tims(self, obj_tims: List[dict]) -> None:
+        """Loads the obj_tim scores and notes of each team with obj_team data to bootstrap from"""
+        team_tims = {}
+        for tim in obj_tims:
+            if tim["team_number"] in self.team_indexes:
+                team_tims.setdefault(self.team_indexes[tim["team_number"]], []).append(tim)
+        max_tims = max([len(tims) for tims in team_tims.values()], default=0)
+        self.tim_counts = np.zeros(len(self.team_indexes) + 1, dtype=int)
+        self.tim_scores = np.zeros((len(self.team_indexes) + 1, max_tims))
+        self.tim_notes = np.zeros((len(self.team_indexes) + 1, max_tims))
+        for row, tims in team_tims.items():
+            self.tim_counts[row] = len(tims)
+            self.tim_scores[row, : len(tims)] = [tim["total_points"] for tim in tims]
+            self.tim_notes[row, : len(tims)] = [
+                sum(tim[field] for _, field in self.NOTE_FIELDS.values()) for tim in tims
+            ]
+
+    def get_alliance_rows(self, team_lists: List[List[str]]) -> np.ndarray:
+        """Returns the rows of the teams in each alliance, teams without data use the last row"""
+        missing_row = len(self.team_indexes)
+        return np.array(
+            [
+                [self.team_indexes.get(team, missing_row) for team in team_list]
+                for team_list in team_lists
+            ],
+            dtype=int,
+        ).reshape(len(team_lists), -1)
+
+    def sample_teams(
+        self,
+        rng: np.random.Generator,
+        alliance_rows: np.ndarray,
+        means: np.ndarray,
+        sds: np.ndarray,
+        tim_values: np.ndarray,
+        num_simulations: Optional[int] = None,
+    ) -> np.ndarray:
+        """Samples a value for each team in each alliance in each simulation
+
+        Teams with obj_tims are bootstrapped from tim_values, the others are sampled from a normal
+        distribution that is cut off at 0
+        Returns an array of shape (alliances, teams, simulations), simulations defaults to
+        num_simulations
+        """
+        shape = alliance_rows.shape + (num_simulations or self.num_simulations,)
+        samples = np.maximum(
+            rng.normal(means[alliance_rows, None], sds[alliance_rows, None], shape), 0
+        )
+        counts = self.tim_counts[alliance_rows]
+        if counts.any():
+            tim_indexes = (rng.random(shape) * np.maximum(counts, 1)[:, :, None]).astype(int)
+            bootstrapped = tim_values[alliance_rows[:, :, None], tim_indexes]
+            samples = np.where(counts[:, :, None] > 0, bootstrapped, samples)
+        return samples
+
+    def simulate_scores(
+        self,
+        rng: np.random.Generator,
+        alliance_rows: np.ndarray,
+        num_simulations: Optional[int] = None,
+    ) -> np.ndarray:
+        """Simulates the score of each alliance, returns an array of shape (alliances, simulations)"""
+        return self.sample_teams(
+            rng, alliance_rows, self.score_means, self.score_sds, self.tim_scores, num_simulations
+        ).sum(axis=1)
+
+    def simulate_alliances(
+        self, rng: np.random.Generator, alliance_rows: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Simulates each alliance num_simulations times
+
+        Returns the scores and whether the alliance got the melody and ensemble RPs, as arrays of
+        shape (alliances, simulations)
+        """
+        scores = self.simulate_scores(rng, alliance_rows)
+        notes = self.sample_teams(
+            rng, alliance_rows, self.note_means, self.note_sds, self.tim_notes
+        ).sum(axis=1)
+
+        # One draw decides if a team is onstage, parked or neither
+        shape = alliance_rows.shape + (self.num_simulations,)
+        onstage_rates = self.stage_rates["onstage_rate"][alliance_rows, None]
+        park_rates = self.stage_rates["park_rate"][alliance_rows, None]
+        stage_draws = rng.random(shape)
+        onstage = stage_draws < onstage_rates
+        parked = ~onstage & (stage_draws < onstage_rates + park_rates)
+        trap = rng.random(shape) < self.stage_rates["trap_rate"][alliance_rows, None]
+        climb_after = onstage & (
+            rng.random(shape) < self.stage_rates["climb_after_rate"][alliance_rows, None]
+        )
+
+        num_onstage = onstage.sum(axis=1)
+        # Each team that climbs after another team adds a harmony
+        num_harmony = np.minimum(climb_after.sum(axis=1), np.maximum(num_onstage - 1, 0))
+        stage_points = (
+            num_onstage * self.STAGE_POINTS["onstage"]
+            + parked.sum(axis=1) * self.STAGE_POINTS["park"]
+            + trap.sum(axis=1) * self.STAGE_POINTS["trap"]
+            + num_harmony * self.STAGE_POINTS["harmony"]
+        )
+        melody = notes >= self.MELODY_NOTES
+        ensemble = (stage_points >= self.ENSEMBLE_POINTS) & (num_onstage >= self.ENSEMBLE_ONSTAGE)
+        return scores, melody, ensemble
+
+    def simulate_matches(
+        self,
+        red_rows: np.ndarray,
+        blue_rows: np.ndarray,
+        match_keys: Optional[Sequence[int]] = None,
+    ) -> Dict[str, Dict[str, np.ndarray]]:
+        """Simulates each match between red_rows[i] and blue_rows[i] num_simulations times
+
+        match_keys: a non-negative integer for each match, like the match number, defaults to the
+        index of the match. Each match is drawn from its own generator seeded with the seed and its
+        key, so a match gives the same results no matter which other matches are simulated with it.
+        Returns a dictionary of alliance colors ("R" and "B") to a dictionary of:
+        score_quantiles: the QUANTILES of the alliance's score, shape (matches, quantiles)
+        rp1_chance, rp2_chance: the chances of getting the melody and ensemble RPs
+        win_chance: the chance of winning, ties count as half a win
+        avg_rps: the expected RPs from the match
+        """
+        num_matches = len(red_rows)
+        if match_keys is None:
+            match_keys = range(num_matches)
+        results = {
+            color: {
+                "score_quantiles": np.zeros((num_matches, len(self.QUANTILES))),
+                **{
+                    name: np.zeros(num_matches)
+                    for name in ["rp1_chance", "rp2_chance", "win_chance", "avg_rps"]
+                },
+            }
+            for color in ["R", "B"]
+        }
+        for start in range(0, num_matches, self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            match_draws = []
+            for index in range(num_matches)[chunk]:
+                rng = np.random.default_rng([self.seed, match_keys[index]])
+                match_draws.append(
+                    [
+                        self.simulate_alliances(rng, rows[index : index + 1])
+                        for rows in [red_rows, blue_rows]
+                    ]
+                )
+            # Stacks the draws of the matches in the chunk, so the results are found at once
+            simulated = {
+                color: tuple(np.concatenate(arrays) for arrays in zip(*alliance_draws))
+                for color, alliance_draws in zip(["R", "B"], zip(*match_draws))
+            }
+            ties = simulated["R"][0] == simulated["B"][0]
+            for color, other_color in [("R", "B"), ("B", "R")]:
+                scores, melody, ensemble = simulated[color]
+                wins = scores > simulated[other_color][0]
+                color_results = results[color]
+                color_results["score_quantiles"][chunk] = np.percentile(
+                    scores, self.QUANTILES, axis=1
+                ).T
+                color_results["rp1_chance"][chunk] = melody.mean(axis=1)
+                color_results["rp2_chance"][chunk] = ensemble.mean(axis=1)
+                color_results["win_chance"][chunk] = (wins + 0.5 * ties).mean(axis=1)
+                color_results["avg_rps"][chunk] = (
+                    wins * self.WIN_RPS + ties * self.TIE_RPS + melody + ensemble
+                ).mean(axis=1)
+        return results
+
+    @staticmethod
+    def get_red_wins(
+        rng: np.random.Generator, red_scores: np.ndarray, blue_scores: np.ndarray
+    ) -> np.ndarray:
+        """Returns whether red wins each simulated match, ties are decided randomly"""
+        ties = red_scores == blue_scores
+        return (red_scores > blue_scores) | (ties & (rng.random(red_scores.shape) < 0.5))
+
+    def simulate_bracket(
+        self, alliance_rows: np.ndarray, num_brackets: int
+    ) -> Dict[str, np.ndarray]:
+        """Simulates the PLAYOFF_BRACKET num_brackets times at once
+
+        alliance_rows: the rows of the teams in each alliance, in order of alliance number
+        Returns a dictionary of stages ("round_1" to the last round, "finals" and "winner") to the
+        chance of each alliance reaching the stage
+        """
+        rng = np.random.default_rng(self.seed)
+        num_rounds = max(round_number for round_number, _, _ in self.PLAYOFF_BRACKET)
+        stages = [f"round_{round_number}" for round_number in range(1, num_rounds + 1)]
+        stages += ["finals", "winner"]
+        num_matches = len(self.PLAYOFF_BRACKET) + self.FINALS_MATCHES
+        # Score of every alliance in every match of every bracket, even if it doesn't play in it
+        scores = self.simulate_scores(rng, alliance_rows, num_matches * num_brackets).reshape(
+            len(alliance_rows), num_matches, num_brackets
+        )
+        brackets = np.arange(num_brackets)
+        # Index in stages of the furthest stage each alliance reaches in each bracket
+        reached = np.zeros((len(alliance_rows), num_brackets), dtype=int)
+        results = {"winner": {}, "loser": {}}
+
+        def get_alliances(source):
+            kind, number = source
+            if kind == "seed":
+                return np.full(num_brackets, number - 1)
+            return results[kind][number]
+
+        def play(match_index, red, blue, stage):
+            for alliances in [red, blue]:
+                reached[alliances, brackets] = np.maximum(reached[alliances, brackets], stage)
+            return self.get_red_wins(
+                rng, scores[red, match_index, brackets], scores[blue, match_index, brackets]
+            )
+
+        for match_index, (round_number, red_source, blue_source) in enumerate(self.PLAYOFF_BRACKET):
+            red, blue = get_alliances(red_source), get_alliances(blue_source)
+            red_wins = play(match_index, red, blue, round_number - 1)
+            results["winner"][match_index + 1] = np.where(red_wins, red, blue)
+            results["loser"][match_index + 1] = np.where(red_wins, blue, red)
+
+        red, blue = [get_alliances(source) for source in self.FINALS]
+        red_match_wins = sum(
+            play(len(self.PLAYOFF_BRACKET) + finals_match, red, blue, len(stages) - 2)
+            for finals_match in range(self.FINALS_MATCHES)
+        )
+        winners = np.where(red_match_wins > self.FINALS_MATCHES // 2, red, blue)
+        reached[winners, brackets] = len(stages) - 1
+        return {
+            stage: (reached >= stage_index).mean(axis=1) for stage_index, stage in enumerate(stages)
+        }
@@ -2,8 +2,12 @@
 """Calculate objective team data from Team in Match (TIM) data."""
 
 import utils
-from typing import List, Dict
+from typing import List, Dict, Optional
 from calculations import base_calculations
+from calculations import running_stats
+from collections import Counter
+import numpy as np
+import pandas as pd
 import statistics
 import time
 import logging
@@ -19,11 +23,42 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
     # Get the last section of each entry (so foo.bar.baz becomes baz)
     SCHEMA = utils.unprefix_schema_dict(utils.read_schema("schema/calc_obj_team_schema.yml"))
     TIM_SCHEMA = utils.read_schema("schema/calc_obj_tim_schema.yml")
+    # Prefix of calculations that only use a team's last matches, to how many matches they use
+    LAST_MATCHES = SCHEMA.get("--last_matches", {"lfm": 4})
 
     def __init__(self, server):
         """Overrides watched collections, passes server object"""
         super().__init__(server)
         self.watched_collections = ["obj_tim", "subj_tim"]
+        # Running aggregates of each team's TIMs, kept between runs so new TIMs are added one at a time
+        self.team_aggregates = {}
+        # Maps the _id of each TIM in team_aggregates to its team number, to find deleted TIMs
+        self.tim_teams = {}
+        # obj_tim fields that need averages, standard deviations, extrema, medians or sums
+        self.stat_fields = {"incap_time"}
+        for section in ["averages", "standard_deviations", "extrema", "medians"]:
+            for schema in self.SCHEMA[section].values():
+                self.stat_fields.update(field.split(".")[1] for field in schema["tim_fields"])
+        self.category_fields = {
+            field.split(".")[1]
+            for schema in self.SCHEMA["modes"].values()
+            for field in schema["tim_fields"]
+        }
+        # Count calculations that are sums of each TIM's count, so they can be added to
+        self.running_counts = [
+            calculation
+            for section in ["counts", "multi_counts", "super_counts", "special_counts"]
+            for calculation in self.SCHEMA[section]
+            if self.get_last_matches_prefix(calculation) is None
+        ]
+
+    def get_last_matches_prefix(self, calculation: str) -> Optional[str]:
+        """Returns the prefix (such as lfm) of a calculation that only uses a team's last matches,
+        or None if the calculation uses every match"""
+        for prefix in self.LAST_MATCHES:
+            if prefix in calculation.split("_"):
+                return prefix
+        return None
 
     def get_action_counts(self, tims: List[Dict]):
         """Gets a list of times each team completed a certain action by tim for averages
@@ -75,10 +110,10 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
             average = 0
             for tim_field in schema["tim_fields"]:
                 tim_field = tim_field.split(".")[1]
-                if "lfm" in calculation:
-                    average += self.avg(lfm_tim_action_counts[tim_field])
+                if self.get_last_matches_prefix(calculation):
+                    average += running_stats.mean(lfm_tim_action_counts[tim_field])
                 else:
-                    average += self.avg(tim_action_counts[tim_field])
+                    average += running_stats.mean(tim_action_counts[tim_field])
             team_info[calculation] = average
         return team_info
 
@@ -90,10 +125,10 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
         for calculation, schema in self.SCHEMA["standard_deviations"].items():
             # Take the standard deviation for the tim_field
             tim_field = schema["tim_fields"][0].split(".")[1]
-            if "lfm" in calculation:
-                standard_deviation = statistics.pstdev(lfm_tim_action_counts[tim_field])
+            if self.get_last_matches_prefix(calculation):
+                standard_deviation = running_stats.pstdev(lfm_tim_action_counts[tim_field])
             else:
-                standard_deviation = statistics.pstdev(tim_action_counts[tim_field])
+                standard_deviation = running_stats.pstdev(tim_action_counts[tim_field])
             team_info[calculation] = standard_deviation
         return team_info
 
@@ -151,7 +186,7 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
         """
         team_info = {}
         for calculation, schema in self.SCHEMA["counts"].items():
-            if "lfm" in calculation:
+            if self.get_last_matches_prefix(calculation):
                 tims_that_meet_filter = self.filter_tims_for_counts(lfm_tims, schema)
             else:
                 tims_that_meet_filter = self.filter_tims_for_counts(tims, schema)
@@ -167,7 +202,7 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
                 [
                     tim[tim_field]
                     for tim_field in tim_fields
-                    for tim in (lfm_tims if "lfm" in calculation else tims)
+                    for tim in (lfm_tims if self.get_last_matches_prefix(calculation) else tims)
                 ]
             )
         return team_info
@@ -179,7 +214,7 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
             total = 0
             obj_tims_that_meet_filter = []
             subj_tims_that_meet_filter = []
-            if "lfm" in calculation:
+            if self.get_last_matches_prefix(calculation):
                 for field in schema["tim_fields"]:
                     for key, value in field.items():
                         # Separates the datapoint into the obj/subj_tim part and the actual datapoint
@@ -228,7 +263,7 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
         for calculation, schema in self.SCHEMA["super_counts"].items():
             total = 0
             tim_field = schema["tim_fields"][0].split(".")[1]
-            if "lfm" in calculation:
+            if self.get_last_matches_prefix(calculation):
                 for tim in lfm_tims:
                     if tim[tim_field]:
                         total += 1
@@ -245,7 +280,7 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
         for calculation, schema in self.SCHEMA["ss_counts"].items():
             total = 0
             tim_field = schema["tim_fields"][0].split(".")[1]
-            if "lfm" in calculation:
+            if self.get_last_matches_prefix(calculation):
                 for tim in lfm_tims:
                     if tim_field in tim.keys():
                         if tim[tim_field] == True:
@@ -270,15 +305,15 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
         for calculation, schema in self.SCHEMA["extrema"].items():
             tim_field = schema["tim_fields"][0].split(".")[1]
             if schema["extrema_type"] == "max":
-                if "lfm" in calculation:
-                    team_info[calculation] = max(lfm_tim_action_counts[tim_field])
+                if self.get_last_matches_prefix(calculation):
+                    team_info[calculation] = running_stats.maximum(lfm_tim_action_counts[tim_field])
                 else:
-                    team_info[calculation] = max(tim_action_counts[tim_field])
+                    team_info[calculation] = running_stats.maximum(tim_action_counts[tim_field])
             if schema["extrema_type"] == "min":
-                if "lfm" in calculation:
-                    team_info[calculation] = min(lfm_tim_action_counts[tim_field])
+                if self.get_last_matches_prefix(calculation):
+                    team_info[calculation] = running_stats.minimum(lfm_tim_action_counts[tim_field])
                 else:
-                    team_info[calculation] = min(tim_action_counts[tim_field])
+                    team_info[calculation] = running_stats.minimum(tim_action_counts[tim_field])
         return team_info
 
     def calculate_medians(self, tim_action_sum, lfm_tim_action_sum):
@@ -290,22 +325,15 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
             median = 0
             for tim_field in schema["tim_fields"]:
                 tim_field = tim_field.split(".")[1]
-                if "lfm" in calculation:
-                    values_to_count = [
-                        value
-                        for value in lfm_tim_action_sum[tim_field]
-                        if value != schema["ignore"]
-                    ]
-                    if values_to_count == []:
-                        continue
-                    median += statistics.median(values_to_count)
+                if self.get_last_matches_prefix(calculation):
+                    field_median = running_stats.median(
+                        lfm_tim_action_sum[tim_field], schema["ignore"]
+                    )
                 else:
-                    values_to_count = [
-                        value for value in tim_action_sum[tim_field] if value != schema["ignore"]
-                    ]
-                    if values_to_count == []:
-                        continue
-                    median += statistics.median(values_to_count)
+                    field_median = running_stats.median(tim_action_sum[tim_field], schema["ignore"])
+                if field_median is None:
+                    continue
+                median += field_median
             team_info[calculation] = median
         return team_info
 
@@ -316,22 +344,22 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
 
         team_info = {}
         for calculation, schema in self.SCHEMA["modes"].items():
-            values_to_count = []
+            # Categories can be given as lists of values or as Counters of how often each occurred
+            frequencies = Counter()
             for tim_field in schema["tim_fields"]:
                 tim_field = tim_field.split(".")[1]
-                if "lfm" in calculation:
-                    values_to_count = values_to_count + [
-                        value
-                        for value in lfm_tim_action_categories[tim_field]
-                        if value != schema["ignore"]
-                    ]
+                if self.get_last_matches_prefix(calculation):
+                    frequencies.update(lfm_tim_action_categories[tim_field])
                 else:
-                    values_to_count = values_to_count + [
-                        value
-                        for value in tim_action_categories[tim_field]
-                        if value != schema["ignore"]
-                    ]
-            team_info[calculation] = statistics.multimode(values_to_count)
+                    frequencies.update(tim_action_categories[tim_field])
+            frequencies.pop(schema["ignore"], None)
+            # Same as statistics.multimode, modes are in the order they first occurred
+            max_frequency = max(frequencies.values(), default=0)
+            team_info[calculation] = [
+                value
+                for value, frequency in frequencies.items()
+                if frequency == max_frequency and frequency > 0
+            ]
         return team_info
 
     def calculate_success_rates(self, team_counts: Dict):
@@ -376,16 +404,26 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
                 team_info[calculation] = 0
         return team_info"""
 
-    def calculate_sums(self, team_data, tims: List[Dict], lfm_tims: List[Dict]):
+    def calculate_sums(
+        self, team_data, tims: List[Dict], lfm_tims: List[Dict], total_incap_time=None
+    ):
         """Creates a dictionary of sum of weighted data, called team_info
         where the keys are the names of the calculations, and the values are the results
+
+        total_incap_time is used instead of summing the incap_time of tims when it is given
         """
         team_info = {}
         for calculation, schema in self.SCHEMA["sums"].items():
+            prefix = self.get_last_matches_prefix(calculation)
             # incap_time has no point values
-            if calculation == "total_incap_time":
+            if total_incap_time is not None and calculation in [
+                "total_incap_time",
+                f"{prefix}_total_incap_time",
+            ]:
+                team_info[calculation] = total_incap_time
+            elif calculation == "total_incap_time":
                 team_info[calculation] = sum(tim["incap_time"] for tim in tims)
-            elif calculation == "lfm_total_incap_time":
+            elif calculation == f"{prefix}_total_incap_time":
                 # Use lfm_tims instead of tims, also this is the only lfm sum
                 team_info[calculation] = sum([tim["incap_time"] for tim in lfm_tims])
             else:
@@ -405,6 +443,88 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
                 team_info[calculation] = total_points
         return team_info
 
+    def get_tims_scope(self, obj_tims: List[Dict], subj_tims: List[Dict], ss_tims: List[Dict]):
+        """Returns the data calculate_team_data needs from a group of TIMs"""
+        return {
+            "action_values": {**self.get_action_counts(obj_tims), **self.get_action_sum(obj_tims)},
+            "action_categories": self.get_action_categories(obj_tims),
+            "time_left_to_climb": [tim["time_left_to_climb"] for tim in subj_tims],
+            "obj_tims": obj_tims,
+            "subj_tims": subj_tims,
+            "ss_tims": ss_tims,
+        }
+
+    def calculate_time_left_to_climb(self, time_left_to_climbs, prefix: Optional[str] = None):
+        """Calculates the average, standard deviation and max time left to climb,
+        time_left_to_climbs can be a list or a RunningStat"""
+        names = ["avg_time_left_to_climb", "sd_time_left_to_climb", "max_time_left_to_climb"]
+        if prefix is not None:
+            names = [f"{prefix}_{name}" for name in names]
+        if len(time_left_to_climbs) == 0:
+            return dict.fromkeys(names, 0)
+        return dict(
+            zip(
+                names,
+                [
+                    running_stats.mean(time_left_to_climbs),
+                    running_stats.pstdev(time_left_to_climbs),
+                    running_stats.maximum(time_left_to_climbs),
+                ],
+            )
+        )
+
+    def calculate_team_data(self, team: str, scopes: Dict[Optional[str], Dict]) -> dict:
+        """Calculates every datapoint of a team
+
+        scopes maps None (every match) and each prefix in LAST_MATCHES (such as lfm) to the data
+        of those TIMs, see get_tims_scope. Action values and categories can also be RunningStats
+        and Counters, and a scope can give its non-lfm 'counts' instead of obj_tims and subj_tims.
+        """
+        team_data = {"team_number": team}
+        for prefix, scope in scopes.items():
+            scope_data = self.calculate_time_left_to_climb(scope["time_left_to_climb"], prefix)
+            action_values = scope["action_values"]
+            action_categories = scope["action_categories"]
+            scope_data.update(self.calculate_averages(action_values, action_values))
+            if "counts" in scope:
+                scope_data.update(scope["counts"])
+            else:
+                obj_tims, subj_tims = scope["obj_tims"], scope["subj_tims"]
+                scope_data.update(self.calculate_counts(obj_tims, obj_tims))
+                scope_data.update(self.calculate_multi_counts(obj_tims, obj_tims))
+                scope_data.update(self.calculate_super_counts(subj_tims, subj_tims))
+                scope_data.update(
+                    self.calculate_special_counts(obj_tims, subj_tims, obj_tims, subj_tims)
+                )
+            scope_data.update(self.calculate_ss_counts(scope["ss_tims"], scope["ss_tims"]))
+            scope_data.update(self.calculate_standard_deviations(action_values, action_values))
+            scope_data.update(self.calculate_extrema(action_values, action_values))
+            scope_data.update(self.calculate_modes(action_categories, action_categories))
+            scope_data.update(self.calculate_medians(action_values, action_values))
+            # Only keep the calculations that use this scope's TIMs
+            team_data.update(
+                {
+                    calculation: value
+                    for calculation, value in scope_data.items()
+                    if self.get_last_matches_prefix(calculation) == prefix
+                }
+            )
+        team_data.update(self.calculate_success_rates(team_data))
+        # team_data.update(self.calculate_average_points(team_data))
+        for prefix, scope in scopes.items():
+            obj_tims = scope.get("obj_tims", [])
+            sums = self.calculate_sums(
+                team_data, obj_tims, obj_tims, total_incap_time=scope.get("total_incap_time")
+            )
+            team_data.update(
+                {
+                    calculation: value
+                    for calculation, value in sums.items()
+                    if self.get_last_matches_prefix(calculation) == prefix
+                }
+            )
+        return team_data
+
     def update_team_calcs(self, teams: list) -> list:
         """Calculate data for given team using objective calculated TIMs"""
         obj_team_updates = {}
@@ -414,85 +534,463 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
             obj_tims = self.server.db.find("obj_tim", {"team_number": team})
             subj_tims = self.server.db.find("subj_tim", {"team_number": team})
             ss_tims = self.server.db.find("ss_tim", {"team_number": team})
-            # Last 4 tims to calculate last 4 matches
-            obj_lfm_tims = sorted(obj_tims, key=lambda tim: tim["match_number"])[-4:]
-            subj_lfm_tims = sorted(subj_tims, key=lambda tim: tim["match_number"])[-4:]
-            ss_lfm_tims = sorted(ss_tims, key=lambda tim: tim["match_number"])[-4:]
-            tim_action_counts = self.get_action_counts(obj_tims)
-            lfm_tim_action_counts = self.get_action_counts(obj_lfm_tims)
-            tim_action_categories = self.get_action_categories(obj_tims)
-            lfm_tim_action_categories = self.get_action_categories(obj_lfm_tims)
-            tim_action_sum = self.get_action_sum(obj_tims)
-            lfm_tim_action_sum = self.get_action_sum(obj_lfm_tims)
-
-            team_data = {}
-            time_left_to_climbs = [tim["time_left_to_climb"] for tim in subj_tims]
-            lfm_time_left_to_climbs = [tim["time_left_to_climb"] for tim in subj_lfm_tims]
-            if len(time_left_to_climbs) != 0:
-                team_data["avg_time_left_to_climb"] = sum(time_left_to_climbs) / len(
-                    time_left_to_climbs
+            scopes = {None: self.get_tims_scope(obj_tims, subj_tims, ss_tims)}
+            # Last tims to calculate last matches (such as last 4 matches)
+            for prefix, num_matches in self.LAST_MATCHES.items():
+                scopes[prefix] = self.get_tims_scope(
+                    *[
+                        sorted(tims, key=lambda tim: tim["match_number"])[-num_matches:]
+                        if num_matches > 0
+                        else []
+                        for tims in [obj_tims, subj_tims, ss_tims]
+                    ]
                 )
-                team_data["sd_time_left_to_climb"] = statistics.pstdev(time_left_to_climbs)
-                team_data["max_time_left_to_climb"] = max(time_left_to_climbs)
-            else:
-                team_data["avg_time_left_to_climb"] = 0
-                team_data["sd_time_left_to_climb"] = 0
-                team_data["max_time_left_to_climb"] = 0
+            obj_team_updates[team] = self.calculate_team_data(team, scopes)
+        return list(obj_team_updates.values())
+
+    def load_tim_frames(self) -> Dict[str, pd.DataFrame]:
+        """Loads every obj_tim, subj_tim and ss_tim into a DataFrame, with one query each"""
+        return {
+            collection: pd.DataFrame(self.server.db.find(collection))
+            for collection in ["obj_tim", "subj_tim", "ss_tim"]
+        }
+
+    def get_last_matches_frame(self, frame: pd.DataFrame, num_matches: int) -> pd.DataFrame:
+        """Returns the rows of each team's last matches, sorted by match number"""
+        if frame.empty:
+            return frame
+        frame = frame.sort_values("match_number", kind="stable")
+        # Rank of each TIM within its team, where 0 is the team's most recent match
+        rank = frame.groupby("team_number").cumcount(ascending=False)
+        return frame[rank < num_matches]
+
+    def get_frame_field(self, frame: pd.DataFrame, field: str) -> pd.Series:
+        """Returns a column of a TIM DataFrame, which is all NaN if no TIM has the field"""
+        if field in frame:
+            return frame[field]
+        return pd.Series(np.nan, index=frame.index, dtype=object)
+
+    def get_frame_mask(self, frame: pd.DataFrame, field: str, value, missing: bool) -> pd.Series:
+        """Returns which TIMs have `field` equal to `value`, `missing` is used for TIMs without it"""
+        column = self.get_frame_field(frame, field)
+        return (column == value).where(column.notna(), missing).astype(bool)
+
+    def count_frame(self, frame: pd.DataFrame, mask: pd.Series, teams: pd.Index) -> pd.Series:
+        """Counts the TIMs of each team that meet a mask"""
+        if frame.empty:
+            return pd.Series(0, index=teams)
+        return mask.groupby(frame["team_number"]).sum().reindex(teams, fill_value=0)
+
+    def calculate_frame_counts(self, frame: pd.DataFrame, schema, teams: pd.Index) -> pd.Series:
+        """Same as filter_tims_for_counts, for every team at once"""
+        tim_fields = schema["tim_fields"]
+        masks = []
+        if isinstance(tim_fields, dict):
+            for key, value in tim_fields.items():
+                if key != "not":
+                    masks.append(self.get_frame_mask(frame, key, value, False))
+                    continue
+                # not_field expects the output to be anything but the given filter
+                not_filters = value if isinstance(value, list) else [value]
+                for not_filter in not_filters:
+                    for not_field, not_value in not_filter.items():
+                        not_field = not_field.split(".")[-1]
+                        masks.append(~self.get_frame_mask(frame, not_field, not_value, True))
+            # filter_tims_for_counts checks every filter once for each key in tim_fields
+            masks *= len(tim_fields)
+        else:
+            for field in tim_fields:
+                for key, value in field.items():
+                    masks.append(self.get_frame_mask(frame, key.split(".")[1], value, False))
+        return sum(
+            (self.count_frame(frame, mask, teams) for mask in masks), pd.Series(0, index=teams)
+        )
 
-            if len(lfm_time_left_to_climbs) != 0:
-                team_data["lfm_avg_time_left_to_climb"] = sum(lfm_time_left_to_climbs) / len(
-                    lfm_time_left_to_climbs
+    def calculate_frame_modes(self, frame: pd.DataFrame, schema, teams: pd.Index) -> pd.Series:
+        """Same as calculate_modes for one calculation, for every team at once"""
+        modes = pd.Series([[] for _ in teams], index=teams, dtype=object)
+        if frame.empty:
+            return modes
+        values = pd.concat(
+            [
+                pd.DataFrame(
+                    {
+                        "team_number": frame["team_number"],
+                        "value": self.get_frame_field(frame, tim_field.split(".")[1]),
+                    }
                 )
-                team_data["lfm_sd_time_left_to_climb"] = statistics.pstdev(lfm_time_left_to_climbs)
-                team_data["lfm_max_time_left_to_climb"] = max(lfm_time_left_to_climbs)
+                for tim_field in schema["tim_fields"]
+            ]
+        )
+        values = values[values["value"] != schema["ignore"]]
+        # Without sorting, categories stay in the order they first occurred like statistics.multimode
+        frequencies = values.groupby(["team_number", "value"], sort=False, dropna=False).size()
+        max_frequencies = frequencies.groupby(level="team_number").transform("max")
+        frequencies = frequencies[frequencies == max_frequencies].reset_index()
+        for team, team_modes in frequencies.groupby("team_number", sort=False)["value"]:
+            modes[team] = list(team_modes)
+        return modes
+
+    def calculate_frame_scope(
+        self,
+        frames: Dict[str, pd.DataFrame],
+        prefix: Optional[str],
+        teams: pd.Index,
+    ) -> pd.DataFrame:
+        """Calculates the datapoints of every team that use the TIMs in `frames`, for the
+        calculations with the given last matches prefix (or every match if the prefix is None)"""
+        obj_frame, subj_frame, ss_frame = frames["obj_tim"], frames["subj_tim"], frames["ss_tim"]
+        obj_groups = obj_frame.groupby("team_number")
+        team_data = pd.DataFrame(index=teams)
+
+        def get_calculations(section):
+            return {
+                calculation: schema
+                for calculation, schema in self.SCHEMA[section].items()
+                if self.get_last_matches_prefix(calculation) == prefix
+            }
+
+        def aggregate(tim_field, function):
+            return obj_groups[tim_field.split(".")[1]].agg(function).reindex(teams)
+
+        climb_names = ["avg_time_left_to_climb", "sd_time_left_to_climb", "max_time_left_to_climb"]
+        for name, function in zip(climb_names, ["mean", lambda x: x.std(ddof=0), "max"]):
+            if subj_frame.empty:
+                team_data[name if prefix is None else f"{prefix}_{name}"] = 0
+                continue
+            team_data[name if prefix is None else f"{prefix}_{name}"] = (
+                subj_frame.groupby("team_number")["time_left_to_climb"]
+                .agg(function)
+                .reindex(teams, fill_value=0)
+            )
+        for calculation, schema in get_calculations("averages").items():
+            team_data[calculation] = sum(
+                aggregate(tim_field, "mean") for tim_field in schema["tim_fields"]
+            )
+        for calculation, schema in get_calculations("counts").items():
+            team_data[calculation] = self.calculate_frame_counts(obj_frame, schema, teams)
+        for calculation, schema in get_calculations("multi_counts").items():
+            team_data[calculation] = sum(
+                aggregate(tim_field, "sum") for tim_field in schema["tim_fields"]
+            )
+        for calculation, schema in get_calculations("super_counts").items():
+            tim_field = schema["tim_fields"][0].split(".")[1]
+            mask = self.get_frame_field(subj_frame, tim_field).fillna(False).astype(bool)
+            team_data[calculation] = self.count_frame(subj_frame, mask, teams)
+        for calculation, schema in get_calculations("special_counts").items():
+            obj_masks, subj_mask = [], pd.Series(False, index=subj_frame.index)
+            for field in schema["tim_fields"]:
+                for key, value in field.items():
+                    name, key = key.split(".")
+                    if name == "obj_tim":
+                        obj_masks.append(self.get_frame_mask(obj_frame, key, value, True))
+                    else:
+                        subj_mask |= self.get_frame_mask(subj_frame, key, value, True)
+            # Only obj_tims with a subj_tim from the same match that meets the filter are counted
+            if subj_frame.empty:
+                has_subj_tim = pd.Series(False, index=obj_frame.index)
             else:
-                team_data["lfm_avg_time_left_to_climb"] = 0
-                team_data["lfm_sd_time_left_to_climb"] = 0
-                team_data["lfm_max_time_left_to_climb"] = 0
-
-            team_data.update(self.calculate_averages(tim_action_counts, lfm_tim_action_counts))
-            team_data["team_number"] = team
-            team_data.update(self.calculate_counts(obj_tims, obj_lfm_tims))
-            team_data.update(self.calculate_multi_counts(obj_tims, obj_lfm_tims))
-            team_data.update(self.calculate_super_counts(subj_tims, subj_lfm_tims))
-            team_data.update(self.calculate_ss_counts(ss_tims, ss_lfm_tims))
-            team_data.update(
-                self.calculate_standard_deviations(tim_action_counts, lfm_tim_action_counts)
+                subj_tims = pd.MultiIndex.from_frame(
+                    subj_frame.loc[subj_mask, ["team_number", "match_number"]]
+                )
+                has_subj_tim = pd.MultiIndex.from_frame(
+                    obj_frame[["team_number", "match_number"]]
+                ).isin(subj_tims)
+            team_data[calculation] = sum(
+                (self.count_frame(obj_frame, mask & has_subj_tim, teams) for mask in obj_masks),
+                pd.Series(0, index=teams),
             )
-            team_data.update(
-                self.calculate_extrema(
-                    tim_action_counts,
-                    lfm_tim_action_counts,
+        for calculation, schema in get_calculations("ss_counts").items():
+            tim_field = schema["tim_fields"][0].split(".")[1]
+            mask = self.get_frame_mask(ss_frame, tim_field, True, False)
+            team_data[calculation] = self.count_frame(ss_frame, mask, teams)
+        for calculation, schema in get_calculations("standard_deviations").items():
+            team_data[calculation] = aggregate(schema["tim_fields"][0], lambda x: x.std(ddof=0))
+        for calculation, schema in get_calculations("extrema").items():
+            team_data[calculation] = aggregate(schema["tim_fields"][0], schema["extrema_type"])
+        for calculation, schema in get_calculations("modes").items():
+            team_data[calculation] = self.calculate_frame_modes(obj_frame, schema, teams)
+        for calculation, schema in get_calculations("medians").items():
+            median = pd.Series(0, index=teams)
+            for tim_field in schema["tim_fields"]:
+                tim_field = tim_field.split(".")[1]
+                values = obj_frame.loc[obj_frame[tim_field] != schema["ignore"]]
+                # Teams without any values that aren't ignored don't add to the median
+                median = median + values.groupby("team_number")[tim_field].median().reindex(
+                    teams, fill_value=0
                 )
+            team_data[calculation] = median
+        for calculation in get_calculations("sums"):
+            if calculation in ["total_incap_time", f"{prefix}_total_incap_time"]:
+                team_data[calculation] = aggregate("obj_tim.incap_time", "sum")
+        return team_data
+
+    def calculate_team_frame(self, frames: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+        """Calculates every datapoint of every team with an obj_tim, using groupby aggregations
+        instead of calculating each team separately. Each row is a team."""
+        teams = pd.Index(frames["obj_tim"]["team_number"].unique(), name="team_number")
+        team_data = [self.calculate_frame_scope(frames, None, teams)]
+        for prefix, num_matches in self.LAST_MATCHES.items():
+            last_frames = {
+                collection: self.get_last_matches_frame(frame, num_matches)
+                for collection, frame in frames.items()
+            }
+            team_data.append(self.calculate_frame_scope(last_frames, prefix, teams))
+        team_data = pd.concat(team_data, axis=1)
+
+        for calculation, schema in self.SCHEMA["success_rates"].items():
+            num_attempts = pd.Series(0, index=teams)
+            for attempt_datapoint in schema["team_attempts"]:
+                if isinstance(attempt_datapoint, int):
+                    num_attempts += attempt_datapoint
+                elif attempt_datapoint[0] == "-":
+                    num_attempts -= team_data[attempt_datapoint[1:]]
+                else:
+                    num_attempts += team_data[attempt_datapoint]
+            num_successes = sum(
+                (team_data[datapoint] for datapoint in schema["team_successes"]),
+                pd.Series(0, index=teams),
             )
-            team_data.update(
-                self.calculate_special_counts(obj_tims, subj_tims, obj_lfm_tims, subj_lfm_tims)
+            rates = (num_successes / num_attempts.where(num_attempts != 0)).clip(upper=1)
+            team_data[calculation] = rates.fillna(0)
+
+        for calculation, schema in self.SCHEMA["sums"].items():
+            if calculation in team_data:
+                # incap_time has no point values, it was summed with the rest of its TIMs' data
+                continue
+            total_points = pd.Series(0, index=teams)
+            for field, value in schema.items():
+                if field == "type":
+                    continue
+                weight = 1
+                for v in value if isinstance(value, list) else [value]:
+                    weight = weight * (v if not isinstance(v, str) else team_data[v])
+                total_points = total_points + team_data[field] * weight
+            team_data[calculation] = total_points
+        return team_data
+
+    def update_all_team_calcs(self) -> list:
+        """Calculates the data of every team at once from DataFrames of every TIM,
+        gives the same results as update_team_calcs"""
+        frames = self.load_tim_frames()
+        if frames["obj_tim"].empty:
+            return []
+        team_data = self.calculate_team_frame(frames)
+        obj_team_updates = []
+        for team, row in team_data.iterrows():
+            # Convert from NumPy types so the documents can be stored in MongoDB
+            update = {"team_number": team}
+            for calculation, value in row.items():
+                if isinstance(value, list):
+                    value = [v.item() if isinstance(v, np.generic) else v for v in value]
+                elif isinstance(value, np.generic):
+                    value = value.item()
+                update[calculation] = value
+            obj_team_updates.append(update)
+        return obj_team_updates
+
+    def new_team_aggregates(self) -> dict:
+        """Returns empty running aggregates for one team"""
+        return {
+            # Match number to TIM
+            "obj_tims": {},
+            "subj_tims": {},
+            # obj_tim field to RunningStat
+            "action_stats": {field: running_stats.RunningStat() for field in self.stat_fields},
+            # obj_tim field to how many times each category occurred
+            "action_categories": {field: Counter() for field in self.category_fields},
+            "time_left_to_climb": running_stats.RunningStat(),
+            "counts": dict.fromkeys(self.running_counts, 0),
+            # Prefix in LAST_MATCHES to windows of the last obj_tims and subj_tims
+            "last_matches": {
+                prefix: {
+                    "obj_tim": running_stats.LastMatchesWindow(
+                        num_matches, self.stat_fields, self.category_fields
+                    ),
+                    "subj_tim": running_stats.LastMatchesWindow(
+                        num_matches, ["time_left_to_climb"]
+                    ),
+                }
+                for prefix, num_matches in self.LAST_MATCHES.items()
+            },
+        }
+
+    def add_running_counts(self, aggregates: dict, team_info: dict) -> None:
+        """Adds the non-lfm counts of one TIM to a team's running counts"""
+        for calculation, count in team_info.items():
+            if calculation in aggregates["counts"]:
+                aggregates["counts"][calculation] += count
+
+    def add_obj_tim(self, aggregates: dict, tim: dict) -> None:
+        """Adds one new obj_tim to a team's running aggregates"""
+        aggregates["obj_tims"][tim["match_number"]] = tim
+        for windows in aggregates["last_matches"].values():
+            windows["obj_tim"].add(tim)
+        for field, stat in aggregates["action_stats"].items():
+            stat.add(tim[field])
+        for field, categories in aggregates["action_categories"].items():
+            categories[tim[field]] += 1
+        self.add_running_counts(aggregates, self.calculate_counts([tim], []))
+        self.add_running_counts(aggregates, self.calculate_multi_counts([tim], []))
+        # Special counts only count matches with both an obj_tim and a subj_tim
+        if (subj_tim := aggregates["subj_tims"].get(tim["match_number"])) is not None:
+            self.add_running_counts(
+                aggregates, self.calculate_special_counts([tim], [subj_tim], [], [])
             )
-            team_data.update(self.calculate_modes(tim_action_categories, lfm_tim_action_categories))
-            team_data.update(self.calculate_medians(tim_action_sum, lfm_tim_action_sum))
-            team_data.update(self.calculate_success_rates(team_data))
-            # team_data.update(self.calculate_average_points(team_data))
-            team_data.update(self.calculate_sums(team_data, obj_tims, obj_lfm_tims))
-            obj_team_updates[team] = team_data
-        return list(obj_team_updates.values())
+
+    def add_subj_tim(self, aggregates: dict, tim: dict) -> None:
+        """Adds one new subj_tim to a team's running aggregates"""
+        aggregates["subj_tims"][tim["match_number"]] = tim
+        for windows in aggregates["last_matches"].values():
+            windows["subj_tim"].add(tim)
+        aggregates["time_left_to_climb"].add(tim["time_left_to_climb"])
+        self.add_running_counts(aggregates, self.calculate_super_counts([tim], []))
+        if (obj_tim := aggregates["obj_tims"].get(tim["match_number"])) is not None:
+            self.add_running_counts(
+                aggregates, self.calculate_special_counts([obj_tim], [tim], [], [])
+            )
+
+    def rebuild_team_aggregates(self, team_tims: Dict[str, Dict[str, List[Dict]]]) -> None:
+        """Replaces the running aggregates of the given teams
+
+        team_tims is a dictionary of team numbers to {'obj_tim': [...], 'subj_tim': [...]}
+        """
+        for team, tims in team_tims.items():
+            aggregates = self.new_team_aggregates()
+            for tim in tims.get("obj_tim", []):
+                self.add_obj_tim(aggregates, tim)
+                self.tim_teams[tim["_id"]] = team
+            for tim in tims.get("subj_tim", []):
+                self.add_subj_tim(aggregates, tim)
+                self.tim_teams[tim["_id"]] = team
+            self.team_aggregates[team] = aggregates
+
+    def rebuild_all_team_aggregates(self) -> List[str]:
+        """Rebuilds the running aggregates of every team from the database, returns the teams"""
+        team_tims = {}
+        for collection in self.watched_collections:
+            for tim in self.server.db.find(collection):
+                team_tims.setdefault(tim["team_number"], {}).setdefault(collection, []).append(tim)
+        self.team_aggregates = {}
+        self.tim_teams = {}
+        self.rebuild_team_aggregates(team_tims)
+        return list(team_tims.keys())
+
+    def update_team_aggregates(self, entries: List[dict]) -> List[str]:
+        """Adds the TIMs inserted in the given oplog entries to the running aggregates,
+        and returns the teams whose aggregates changed
+
+        Teams that had a TIM updated (such as an override) or deleted, or that haven't been
+        loaded yet, are rebuilt from the database instead
+        """
+        rebuild_teams = set()
+        inserted_tims = []
+        for entry in entries:
+            collection = entry["ns"].split(".")[-1]
+            if entry["op"] == "i":
+                tim = entry["o"]
+                team = tim["team_number"]
+                aggregates = self.team_aggregates.get(team)
+                # The same TIM being inserted again means it was deleted and replaced
+                if aggregates is None or tim["match_number"] in aggregates[f"{collection}s"]:
+                    rebuild_teams.add(team)
+                else:
+                    inserted_tims.append((collection, tim))
+                continue
+            # Updates and deletes only include the _id, find which team the TIM belongs to
+            document_id = entry["o2"]["_id"] if entry["op"] == "u" else entry["o"]["_id"]
+            if (team := self.tim_teams.get(document_id)) is None:
+                if not (documents := self.server.db.find(collection, {"_id": document_id})):
+                    continue
+                team = documents[0]["team_number"]
+            rebuild_teams.add(team)
+
+        for collection, tim in inserted_tims:
+            if tim["team_number"] in rebuild_teams:
+                continue
+            aggregates = self.team_aggregates[tim["team_number"]]
+            # The same TIM can be in the oplog more than once
+            if tim["match_number"] in aggregates[f"{collection}s"]:
+                rebuild_teams.add(tim["team_number"])
+                continue
+            if collection == "obj_tim":
+                self.add_obj_tim(aggregates, tim)
+            else:
+                self.add_subj_tim(aggregates, tim)
+            self.tim_teams[tim["_id"]] = tim["team_number"]
+
+        if rebuild_teams:
+            team_tims = {team: {} for team in rebuild_teams}
+            for collection in self.watched_collections:
+                for tim in self.server.db.find(
+                    collection, {"team_number": {"$in": list(rebuild_teams)}}
+                ):
+                    team_tims[tim["team_number"]].setdefault(collection, []).append(tim)
+            self.rebuild_team_aggregates(team_tims)
+        return list({tim["team_number"] for _, tim in inserted_tims} | rebuild_teams)
+
+    def calculate_running_team_data(self, team: str, ss_tims: List[Dict]) -> dict:
+        """Calculates a team's data from its running aggregates and last matches windows"""
+        aggregates = self.team_aggregates[team]
+        action_stats = aggregates["action_stats"]
+        scopes = {
+            None: {
+                "action_values": action_stats,
+                "action_categories": aggregates["action_categories"],
+                "time_left_to_climb": aggregates["time_left_to_climb"],
+                "counts": aggregates["counts"],
+                "ss_tims": ss_tims,
+                "total_incap_time": action_stats["incap_time"].sum,
+            }
+        }
+        for prefix, windows in aggregates["last_matches"].items():
+            obj_window, subj_window = windows["obj_tim"], windows["subj_tim"]
+            num_matches = self.LAST_MATCHES[prefix]
+            scopes[prefix] = {
+                "action_values": obj_window.stats,
+                "action_categories": obj_window.get_categories(),
+                "time_left_to_climb": subj_window.stats["time_left_to_climb"],
+                "obj_tims": obj_window.get_tims(),
+                "subj_tims": subj_window.get_tims(),
+                # ss_tim isn't watched, so it doesn't have a window
+                "ss_tims": sorted(ss_tims, key=lambda tim: tim["match_number"])[-num_matches:]
+                if num_matches > 0
+                else [],
+                "total_incap_time": obj_window.stats["incap_time"].sum,
+            }
+        return self.calculate_team_data(team, scopes)
 
     def run(self):
         """Executes the OBJ Team calculations"""
         # Get calc start time
         start_time = time.time()
-        teams = []
-        # Filter out teams that are in subj_tim but not obj_tim
-        for team in self.get_updated_teams():
-            if self.server.db.find("obj_tim", {"team_number": team}):
-                teams.append(team)
         # Delete and re-insert if updating all data
         if self.calc_all_data:
             self.server.db.delete_data("obj_team")
+            # Calculate every team at once, running aggregates are loaded again as TIMs are added
+            self.team_aggregates = {}
+            self.tim_teams = {}
+            if obj_team_updates := self.update_all_team_calcs():
+                self.server.db.insert_documents("obj_team", obj_team_updates)
+            self.update_timestamp()
+        else:
+            entries = self.entries_since_last()
+            teams = self.update_team_aggregates(entries)
+            # Only read each oplog entry once, since inserted TIMs are added to the aggregates
+            if entries:
+                self.timestamp = max(entry["ts"] for entry in entries)
+            # Filter out teams that are in subj_tim but not obj_tim
+            teams = [team for team in teams if self.team_aggregates[team]["obj_tims"]]
+            # ss_tim isn't watched, so it is always loaded from the database
+            team_ss_tims = {team: [] for team in teams}
+            for ss_tim in self.server.db.find("ss_tim", {"team_number": {"$in": teams}}):
+                team_ss_tims[ss_tim["team_number"]].append(ss_tim)
 
-        for update in self.update_team_calcs(teams):
-            self.server.db.update_document(
-                "obj_team", update, {"team_number": update["team_number"]}
-            )
+            for team in teams:
+                update = self.calculate_running_team_data(team, team_ss_tims[team])
+                self.server.db.update_document(
+                    "obj_team", update, {"team_number": update["team_number"]}
+                )
         end_time = time.time()
         # Get total calc time
         total_time = end_time - start_time
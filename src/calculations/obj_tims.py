@@ -4,9 +4,10 @@
 
 import copy
 import statistics
+import numpy as np
 import utils
 from calculations.base_calculations import BaseCalculations
-from typing import List, Union, Dict
+from typing import List, Optional, Union, Dict
 import logging
 from data_transfer import tba_communicator
 import time
@@ -19,11 +20,131 @@ log.addHandler(server_log)
 class ObjTIMCalcs(BaseCalculations):
     schema = utils.read_schema("schema/calc_obj_tim_schema.yml")
     type_check_dict = {"float": float, "int": int, "str": str, "bool": bool}
+    # Stage fields checked for harmony, "O" means onstage
+    HARMONY_STAGES = ["stage_level_left", "stage_level_right", "stage_level_center"]
 
     def __init__(self, server):
         super().__init__(server)
         self.watched_collections = ["unconsolidated_obj_tim"]
 
+    @staticmethod
+    def stack_scout_arrays(arrays: List[List[List[Union[int, float]]]]) -> np.ndarray:
+        """Stacks (scouts x datapoints) arrays of several TIMs into one (TIMs x scouts x datapoints)
+        array, padding TIMs that have fewer scouts with NaN (no report)"""
+        arrays = [np.asarray(array, dtype=float) for array in arrays]
+        max_scouts = max([array.shape[0] for array in arrays], default=0)
+        datapoints = max([array.shape[1] for array in arrays if array.ndim == 2], default=0)
+        stacked = np.full((len(arrays), max_scouts, datapoints), np.nan)
+        for index, array in enumerate(arrays):
+            stacked[index, : array.shape[0]] = array.reshape(array.shape[0], datapoints)
+        return stacked
+
+    @staticmethod
+    def get_scout_modes(values: np.ndarray) -> np.ndarray:
+        """Given a (..., scouts, datapoints) array, returns a mask of the same shape that marks one
+        scout for each distinct most frequently reported value of every datapoint. NaN is ignored"""
+        # agree[..., i, j, d] is True when scouts i and j reported the same value for datapoint d
+        agree = values[..., :, None, :] == values[..., None, :, :]
+        frequencies = agree.sum(axis=-2)
+        # Only mark the first scout that reported each value, so each mode is counted once
+        earlier_scouts = np.tril(np.ones((values.shape[-2],) * 2, dtype=bool), -1)[..., None]
+        first_report = ~(agree & earlier_scouts).any(axis=-2)
+        max_frequencies = frequencies.max(axis=-2, initial=0, keepdims=True)
+        return ~np.isnan(values) & first_report & (frequencies == max_frequencies)
+
+    def consolidate_num_arrays(self, nums: np.ndarray, decimal=False) -> np.ndarray:
+        """Consolidates every datapoint at once, given a (scouts x datapoints) array for one TIM or
+        a (TIMs x scouts x datapoints) array for a batch of TIMs. NaN means the scout didn't report.
+
+        Uses the same rules as consolidate_nums: the mean if a scout reported it, otherwise the
+        mean of the modes if a scout reported that, otherwise the weighted average of the modes
+        """
+        nums = np.asarray(nums, dtype=float)
+        reported = ~np.isnan(nums)
+        num_reported = reported.sum(axis=-2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.where(reported, nums, 0).sum(axis=-2) / num_reported
+            mean_reported = (nums == mean[..., None, :]).any(axis=-2)
+            # If two or more scouts agree, automatically go with what they say
+            # When no scouts agree, every reported value is a mode
+            is_mode = self.get_scout_modes(nums)
+            modes = np.where(is_mode, nums, 0)
+            num_modes = is_mode.sum(axis=-2)
+            mode_mean = modes.sum(axis=-2) / num_modes
+            mode_mean_reported = (is_mode & (nums == mode_mean[..., None, :])).any(axis=-2)
+            # Population standard deviation of the modes
+            deviations = np.where(is_mode, nums - mode_mean[..., None, :], 0)
+            std_dev = np.sqrt((deviations**2).sum(axis=-2) / num_modes)
+            # Calculate weighted average, where the weight for each num is its reciprocal square z-score
+            # That way, we account less for data farther from the mean
+            z_scores = deviations / std_dev[..., None, :]
+            weights = np.where(is_mode, 1 / z_scores**2, 0)
+            weighted_mean = (weights * modes).sum(axis=-2) / weights.sum(axis=-2)
+        consolidated = np.select(
+            [num_reported == 0, mean_reported, mode_mean_reported],
+            [0, mean, mode_mean],
+            weighted_mean,
+        )
+        # Weighted averages are summed in a different order than consolidate_nums used to, which
+        # only matters for rounding when they are close to a tie, so recalculate those one at a time
+        scale = 100 if decimal else 1
+        near_tie = (
+            (num_reported > 0)
+            & ~mean_reported
+            & ~mode_mean_reported
+            & (np.abs(np.abs(consolidated * scale) % 1 - 0.5) < 1e-6)
+        )
+        for index in zip(*np.nonzero(near_tie)):
+            column = index[:-1] + (slice(None), index[-1])
+            consolidated[index] = self.weighted_avg(nums[column][is_mode[column]].tolist())
+        if decimal:
+            # np.round can round halves differently from round() because of float representation
+            rounded = [round(value, 2) for value in consolidated.ravel().tolist()]
+            return np.array(rounded).reshape(consolidated.shape)
+        return np.rint(consolidated).astype(int)
+
+    def weighted_avg(self, nums: List[float]) -> float:
+        """Calculates the weighted average of numbers that no scouts agree on, one number at a time,
+        where the weight for each num is its reciprocal square z-score"""
+        mean = self.avg(nums)
+        # Population standard deviation:
+        std_dev = statistics.pstdev(nums)
+        z_scores = [(num - mean) / std_dev for num in nums]
+        weights = [1 / z**2 for z in z_scores]
+        return self.avg(nums, weights)
+
+    def consolidate_bool_arrays(self, bools: np.ndarray) -> np.ndarray:
+        """Consolidates every boolean datapoint at once, given a (scouts x datapoints) or a
+        (TIMs x scouts x datapoints) array. Goes with the majority, and False if scouts are split"""
+        bools = np.asarray(bools, dtype=bool)
+        num_true = bools.sum(axis=-2)
+        return num_true > bools.shape[-2] - num_true
+
+    def consolidate_category_arrays(self, indexes: np.ndarray) -> np.ndarray:
+        """Consolidates every categorical datapoint at once, given a (scouts x datapoints) or a
+        (TIMs x scouts x datapoints) array of indexes into each category's list of actions.
+        NaN means the scout's action wasn't in the list. Returns the consolidated indexes."""
+        indexes = np.asarray(indexes, dtype=float)
+        reported = ~np.isnan(indexes)
+        is_mode = self.get_scout_modes(indexes)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # If at least 2 scouts agree, take their answer, otherwise round the average index
+            index_avg = np.where(reported, indexes, 0).sum(axis=-2) / reported.sum(axis=-2)
+            consolidated = np.where(
+                is_mode.sum(axis=-2) == 1,
+                np.where(is_mode, indexes, 0).sum(axis=-2),
+                np.rint(np.nan_to_num(index_avg)),
+            )
+        return consolidated.astype(int)
+
+    def consolidate_num_dict(self, nums: Dict[str, list], decimal=False) -> dict:
+        """Given a dictionary of datapoints to the numbers reported by each scout,
+        consolidates all of them together and returns a dictionary of datapoints to actual numbers"""
+        if not nums:
+            return {}
+        num_array = np.array(list(nums.values()), dtype=float).reshape(len(nums), -1)
+        return dict(zip(nums.keys(), self.consolidate_num_arrays(num_array.T, decimal).tolist()))
+
     def consolidate_nums(self, nums: List[Union[int, float]], decimal=False) -> int:
         """Given numbers reported by multiple scouts, estimates actual number
         nums is a list of numbers, representing action counts or times, reported by each scout
@@ -31,62 +152,30 @@ class ObjTIMCalcs(BaseCalculations):
         but future improvements might change the algorithm to account for other alliance members,
         since TBA can give us the total action counts for the alliance
         """
-        mean = self.avg(nums)
-        if len(nums) == 0 or mean in nums:
-            # Avoid getting a divide by zero error when calculating standard deviation
-            if decimal:
-                return round(mean, 2)
-            else:
-                return round(mean)
-        # If two or more scouts agree, automatically go with what they say
-        if len(nums) > len(set(nums)):
-            # Still need to consolidate, in case there are multiple modes
-            return self.consolidate_nums(self.modes(nums), decimal)
-        # Population standard deviation:
-        std_dev = statistics.pstdev(nums)
-        # Calculate weighted average, where the weight for each num is its reciprocal square z-score
-        # That way, we account less for data farther from the mean
-        z_scores = [(num - mean) / std_dev for num in nums]
-        weights = [1 / z**2 for z in z_scores]
-        float_nums = self.avg(nums, weights)
-        if decimal:
-            return round(float_nums, 2)
-        return round(float_nums)
+        return self.consolidate_num_dict({"nums": nums}, decimal)["nums"]
 
     def consolidate_bools(self, bools: list) -> bool:
         """Given a list of booleans reported by multiple scouts, returns the actual value"""
-        bools = self.modes(bools)
-        if len(bools) == 1:
-            # Go with the majority
-            return bools[0]
-        # Scouts are evenly split, so just go with False
-        return False
+        return bool(self.consolidate_bool_arrays(np.array(bools, dtype=bool).reshape(-1, 1))[0])
 
     def consolidate_categorical_actions(self, unconsolidated_tims: List[Dict]):
         """Given string type obj_tims, return actual string"""
-        # Dictionary for final calculated tims
-        final_categorical_actions = {}
-        for category in self.schema["categorical_actions"]:
-            scout_categorical_actions = [scout[category] for scout in unconsolidated_tims]
-            # Enums for associated category actions and shortened representation
-            actions = self.schema["categorical_actions"][category]["list"]
-            # Turn the shortened categorical actions from the scout into full strings
-            categorical_actions = []
-            for action in scout_categorical_actions:
-                for value in actions:
-                    if value == action:
-                        categorical_actions.append(value)
-                        break
-            # If at least 2 scouts agree, take their answer
-            if len(self.modes(categorical_actions)) == 1:
-                final_categorical_actions[category] = self.modes(categorical_actions)[0]
-                continue
-
-            # Add up the indexes of the scout responses
-            category_avg = self.avg([list(actions).index(value) for value in categorical_actions])
-            # Round the average and append the correct action to the final dict
-            final_categorical_actions[category] = list(actions)[round(category_avg)]
-        return final_categorical_actions
+        categories = list(self.schema["categorical_actions"].keys())
+        # Enums for associated category actions
+        actions = [
+            list(self.schema["categorical_actions"][category]["list"]) for category in categories
+        ]
+        # Turn each scout's categorical actions into indexes in the list of actions
+        indexes = np.full((len(unconsolidated_tims), len(categories)), np.nan)
+        for scout, tim in enumerate(unconsolidated_tims):
+            for category_num, category in enumerate(categories):
+                if tim[category] in actions[category_num]:
+                    indexes[scout, category_num] = actions[category_num].index(tim[category])
+        consolidated_indexes = self.consolidate_category_arrays(indexes).tolist()
+        return {
+            category: actions[category_num][consolidated_indexes[category_num]]
+            for category_num, category in enumerate(categories)
+        }
 
     def filter_timeline_actions(self, tim: dict, **filters) -> list:
         """Removes timeline actions that don't meet the filters and returns all the actions that do"""
@@ -326,12 +415,9 @@ class ObjTIMCalcs(BaseCalculations):
                     cycles[field] = num_cycles
             totals.append(cycles)
         # Consolidate the values from each tim to produce one number
-        for key in list(totals[0].keys()):
-            unconsolidated_values = []
-            for tim in totals:
-                unconsolidated_values.append(tim[key])
-            # Set decimal to True, so it returns a float
-            calculated_tim[key] = self.consolidate_nums(unconsolidated_values, True)
+        unconsolidated_values = {key: [tim[key] for tim in totals] for key in totals[0].keys()}
+        # Set decimal to True, so it returns a float
+        calculated_tim.update(self.consolidate_num_dict(unconsolidated_values, True))
         return calculated_tim
 
     def score_fail_type(self, unconsolidated_tims: List[Dict]):
@@ -352,10 +438,10 @@ class ObjTIMCalcs(BaseCalculations):
 
     def calculate_tim_counts(self, unconsolidated_tims: List[Dict]) -> dict:
         """Given a list of unconsolidated TIMs, returns the calculated count based data fields"""
-        calculated_tim = {}
+        unconsolidated_counts = {}
         self.score_fail_type(unconsolidated_tims)
         for calculation, filters in self.schema["timeline_counts"].items():
-            unconsolidated_counts = []
+            unconsolidated_counts[calculation] = []
             # Variable type of a calculation is in the schema, but it's not a filter
             filters_ = copy.deepcopy(filters)
             expected_type = filters_.pop("type")
@@ -415,15 +501,15 @@ class ObjTIMCalcs(BaseCalculations):
                             new_count = tim["override"][calculation]
                 if not isinstance(new_count, self.type_check_dict[expected_type]):
                     raise TypeError(f"Expected {new_count} calculation to be a {expected_type}")
-                unconsolidated_counts.append(new_count)
-            calculated_tim[calculation] = self.consolidate_nums(unconsolidated_counts)
-        return calculated_tim
+                unconsolidated_counts[calculation].append(new_count)
+        # Consolidate every count at once
+        return self.consolidate_num_dict(unconsolidated_counts)
 
     def calculate_tim_times(self, unconsolidated_tims: List[Dict]) -> dict:
         """Given a list of unconsolidated TIMs, returns the calculated time data fields"""
-        calculated_tim = {}
+        unconsolidated_cycle_times = {}
         for calculation, action_types in self.schema["timeline_cycle_time"].items():
-            unconsolidated_cycle_times = []
+            unconsolidated_cycle_times[calculation] = []
             # Variable type of a calculation is in the schema, but it's not a filter
             filters_ = copy.deepcopy(action_types)
             expected_type = filters_.pop("type")
@@ -440,9 +526,8 @@ class ObjTIMCalcs(BaseCalculations):
                     raise TypeError(
                         f"Expected {new_cycle_time} calculation to be a {expected_type}"
                     )
-                unconsolidated_cycle_times.append(new_cycle_time)
-            calculated_tim[calculation] = self.consolidate_nums(unconsolidated_cycle_times)
-        return calculated_tim
+                unconsolidated_cycle_times[calculation].append(new_cycle_time)
+        return self.consolidate_num_dict(unconsolidated_cycle_times)
 
     def calculate_aggregates(self, calculated_tim: List[Dict]):
         """Given a list of consolidated tims by calculate_tim_counts, return consolidated aggregates"""
@@ -465,21 +550,20 @@ class ObjTIMCalcs(BaseCalculations):
 
     def calculate_pre_consolidation_aggregates(self, unconsolidated_tims: List[Dict]):
         """Given a list of unconsolidated tims, return unconsolidated aggregates"""
-        final_aggregates = {}
+        totals = {}
 
         # initilize the list
         for aggregate, filters in self.schema["pre_consolidated_aggregates"].items():
-            totals = []
+            totals[aggregate] = []
             aggregate_counts = filters["counts"]
             # Add up all the counts for each aggregate and add them to the totals dictionary
             for tim in unconsolidated_tims:
                 scout_totals = 0
                 for count in aggregate_counts:
                     scout_totals += tim[count] if count in tim else 0
-                totals.append(scout_totals)
-            # Consolidate numbers from all 3 scouts
-            final_aggregates[aggregate] = self.consolidate_nums(totals)
-        return final_aggregates
+                totals[aggregate].append(scout_totals)
+        # Consolidate numbers from all 3 scouts
+        return self.consolidate_num_dict(totals)
 
     def calculate_point_values(self, calculated_tim: List[Dict]):
         """Given a list of consolidated tims by calculate_tim_counts, return consolidated point values"""
@@ -507,56 +591,61 @@ class ObjTIMCalcs(BaseCalculations):
             final_points[point_datapoint_section] = total_points
         return final_points
 
-    def calculate_harmony(self, calculated_tims: List[Dict]):
-        """Given a list of calculated TIMs, returns a list of team and match numbers of the teams that harmonized"""
+    def calculate_harmony(
+        self, calculated_tims: List[Dict], partner_tims: Optional[List[Dict]] = None
+    ):
+        """Given a list of calculated TIMs, returns a list of team and match numbers of the teams that harmonized
+
+        partner_tims are already stored obj_tims of alliance partners that were not recalculated,
+        they count towards a harmony but are not included in the returned list
+        """
+        if partner_tims is None:
+            partner_tims = []
+        # Group onstage teams by (match_number, alliance_color_is_red), then by stage
+        onstage_teams = {}
+        for tim in calculated_tims + partner_tims:
+            if tim == {}:
+                continue
+            alliance = onstage_teams.setdefault(
+                (tim["match_number"], tim["alliance_color_is_red"]), {}
+            )
+            for stage in self.HARMONY_STAGES:
+                if tim.get(stage) == "O":
+                    alliance.setdefault(stage, set()).add(tim["team_number"])
         harmonized_teams = []
-        for tim1 in calculated_tims:
-            if calculated_tims == [{}]:
-                break
-            else:
-                if "O" in [
-                    tim1["stage_level_left"],
-                    tim1["stage_level_right"],
-                    tim1["stage_level_center"],
-                ]:
-                    for tim2 in calculated_tims:
-                        if (
-                            tim1["match_number"] == tim2["match_number"]
-                            and tim1["alliance_color_is_red"] == tim2["alliance_color_is_red"]
-                            and tim1["team_number"] != tim2["team_number"]
-                        ):
-                            if (
-                                tim1["stage_level_left"] == tim2["stage_level_left"]
-                                and tim1["stage_level_left"] == "O"
-                            ):
-                                harmonized_teams.append(
-                                    {
-                                        "team_number": tim1["team_number"],
-                                        "match_number": tim1["match_number"],
-                                    }
-                                )
-                            elif (
-                                tim1["stage_level_right"] == tim2["stage_level_right"]
-                                and tim1["stage_level_right"] == "O"
-                            ):
-                                harmonized_teams.append(
-                                    {
-                                        "team_number": tim1["team_number"],
-                                        "match_number": tim1["match_number"],
-                                    }
-                                )
-                            elif (
-                                tim1["stage_level_center"] == tim2["stage_level_center"]
-                                and tim1["stage_level_center"] == "O"
-                            ):
-                                harmonized_teams.append(
-                                    {
-                                        "team_number": tim1["team_number"],
-                                        "match_number": tim1["match_number"],
-                                    }
-                                )
+        for tim in calculated_tims:
+            if tim == {}:
+                continue
+            alliance = onstage_teams[(tim["match_number"], tim["alliance_color_is_red"])]
+            # A team harmonized if at least one partner is onstage on the same stage
+            if any(tim[stage] == "O" and len(alliance[stage]) > 1 for stage in self.HARMONY_STAGES):
+                harmonized_teams.append(
+                    {"team_number": tim["team_number"], "match_number": tim["match_number"]}
+                )
         return harmonized_teams
 
+    def get_harmony_partner_tims(self, calculated_tims: List[Dict]) -> List[Dict]:
+        """Returns the stored obj_tims of alliance partners of the calculated TIMs that were not
+        recalculated this cycle, so a harmony with an unchanged partner isn't missed"""
+        calculated_alliances = {}
+        for tim in calculated_tims:
+            if tim == {}:
+                continue
+            calculated_alliances.setdefault(
+                (tim["match_number"], tim["alliance_color_is_red"]), set()
+            ).add(tim["team_number"])
+        partner_tims = []
+        for (match_number, is_red), teams in calculated_alliances.items():
+            # All three robots on the alliance were recalculated, no need to query
+            if len(teams) >= 3:
+                continue
+            for partner_tim in self.server.db.find(
+                "obj_tim", {"match_number": match_number, "alliance_color_is_red": is_red}
+            ):
+                if partner_tim["team_number"] not in teams:
+                    partner_tims.append(partner_tim)
+        return partner_tims
+
     def calculate_scored_preload(self, unconsolidated_tims: List[Dict]):
         """Given a list of unconsolidated TIMS, returns whether or not the team scored their preload"""
         unconsolidated_preloads = []
@@ -597,25 +686,44 @@ class ObjTIMCalcs(BaseCalculations):
 
     def update_calcs(self, tims: List[Dict[str, Union[str, int]]]) -> List[dict]:
         """Calculate data for each of the given TIMs. Those TIMs are represented as dictionaries:
-        {'team_number': '1678', 'match_number': 69}"""
+        {'team_number': '1678', 'match_number': 69}
+
+        Also returns {'team_number', 'match_number', 'harmonized'} updates for stored alliance
+        partners whose harmony changed because of the newly calculated TIMs"""
         calculated_tims = []
         for tim in tims:
             unconsolidated_obj_tims = self.server.db.find("unconsolidated_obj_tim", tim)
             unconsolidated_totals = self.server.db.find("unconsolidated_totals", tim)
             calculated_tim = self.calculate_tim(unconsolidated_obj_tims, unconsolidated_totals)
             calculated_tims.append(calculated_tim)
-        harmonized_teams = self.calculate_harmony(calculated_tims)
+        # All obj_tims are recalculated when calculating all data, so there are no stored partners
+        partner_tims = [] if self.calc_all_data else self.get_harmony_partner_tims(calculated_tims)
+        harmonized_teams = {
+            (tim["team_number"], tim["match_number"])
+            for tim in self.calculate_harmony(calculated_tims, partner_tims)
+        }
         for tim in calculated_tims:
             if tim == {}:
                 continue
-            else:
-                if {
-                    "team_number": tim["team_number"],
-                    "match_number": tim["match_number"],
-                } in harmonized_teams:
-                    tim["harmonized"] = True
-                else:
-                    tim["harmonized"] = False
+            tim["harmonized"] = (tim["team_number"], tim["match_number"]) in harmonized_teams
+        # Stored partners can harmonize with a newly calculated TIM, so update their harmony too
+        partner_harmony = {
+            (tim["team_number"], tim["match_number"])
+            for tim in self.calculate_harmony(partner_tims, calculated_tims)
+        }
+        for partner_tim in partner_tims:
+            harmonized = (
+                partner_tim["team_number"],
+                partner_tim["match_number"],
+            ) in partner_harmony
+            if partner_tim.get("harmonized") != harmonized:
+                calculated_tims.append(
+                    {
+                        "team_number": partner_tim["team_number"],
+                        "match_number": partner_tim["match_number"],
+                        "harmonized": harmonized,
+                    }
+                )
         return calculated_tims
 
     def run(self):
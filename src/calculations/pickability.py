@@ -2,6 +2,8 @@ from calculations import base_calculations
 import utils
 import logging
 import time
+import numpy as np
+from typing import Dict, List, Optional, Tuple
 
 log = logging.getLogger(__name__)
 server_log = logging.FileHandler("server.log")
@@ -15,6 +17,11 @@ class PickabilityCalc(base_calculations.BaseCalculations):
         super().__init__(server)
         self.pickability_schema = utils.read_schema("schema/calc_pickability_schema.yml")
         self.get_watched_collections()
+        # The schema only needs to be read once, each pickability is a column of coefficients
+        self.calc_names = list(self.pickability_schema["calculations"])
+        self.features, self.coefficients, self.feature_uses = self.compile_calculations(
+            self.pickability_schema["calculations"]
+        )
 
     def get_watched_collections(self):
         """Reads from the schema file to generate the correct watched collections"""
@@ -24,6 +31,80 @@ class PickabilityCalc(base_calculations.BaseCalculations):
                 if "." in sub_calc:
                     self.watched_collections.add(sub_calc.split(".")[0])
 
+    @staticmethod
+    def compile_calculations(
+        calculations: Dict[str, dict]
+    ) -> Tuple[List[Tuple[str, ...]], np.ndarray, np.ndarray]:
+        """Compiles pickability weights in the format of calc_pickability_schema.yml
+
+        calculations is a dictionary of calculation names to their weights
+        Returns the features, which are tuples of datapoints (such as 'obj_team.x') to multiply,
+        a matrix of the coefficient of each feature (row) in each calculation (column),
+        and a matrix of which features each calculation uses
+        """
+        # Feature to the coefficient of that feature in each calculation
+        feature_coefficients = {}
+        for index, weights in enumerate(calculations.values()):
+            for calc, weighted_value in weights.items():
+                # Ignore 'type' in schema
+                if "." not in calc:
+                    continue
+                # Turn the key and weights into a list to take the product of
+                calcs = [calc] + (
+                    weighted_value if isinstance(weighted_value, list) else [weighted_value]
+                )
+                coefficient = 1
+                for c in calcs:
+                    if not isinstance(c, str):
+                        coefficient *= c
+                feature = tuple(sorted(c for c in calcs if isinstance(c, str)))
+                feature_coefficients.setdefault(feature, [[0, False] for _ in calculations])
+                feature_coefficients[feature][index][0] += coefficient
+                feature_coefficients[feature][index][1] = True
+        features = list(feature_coefficients.keys())
+        coefficients = np.array(
+            [[coefficient for coefficient, _ in feature_coefficients[f]] for f in features],
+            dtype=float,
+        ).reshape(len(features), len(calculations))
+        uses = np.array(
+            [[used for _, used in feature_coefficients[f]] for f in features], dtype=bool
+        ).reshape(len(features), len(calculations))
+        return features, coefficients, uses
+
+    @staticmethod
+    def get_feature_matrix(
+        team_datas: List[Dict[str, dict]], features: List[Tuple[str, ...]]
+    ) -> np.ndarray:
+        """Returns a matrix of the value of each feature (column) for each team (row)
+
+        team_datas has each team's documents by collection, features that need a missing datapoint
+        are NaN
+        """
+        matrix = np.ones((len(team_datas), len(features)))
+        for row, team_data in enumerate(team_datas):
+            for column, feature in enumerate(features):
+                for c in feature:
+                    collection, datapoint = c.split(".")
+                    if not (collection in team_data and datapoint in team_data[collection]):
+                        matrix[row, column] = np.nan
+                        break
+                    matrix[row, column] *= team_data[collection][datapoint]
+        return matrix
+
+    @staticmethod
+    def evaluate(
+        feature_matrix: np.ndarray, coefficients: np.ndarray, uses: np.ndarray
+    ) -> np.ndarray:
+        """Calculates every pickability of every team with one matrix multiply
+
+        Returns a matrix with a row for each team and a column for each calculation,
+        where NaN means the team is missing data for that calculation
+        """
+        missing = np.isnan(feature_matrix)
+        results = np.nan_to_num(feature_matrix, nan=0) @ coefficients
+        results[(missing.astype(int) @ uses.astype(int)) > 0] = np.nan
+        return results
+
     def calculate_pickability(self, calc_name: str, team_data: dict) -> float:
         """Calculates first and second pickability
 
@@ -31,49 +112,73 @@ class PickabilityCalc(base_calculations.BaseCalculations):
         team_data is the data required to perform the weighted sum
         returns the weighted sum
         """
-        weighted_sum = 0
-        for calc, weighted_value in self.pickability_schema["calculations"][
-            calc_name
-        ].items():  # Datapoints of first or second pickability
-            # Turn the key and weights into a list to take the product of
-            if isinstance(weighted_value, list):
-                calcs = [calc] + weighted_value
-            else:
-                calcs = [calc, weighted_value]
-            for c in calcs:
-                if isinstance(c, str) and "." not in calc:  # Ignore 'type' in schema
-                    break
-            else:
-                # Find the product of the key and weights
-                product = 1
-                for c in calcs:
-                    if not isinstance(c, str):
-                        product *= c
-                        continue
-                    collection, datapoint = c.split(".")
-                    if not (collection in team_data and datapoint in team_data[collection]):
-                        return  # Can't calculate this pickability
-                    product *= team_data[collection][datapoint]
-                weighted_sum += product
-        return weighted_sum
+        result = self.evaluate(
+            self.get_feature_matrix([team_data], self.features),
+            self.coefficients,
+            self.feature_uses,
+        )[0, self.calc_names.index(calc_name)]
+        if np.isnan(result):
+            return  # Can't calculate this pickability
+        return result.item()
+
+    def load_team_data(self, teams: Optional[List[str]] = None) -> Dict[str, Dict[str, dict]]:
+        """Loads the documents of each team in the watched collections, with one query per
+        collection. Loads every team if teams isn't given"""
+        query = {} if teams is None else {"team_number": {"$in": list(teams)}}
+        team_data = {team: {} for team in teams or []}
+        for collection in self.watched_collections:
+            for document in self.server.db.find(collection, query):
+                # Only use the first document of each team, the same as finding each team
+                team_data.setdefault(document["team_number"], {}).setdefault(collection, document)
+        return team_data
+
+    def sweep_pickability(
+        self, calculations: Dict[str, dict], team_data: Optional[Dict[str, Dict[str, dict]]] = None
+    ) -> Dict[str, Dict[str, Optional[float]]]:
+        """Evaluates many sets of pickability weights at once, such as when trying out weights
+        during alliance selection
+
+        calculations is a dictionary of names to weights in the format of
+        calc_pickability_schema.yml, team_data is loaded from the database if not given
+        Returns a dictionary of team numbers to the value of each calculation, or None if the team
+        is missing data for it
+        """
+        if team_data is None:
+            team_data = self.load_team_data()
+        features, coefficients, uses = self.compile_calculations(calculations)
+        teams = list(team_data.keys())
+        results = self.evaluate(
+            self.get_feature_matrix([team_data[team] for team in teams], features),
+            coefficients,
+            uses,
+        )
+        return {
+            team: {
+                calc_name: (None if np.isnan(value) else value)
+                for calc_name, value in zip(calculations, row)
+            }
+            for team, row in zip(teams, results.tolist())
+        }
 
     def update_pickability(self):
         """Creates updated pickability documents"""
         updates = []
-        for team in self.get_updated_teams():
-            # Data that is needed to calculate pickability
-            team_data = {}
-            # Get each calc name and search for it in the database
-            for collection in self.watched_collections:
-                if query := self.server.db.find(collection, {"team_number": team}):
-                    team_data[collection] = query[0]
+        teams = self.get_updated_teams()
+        # Data that is needed to calculate pickability
+        team_data = self.load_team_data(teams)
+        results = self.evaluate(
+            self.get_feature_matrix([team_data[team] for team in teams], self.features),
+            self.coefficients,
+            self.feature_uses,
+        )
+        for team, row in zip(teams, results.tolist()):
             update = {"team_number": team}
-            for calc_name in self.pickability_schema["calculations"]:
-                value = self.calculate_pickability(calc_name, team_data)
-                if value is None:
+            for calc_name, value in zip(self.calc_names, row):
+                if np.isnan(value):
                     log.error(f"{calc_name} could not be calculated for team: {team}")
                     continue
                 update[calc_name] = value
+            if len(update) > 1:
                 updates.append(update)
         return updates
 
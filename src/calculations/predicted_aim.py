@@ -2,13 +2,18 @@
 """Makes predictive calculations for alliances in matches in a competition."""
 
 import utils
+import itertools
 import numpy as np
+from scipy import special
 from statistics import NormalDist as Norm
+from typing import Dict, List, Optional, Tuple
 from calculations.base_calculations import BaseCalculations
+from calculations.match_simulator import MatchSimulator
 from data_transfer import tba_communicator
 import logging
 import time
 import pandas as pd
+import pymongo
 import statsmodels.api as sm
 
 log = logging.getLogger(__name__)
@@ -38,6 +43,29 @@ class PredictedAimScores:
 
 class PredictedAimCalc(BaseCalculations):
     schema = utils.read_schema("schema/calc_predicted_aim_schema.yml")
+    # Fields of PredictedAimScores in the order calc_alliance_score adds them,
+    # and the obj_team datapoints each team adds to them
+    SCORE_FIELDS = {
+        "auto_speaker": ["auto_avg_speaker"],
+        "auto_amp": ["auto_avg_amp"],
+        "tele_speaker": ["tele_avg_unamplified_speaker"],
+        "tele_speaker_all": ["tele_avg_unamplified_speaker", "tele_avg_amplified"],
+        "tele_amplified": ["tele_avg_amplified"],
+        "tele_amp": ["tele_avg_amp"],
+        "num_park": ["parked_percent"],
+        "num_onstage": ["stage_percent_success_all"],
+        "num_trap": ["trap_percent_success"],
+    }
+    # Probability cutoff for a team to be considered capable of an endgame action
+    ENDGAME_CUTOFF = 0.75
+    # Settings for simulating matches, bootstrap samples teams from their obj_tims
+    SIMULATION = {
+        "num_simulations": 2000,
+        "seed": 1678,
+        "bootstrap": False,
+        "num_brackets": 5000,
+        **schema.get("--simulation", {}),
+    }
 
     POINT_VALUES = {
         "auto_amp": 2,
@@ -55,6 +83,26 @@ class PredictedAimCalc(BaseCalculations):
     def __init__(self, server):
         super().__init__(server)
         self.watched_collections = ["obj_team", "tba_team"]
+        # Endgame score for each number of teams that can climb, climb after, trap and park
+        self.stage_scores = np.array(
+            [
+                [
+                    [
+                        [self.get_stage_score(climb, climb_after, trap, park) for park in range(4)]
+                        for trap in range(4)
+                    ]
+                    for climb_after in range(3)
+                ]
+                for climb in range(4)
+            ]
+        )
+        # Feature row of each team, reused until the team's obj_team document changes
+        # Looks like {team_number: (obj_team document, row)}
+        self.team_features = {}
+        # Latest obj_team and tba_team documents of each team, so only updated teams are loaded
+        self.team_documents = {"obj_team": {}, "tba_team": {}}
+        # Last predicted_aim written for each (match_number, alliance_color_is_red)
+        self.written_aims = {}
 
     def calc_alliance_auto_score(self, predicted_values):
         """Calculates the predicted auto score for an alliance.
@@ -120,19 +168,25 @@ class PredictedAimCalc(BaseCalculations):
         # List of dicts containing success rates for each team
         endgame_data = self.get_endgame_fields(obj_team, team_numbers)
 
-        endgame_score = 0
-
-        ## Scuffed formula to predict endgame score ##
-        # Probability cutoff to be considered as capable
-        cutoff = 0.75
         # Number of teams that can do the action
-        num_can_climb = sum([1 for team in endgame_data if team["onstage_rate"] >= cutoff])
+        num_can_climb = sum(
+            [1 for team in endgame_data if team["onstage_rate"] >= self.ENDGAME_CUTOFF]
+        )
         num_can_climb_after = sum(
-            [1 for team in endgame_data if team["climb_after_rate"] >= cutoff]
+            [1 for team in endgame_data if team["climb_after_rate"] >= self.ENDGAME_CUTOFF]
         )
-        num_can_trap = sum([1 for team in endgame_data if team["trap_rate"] >= cutoff])
-        num_can_park = sum([1 for team in endgame_data if team["park_rate"] >= cutoff])
+        num_can_trap = sum([1 for team in endgame_data if team["trap_rate"] >= self.ENDGAME_CUTOFF])
+        num_can_park = sum([1 for team in endgame_data if team["park_rate"] >= self.ENDGAME_CUTOFF])
+
+        return self.get_stage_score(num_can_climb, num_can_climb_after, num_can_trap, num_can_park)
 
+    @staticmethod
+    def get_stage_score(num_can_climb, num_can_climb_after, num_can_trap, num_can_park):
+        """Predicts an alliance's endgame score from the number of teams that can climb,
+        climb after another team, trap and park"""
+        endgame_score = 0
+
+        ## Scuffed formula to predict endgame score ##
         if num_can_climb_after > 2:
             num_can_climb_after = 2
 
@@ -532,121 +586,387 @@ class PredictedAimCalc(BaseCalculations):
         # Return win chance
         return prob_red_wins
 
-    def update_predicted_aim(self, aims_list):
-        "Updates predicted and actual data with new obj_team and tba_team data"
+    def build_team_features(
+        self, obj_team: List[dict]
+    ) -> Tuple[Dict[str, int], Dict[str, int], np.ndarray]:
+        """Builds a matrix of the datapoints needed to predict alliances, with a row for each team
+
+        Returns a dictionary of team numbers to rows, a dictionary of feature names to columns and
+        the matrix. The last row is all zeros, and is used for teams without obj_team data.
+        Features are each field of PredictedAimScores, avg_expected_notes, the --endgame_fields,
+        and the mean and variance (from the SD datapoints) of the team's score for win chance.
+        """
+        columns = {
+            name: column
+            for column, name in enumerate(
+                list(self.SCORE_FIELDS)
+                + ["avg_expected_notes"]
+                + list(self.schema["--endgame_fields"])
+                + ["win_mean", "win_var"]
+            )
+        }
+        team_indexes = {}
+        for team_data in obj_team:
+            team_indexes.setdefault(team_data["team_number"], len(team_indexes))
+        features = np.zeros((len(team_indexes) + 1, len(columns)))
+        for team_data in obj_team:
+            # Only teams with new obj_team data have their row calculated again
+            cached = self.team_features.get(team_data["team_number"])
+            if cached is None or (cached[0] is not team_data and cached[0] != team_data):
+                cached = (team_data, self.get_team_features(team_data, columns))
+                self.team_features[team_data["team_number"]] = cached
+            features[team_indexes[team_data["team_number"]]] = cached[1]
+        return team_indexes, columns, features
+
+    def get_team_features(self, team_data: dict, columns: Dict[str, int]) -> np.ndarray:
+        """Calculates the feature row of one team from its obj_team data, for build_team_features"""
+        row = np.zeros(len(columns))
+        for field, datapoints in self.SCORE_FIELDS.items():
+            row[columns[field]] = sum(team_data[datapoint] for datapoint in datapoints)
+        row[columns["avg_expected_notes"]] = team_data["avg_expected_notes"]
+        for field, var in self.schema["--endgame_fields"].items():
+            row[columns[field]] = team_data[var["var"]]
+        team_mean = 0
+        team_var = 0
+        for name, attrs in self.schema["--win_chance"].items():
+            team_mean += team_data[name] * attrs["weight"]
+            team_var += (team_data[attrs["sd"]] * attrs["weight"]) ** 2
+        row[columns["win_mean"]] = team_mean
+        row[columns["win_var"]] = team_var
+        return row
+
+    @staticmethod
+    def get_alliance_rows(team_indexes: Dict[str, int], team_lists: List[List[str]]) -> np.ndarray:
+        """Returns the feature rows of the teams in each alliance, teams without data use the last
+        (all zero) row"""
+        missing_row = len(team_indexes)
+        return np.array(
+            [
+                [team_indexes.get(team, missing_row) for team in team_list]
+                for team_list in team_lists
+            ],
+            dtype=int,
+        ).reshape(len(team_lists), -1)
+
+    def predict_alliances(
+        self, columns: Dict[str, int], features: np.ndarray, alliance_rows: np.ndarray
+    ) -> Dict[str, np.ndarray]:
+        """Predicts every alliance at once from the team feature matrix
+
+        alliance_rows has the feature rows of the teams in each alliance, from get_alliance_rows
+        Returns a dictionary of datapoint names to an array with a value for each alliance
+        """
+        predictions = {}
+        # calc_alliance_score adds teams in the order of obj_team, which is the order of the rows
+        ordered_rows = np.sort(alliance_rows, axis=1)
+        for field in self.SCORE_FIELDS:
+            total = np.zeros(len(alliance_rows))
+            for slot in range(ordered_rows.shape[1]):
+                total = total + features[ordered_rows[:, slot], columns[field]]
+            predictions[field] = total
+
+        def alliance_sum(column):
+            total = np.zeros(len(alliance_rows))
+            for slot in range(alliance_rows.shape[1]):
+                total = total + features[alliance_rows[:, slot], columns[column]]
+            return total
+
+        # Same as calc_alliance_auto_score
+        auto_score = (
+            predictions["auto_speaker"] * self.POINT_VALUES["auto_speaker"]
+            + predictions["auto_amp"] * self.POINT_VALUES["auto_amp"]
+        )
+        # Same as calc_alliance_tele_score
+        num_notes = alliance_sum("avg_expected_notes")
+        cycle_time = np.divide(
+            115, num_notes, out=np.full(len(alliance_rows), 150.0), where=num_notes != 0
+        )
+        tele_score = 5 * num_notes - (4 * num_notes) / (cycle_time + 5)
+        # Same as calc_alliance_stage_score, the score for every possible number of capable teams
+        # is looked up in stage_scores
+        capable = {
+            field: (features[alliance_rows, columns[field]] >= self.ENDGAME_CUTOFF).sum(axis=1)
+            for field in ["onstage_rate", "climb_after_rate", "trap_rate", "park_rate"]
+        }
+        stage_score = self.stage_scores[
+            capable["onstage_rate"],
+            np.minimum(capable["climb_after_rate"], 2),
+            capable["trap_rate"],
+            capable["park_rate"],
+        ]
+        predictions["predicted_score"] = auto_score + tele_score + stage_score
+
+        # Same as calc_melody_rp
+        total_gamepieces = (
+            predictions["auto_amp"]
+            + predictions["auto_speaker"]
+            + predictions["tele_amp"]
+            + predictions["tele_speaker"]
+            + predictions["tele_amplified"]
+        )
+        predictions["predicted_rp1"] = np.where(total_gamepieces / 15 > 0.9, 1.0, 0.0)
+
+        # Same as calc_ensemble_rp
+        climb_rates = features[alliance_rows, columns["onstage_rate"]]
+        trap_rates = features[alliance_rows, columns["trap_rate"]]
+        climb_after_rates = features[alliance_rows, columns["climb_after_rate"]]
+        # Trap + 2 climb, one team climbs and a different team traps
+        climb_trap = climb_rates[:, :, None] * trap_rates[:, None, :]
+        different_teams = ~np.eye(alliance_rows.shape[1], dtype=bool)
+        prob_1 = np.where(different_teams, climb_trap, -np.inf).max(axis=(1, 2))
+        # Harmony + climb, two teams climb and the third climbs after
+        prob_2 = np.full(len(alliance_rows), -np.inf)
+        for first, second, after in itertools.permutations(range(alliance_rows.shape[1]), 3):
+            prob_2 = np.maximum(
+                prob_2,
+                climb_rates[:, first] * climb_rates[:, second] * climb_after_rates[:, after],
+            )
+        predictions["predicted_rp2"] = np.where(np.maximum(prob_1, prob_2) >= 0.6, 1.0, 0.0)
+
+        # Mean and variance of each alliance's score, for calc_win_chances
+        predictions["win_mean"] = alliance_sum("win_mean")
+        predictions["win_var"] = alliance_sum("win_var")
+        return predictions
+
+    @staticmethod
+    def calc_win_chances(
+        red_predictions: Dict[str, np.ndarray], blue_predictions: Dict[str, np.ndarray]
+    ) -> np.ndarray:
+        """Calculates the win chances of many RED alliances at once, the same as calc_win_chance
+
+        red_predictions and blue_predictions are from predict_alliances, with the same number of
+        alliances in the same order of matches
+        """
+        mean = red_predictions["win_mean"] - blue_predictions["win_mean"]
+        var = red_predictions["win_var"] + blue_predictions["win_var"]
+        valid = var > 0
+        # Probability of the difference between red and blue being above 0, 1 - phi(0)
+        sd = np.sqrt(np.where(valid, var, 1))
+        prob_red_wins = 1 - 0.5 * (1 + special.erf((0 - mean) / (sd * np.sqrt(2))))
+        if not valid.all():
+            log.critical(
+                f"predicted_aim: {np.count_nonzero(~valid)} matches have an invalid score variance, cannot calculate their win chances"
+            )
+        # Python's round is used to round the same way as calc_win_chance
+        prob_red_wins = np.array([round(prob, 3) for prob in prob_red_wins.tolist()])
+        return np.where(valid, prob_red_wins, np.where(mean > 0, 1, 0))
+
+    def get_aim_pairs(self, aims_list: List[dict]) -> List[Tuple[dict, dict]]:
+        """Pairs the first aim of each match with its opposing alliance, in order of matches"""
+        # Index aims by match so each match is only looked at once
+        aims_by_match = {}
+        for aim in aims_list:
+            aims_by_match.setdefault(aim["match_number"], []).append(aim)
+        aim_pairs = []
+        for match_aims in aims_by_match.values():
+            aim = match_aims[0]
+            # Find opposing alliance
+            other_aims = [other_aim for other_aim in match_aims[1:] if other_aim != aim]
+            if other_aims == []:
+                log.critical(
+                    f"predicted_aim: alliance {aim['team_list']} has no opposing alliance in match {aim['match_number']}"
+                )
+                continue
+            aim_pairs.append((aim, other_aims[0]))
+        return aim_pairs
+
+    def update_predicted_aim(self, aims_list, obj_team=None, tba_team=None):
+        """Updates predicted and actual data with new obj_team and tba_team data
+
+        obj_team and tba_team are loaded from the database if they aren't given"""
         updates = []
-        obj_team = self.server.db.find("obj_team")
-        tba_team = self.server.db.find("tba_team")
+        if obj_team is None:
+            obj_team = self.server.db.find("obj_team")
+        if tba_team is None:
+            tba_team = self.server.db.find("tba_team")
         tba_match_data = tba_communicator.tba_request(f"event/{self.server.TBA_EVENT_KEY}/matches")
         filtered_aims_list = self.filter_aims_list(obj_team, tba_team, aims_list)
 
-        finished_matches = []
-        # Update every aim
-        for aim in filtered_aims_list:
-            if aim["match_number"] not in finished_matches:
-                # Find opposing alliance
-                other_aim = list(
-                    filter(
-                        lambda some_aim: some_aim["match_number"] == aim["match_number"]
-                        and some_aim != aim,
-                        filtered_aims_list,
-                    )
-                )
-                if other_aim != []:
-                    other_aim = other_aim[0]
-                else:
-                    log.critical(
-                        f"predicted_aim: alliance {aim['team_list']} has no opposing alliance in match {aim['match_number']}"
-                    )
-                    continue
+        # Pairs of each aim and its opposing alliance
+        aim_pairs = self.get_aim_pairs(filtered_aims_list)
+        if not aim_pairs:
+            return updates
 
-                # Create updates
+        # Predict every alliance at once
+        team_indexes, columns, features = self.build_team_features(obj_team)
+        aim_predictions, other_aim_predictions = [
+            self.predict_alliances(
+                columns,
+                features,
+                self.get_alliance_rows(
+                    team_indexes, [pair[side]["team_list"] for pair in aim_pairs]
+                ),
+            )
+            for side in [0, 1]
+        ]
+        # Win chances are calculated for the red alliance
+        aim_is_red = np.array([aim["alliance_color"] == "R" for aim, _ in aim_pairs])
+        red_predictions, blue_predictions = [
+            {
+                name: np.where(aim_is_red, predictions[name], other_predictions[name])
+                for name in ["win_mean", "win_var"]
+            }
+            for predictions, other_predictions in [
+                (aim_predictions, other_aim_predictions),
+                (other_aim_predictions, aim_predictions),
+            ]
+        ]
+        red_win_chances = self.calc_win_chances(red_predictions, blue_predictions).tolist()
+
+        aim_predictions = {name: values.tolist() for name, values in aim_predictions.items()}
+        other_aim_predictions = {
+            name: values.tolist() for name, values in other_aim_predictions.items()
+        }
+        for index, (aim, other_aim) in enumerate(aim_pairs):
+            pair_updates = []
+            for pair_aim, predictions in [
+                (aim, aim_predictions),
+                (other_aim, other_aim_predictions),
+            ]:
                 update = {
-                    "match_number": aim["match_number"],
-                    "alliance_color_is_red": aim["alliance_color"] == "R",
-                }
-                other_update = {
-                    "match_number": other_aim["match_number"],
-                    "alliance_color_is_red": other_aim["alliance_color"] == "R",
+                    "match_number": pair_aim["match_number"],
+                    "alliance_color_is_red": pair_aim["alliance_color"] == "R",
                 }
-
-                # Calculate predicted values data classes
-                aim_predicted_values = self.calc_alliance_score(
-                    PredictedAimScores(), obj_team, tba_team, aim["team_list"]
-                )
-                other_aim_predicted_values = self.calc_alliance_score(
-                    PredictedAimScores(), obj_team, tba_team, other_aim["team_list"]
-                )
-
                 # Add gamepieces
-                for action, value in aim_predicted_values.__dict__.items():
-                    update[f"_{action}"] = value
-                for action, value in other_aim_predicted_values.__dict__.items():
-                    other_update[f"_{action}"] = value
-
-                # Calculate predicted scores
-                update["predicted_score"] = (
-                    self.calc_alliance_auto_score(aim_predicted_values)
-                    + self.calc_alliance_tele_score(
-                        aim_predicted_values, obj_team, aim["team_list"]
-                    )
-                    + self.calc_alliance_stage_score(
-                        obj_team, aim["team_list"], aim_predicted_values
-                    )
-                )
+                for action in self.SCORE_FIELDS:
+                    update[f"_{action}"] = predictions[action][index]
+                for name in ["predicted_score", "predicted_rp1", "predicted_rp2"]:
+                    update[name] = predictions[name][index]
+                pair_updates.append(update)
+            update, other_update = pair_updates
+
+            # Calculate win chance
+            if aim["alliance_color"] == "R":
+                update["win_chance"] = red_win_chances[index]
+                other_update["win_chance"] = 1 - update["win_chance"]
+            else:
+                other_update["win_chance"] = red_win_chances[index]
+                update["win_chance"] = 1 - other_update["win_chance"]
 
-                # Other alliance
-                other_update["predicted_score"] = (
-                    self.calc_alliance_auto_score(other_aim_predicted_values)
-                    + self.calc_alliance_tele_score(
-                        other_aim_predicted_values, obj_team, other_aim["team_list"]
-                    )
-                    + self.calc_alliance_stage_score(
-                        obj_team, other_aim["team_list"], other_aim_predicted_values
-                    )
-                )
+            # Calculate actual values
+            update.update(self.get_actual_values(aim, tba_match_data))
+            other_update.update(self.get_actual_values(other_aim, tba_match_data))
 
-                # Calculate RPs
-                update["predicted_rp1"] = self.calc_melody_rp(aim_predicted_values)
-                update["predicted_rp2"] = self.calc_ensemble_rp(obj_team, aim["team_list"])
-                other_update["predicted_rp1"] = self.calc_melody_rp(other_aim_predicted_values)
-                other_update["predicted_rp2"] = self.calc_ensemble_rp(
-                    obj_team, other_aim["team_list"]
-                )
+            # Add aim team list
+            update["team_numbers"] = aim["team_list"]
+            other_update["team_numbers"] = other_aim["team_list"]
 
-                # Calculate win chance
-                if aim["alliance_color"] == "R":
-                    update["win_chance"] = self.calc_win_chance(
-                        obj_team,
-                        {
-                            aim["alliance_color"]: aim["team_list"],
-                            other_aim["alliance_color"]: other_aim["team_list"],
-                        },
-                        aim["match_number"],
-                    )
-                    other_update["win_chance"] = 1 - update["win_chance"]
-                else:
-                    other_update["win_chance"] = self.calc_win_chance(
-                        obj_team,
-                        {
-                            other_aim["alliance_color"]: other_aim["team_list"],
-                            aim["alliance_color"]: aim["team_list"],
-                        },
-                        other_aim["match_number"],
-                    )
-                    update["win_chance"] = 1 - other_update["win_chance"]
+            updates.extend([update, other_update])
+        return updates
 
-                # Calculate actual values
-                update.update(self.get_actual_values(aim, tba_match_data))
-                other_update.update(self.get_actual_values(other_aim, tba_match_data))
+    def get_match_simulator(self, obj_team: Optional[List[dict]] = None) -> MatchSimulator:
+        """Creates a MatchSimulator from the current obj_team (and obj_tim) data"""
+        obj_tims = self.server.db.find("obj_tim") if self.SIMULATION["bootstrap"] else None
+        return MatchSimulator(
+            obj_team if obj_team is not None else self.server.db.find("obj_team"),
+            self.schema["--win_chance"],
+            self.schema["--endgame_fields"],
+            obj_tims,
+            num_simulations=self.SIMULATION["num_simulations"],
+            seed=self.SIMULATION["seed"],
+        )
+
+    def update_simulated_aim(
+        self, predicted_aim_updates: List[dict], obj_team: Optional[List[dict]] = None
+    ) -> List[dict]:
+        """Simulates the matches of predicted_aim updates, and adds the simulated score quantiles,
+        RP chances, win chance and expected RPs of each alliance to its update"""
+        matches = {}
+        for update in predicted_aim_updates:
+            color = "R" if update["alliance_color_is_red"] else "B"
+            matches.setdefault(update["match_number"], {})[color] = update
+        match_numbers = [match_number for match_number, match in matches.items() if len(match) == 2]
+        matches = [matches[match_number] for match_number in match_numbers]
+        if not matches:
+            return predicted_aim_updates
+
+        simulator = self.get_match_simulator(obj_team)
+        # Keyed by match number, so a match is simulated the same way in an incremental run
+        results = simulator.simulate_matches(
+            *[
+                simulator.get_alliance_rows([match[color]["team_numbers"] for match in matches])
+                for color in ["R", "B"]
+            ],
+            match_numbers,
+        )
+        for color, color_results in results.items():
+            color_results = {name: values.tolist() for name, values in color_results.items()}
+            for index, match in enumerate(matches):
+                update = match[color]
+                for quantile, score in zip(
+                    simulator.QUANTILES, color_results["score_quantiles"][index]
+                ):
+                    update[f"simulated_score_p{quantile}"] = score
+                for name in ["rp1_chance", "rp2_chance", "win_chance", "avg_rps"]:
+                    update[f"simulated_{name}"] = color_results[name][index]
+        return predicted_aim_updates
+
+    def calc_playoffs_chances(
+        self, playoffs_alliances: List[dict], simulator: Optional[MatchSimulator] = None
+    ) -> Dict[int, Dict[str, float]]:
+        """Simulates the playoff bracket to find each alliance's chance of reaching each stage
+
+        playoffs_alliances: alliances from get_playoffs_alliances, only alliance numbers 1-8 are in
+        the bracket. Picks can be changed to simulate alliances that haven't been picked yet.
+        Returns a dictionary of alliance numbers to the chances of reaching each round, the finals
+        and winning, or an empty dictionary if there aren't 8 alliances yet
+        """
+        bracket_alliances = {
+            alliance["alliance_num"]: alliance["picks"]
+            for alliance in playoffs_alliances
+            if alliance["alliance_num"] <= 8
+        }
+        if len(bracket_alliances) < 8:
+            return {}
+        if simulator is None:
+            simulator = self.get_match_simulator()
+        stage_chances = simulator.simulate_bracket(
+            simulator.get_alliance_rows(
+                [bracket_alliances[alliance_num] for alliance_num in range(1, 9)]
+            ),
+            self.SIMULATION["num_brackets"],
+        )
+        stage_chances = {stage: chances.tolist() for stage, chances in stage_chances.items()}
+        return {
+            alliance_num: {
+                f"{stage}_chance": chances[alliance_num - 1]
+                for stage, chances in stage_chances.items()
+            }
+            for alliance_num in bracket_alliances
+        }
 
-                # Add aim team list
-                update["team_numbers"] = aim["team_list"]
-                other_update["team_numbers"] = other_aim["team_list"]
+    def load_team_documents(self, teams: Optional[List[str]] = None) -> set:
+        """Loads the obj_team and tba_team documents of teams into team_documents, or of every team
+        if teams isn't given
 
-                updates.extend([update, other_update])
-                finished_matches.append(aim["match_number"])
-        return updates
+        Returns the teams whose documents are new, have changed or were deleted since they were
+        last loaded
+        """
+        query = {}
+        if teams is None:
+            self.team_documents = {"obj_team": {}, "tba_team": {}}
+        else:
+            query = {"team_number": {"$in": list(teams)}}
+        changed_teams = set()
+        for collection, documents in self.team_documents.items():
+            found_documents = self.server.db.find(collection, query)
+            if teams is not None:
+                # Drop cached documents that were deleted, so they don't keep feeding predictions
+                found_teams = {document["team_number"] for document in found_documents}
+                for team in set(teams) - found_teams:
+                    if documents.pop(team, None) is not None:
+                        changed_teams.add(team)
+            for document in found_documents:
+                team = document["team_number"]
+                old_document = documents.get(team)
+                # _id doesn't change the prediction
+                if old_document is None or {**old_document, "_id": None} != {
+                    **document,
+                    "_id": None,
+                }:
+                    changed_teams.add(team)
+                documents[team] = document
+        return changed_teams
 
     def update_playoffs_alliances(self):
         """Runs the calculations for predicted values in playoffs matches
@@ -680,34 +1000,71 @@ class PredictedAimCalc(BaseCalculations):
             )
 
             updates.append(update)
+
+        # Add the chances of reaching each stage of the bracket
+        for alliance_num, chances in self.calc_playoffs_chances(playoffs_alliances).items():
+            for update in updates:
+                if update["alliance_num"] == alliance_num:
+                    update.update(chances)
         return updates
 
     def run(self):
         # Get calc start time
         start_time = time.time()
         match_schedule = self.get_aim_list()
-        # Check if changes need to be made to teams
-        teams = self.get_updated_teams()
-        aims = []
+        # Delete and re-insert if updating all data
+        if self.calc_all_data:
+            self.server.db.delete_data("predicted_aim")
+            self.written_aims = {}
+        # Check if changes need to be made to teams, only the documents of updated teams are loaded
+        # after every team has been loaded once
+        if self.calc_all_data or not self.team_documents["obj_team"]:
+            teams = self.load_team_documents()
+        else:
+            teams = self.load_team_documents(self.get_updated_teams())
+        # Both alliances of a match are needed to predict it
+        matches = set()
         for alliance in match_schedule:
             for team in alliance["team_list"]:
                 if team in teams:
-                    aims.append(alliance)
+                    matches.add(alliance["match_number"])
                     break
-        # Delete and re-insert if updating all data
-        if self.calc_all_data:
-            self.server.db.delete_data("predicted_aim")
+        aims = [alliance for alliance in match_schedule if alliance["match_number"] in matches]
 
-        # Inserts predicted_aim data into database
-        for update in self.update_predicted_aim(aims):
-            self.server.db.update_document(
+        obj_team = list(self.team_documents["obj_team"].values())
+        predicted_aim_updates = []
+        if aims:
+            predicted_aim_updates = self.update_predicted_aim(
+                aims, obj_team, list(self.team_documents["tba_team"].values())
+            )
+            self.update_simulated_aim(predicted_aim_updates, obj_team)
+        # Only alliances with changed predictions or actual data are written
+        predicted_aim_updates = [
+            update
+            for update in predicted_aim_updates
+            if self.written_aims.get((update["match_number"], update["alliance_color_is_red"]))
+            != update
+        ]
+        # Inserts predicted_aim data into database with one bulk write
+        if predicted_aim_updates:
+            self.server.db.bulk_write(
                 "predicted_aim",
-                update,
-                {
-                    "match_number": update["match_number"],
-                    "alliance_color_is_red": update["alliance_color_is_red"],
-                },
+                [
+                    pymongo.UpdateOne(
+                        {
+                            "match_number": update["match_number"],
+                            "alliance_color_is_red": update["alliance_color_is_red"],
+                        },
+                        {"$set": update},
+                        upsert=True,
+                    )
+                    for update in predicted_aim_updates
+                ],
             )
+            for update in predicted_aim_updates:
+                self.written_aims[
+                    (update["match_number"], update["alliance_color_is_red"])
+                ] = update
 
         # Inserts data into predicted_alliances
         for update in self.update_playoffs_alliances():
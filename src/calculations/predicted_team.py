@@ -6,6 +6,8 @@ from data_transfer import tba_communicator
 from calculations.base_calculations import BaseCalculations
 import logging
 import time
+import numpy as np
+from typing import Dict, List, Tuple
 
 log = logging.getLogger(__name__)
 server_log = logging.FileHandler("server.log")
@@ -13,9 +15,20 @@ log.addHandler(server_log)
 
 
 class PredictedTeamCalc(BaseCalculations):
+    # Number of times the rest of the qualification matches are simulated
+    NUM_SIMULATIONS = 2000
+    SEED = 1678
+    # Teams that finish at or above this rank are alliance captains
+    NUM_CAPTAINS = 8
+    # RPs for winning a qualification match
+    WIN_RPS = 2
+
     def __init__(self, server):
         super().__init__(server)
         self.watched_collections = ["predicted_aim"]
+        # Simulated RPs of each unplayed match, reused until the match's teams or outcome chances
+        # change. Looks like {match_number: {"outcomes": (teams, chances), "rps": array}}
+        self.simulated_matches = {}
 
     def calculate_current_values(self, ranking_data, team_number):
         for team_data in ranking_data:
@@ -35,9 +48,11 @@ class PredictedTeamCalc(BaseCalculations):
 
     def calculate_predicted_alliance_rps(self, predicted_aims):
         predicted_alliance_rps = {}
-        match_list = set([aim["match_number"] for aim in predicted_aims])
-        for match in match_list:
-            aims_in_match = [aim for aim in predicted_aims if aim["match_number"] == match]
+        # Index aims by match so each match is processed as a pair of alliances
+        aims_by_match = {}
+        for aim in predicted_aims:
+            aims_by_match.setdefault(aim["match_number"], []).append(aim)
+        for match, aims_in_match in aims_by_match.items():
             # set match to empty dict to avoid key error
             predicted_alliance_rps[match] = {}
             if len(aims_in_match) < 2:
@@ -118,11 +133,16 @@ class PredictedTeamCalc(BaseCalculations):
                 if current_team_data["matches_played"] == scheduled_matches:
                     finished_teams[team] = current_team_data["current_rank"]
 
-        predicted_ranks = sorted(predicted_rps.keys(), key=lambda x: predicted_rps[x], reverse=True)
+        # Rank of each team, looked up instead of searching the sorted list for every update
+        predicted_ranks = {
+            team: rank
+            for rank, team in enumerate(
+                sorted(predicted_rps.keys(), key=lambda x: predicted_rps[x], reverse=True), 1
+            )
+        }
 
         for num, update in enumerate(updates):
-            rank = predicted_ranks.index(update["team_number"]) + 1
-            updates[num]["predicted_rank"] = rank
+            updates[num]["predicted_rank"] = predicted_ranks[update["team_number"]]
             # if the team has finished, use their finished rank instead of a predicted one
             if current_team_data != None:
                 if updates[num]["team_number"] in finished_teams:
@@ -130,6 +150,168 @@ class PredictedTeamCalc(BaseCalculations):
 
         return updates
 
+    @staticmethod
+    def get_outcome_chances(aims_in_match: Dict[str, dict]) -> Tuple[float, ...]:
+        """Gets the chance of red winning, and the chances of each alliance getting each RP
+
+        aims_in_match: the predicted_aim of each alliance color in a match
+        Uses the simulated chances from predicted_aim, or the predicted values if there are none
+        Returns (red win chance, red rp1, red rp2, blue rp1, blue rp2)
+        """
+        red_aim, blue_aim = aims_in_match["R"], aims_in_match["B"]
+        if "simulated_win_chance" in red_aim:
+            red_win_chance = red_aim["simulated_win_chance"]
+        elif "win_chance" in red_aim:
+            red_win_chance = red_aim["win_chance"]
+        elif red_aim["predicted_score"] == blue_aim["predicted_score"]:
+            red_win_chance = 0.5
+        else:
+            red_win_chance = float(red_aim["predicted_score"] > blue_aim["predicted_score"])
+        rp_chances = [
+            aim.get(f"simulated_{rp}_chance", aim[f"predicted_{rp}"])
+            for aim in [red_aim, blue_aim]
+            for rp in ["rp1", "rp2"]
+        ]
+        return (red_win_chance, *rp_chances)
+
+    def simulate_match_rps(self, match_number: int, chances: Tuple[float, ...]) -> np.ndarray:
+        """Draws the RPs of each alliance in a match NUM_SIMULATIONS times
+
+        chances: from get_outcome_chances
+        Each match has its own seed, so a match is drawn the same way every time
+        Returns an array of shape (2, NUM_SIMULATIONS), with red's RPs and blue's RPs
+        """
+        rng = np.random.default_rng([self.SEED, match_number])
+        red_win_chance, *rp_chances = chances
+        red_wins = rng.random(self.NUM_SIMULATIONS) < red_win_chance
+        rps = rng.random((2, 2, self.NUM_SIMULATIONS)) < np.reshape(rp_chances, (2, 2, 1))
+        return np.stack([red_wins, ~red_wins]) * self.WIN_RPS + rps.sum(axis=1)
+
+    def get_simulated_matches(
+        self, aim_list: List[dict], predicted_aim: List[dict]
+    ) -> Tuple[List[Tuple[List[str], List[str]]], np.ndarray]:
+        """Simulates every unplayed qualification match in the schedule
+
+        Matches are only drawn again if their teams or outcome chances have changed since the last
+        time they were simulated
+        Returns the (red teams, blue teams) of each match, and an array of shape
+        (matches, 2, NUM_SIMULATIONS) with the simulated RPs of each alliance
+        """
+        aims_by_match = {}
+        for aim in predicted_aim:
+            color = "R" if aim["alliance_color_is_red"] else "B"
+            aims_by_match.setdefault(aim["match_number"], {})[color] = aim
+        teams_by_match = {}
+        for aim in aim_list:
+            match_teams = teams_by_match.setdefault(aim["match_number"], {})
+            match_teams[aim["alliance_color"]] = aim["team_list"]
+
+        match_teams = []
+        match_rps = []
+        simulated_matches = {}
+        for match_number, teams in teams_by_match.items():
+            aims_in_match = aims_by_match.get(match_number, {})
+            # Matches with actual data are already counted in the TBA rankings
+            if any(aim["has_actual_data"] for aim in aims_in_match.values()):
+                continue
+            if len(teams) < 2 or len(aims_in_match) < 2:
+                log.warning(f"Unable to simulate Match {match_number}, incomplete AIM data")
+                continue
+            outcomes = (
+                (tuple(teams["R"]), tuple(teams["B"])),
+                self.get_outcome_chances(aims_in_match),
+            )
+            cached = self.simulated_matches.get(match_number)
+            if cached is None or cached["outcomes"] != outcomes:
+                cached = {
+                    "outcomes": outcomes,
+                    "rps": self.simulate_match_rps(match_number, outcomes[1]),
+                }
+            simulated_matches[match_number] = cached
+            match_teams.append((teams["R"], teams["B"]))
+            match_rps.append(cached["rps"])
+        # Matches that have been played or removed from the schedule are no longer cached
+        self.simulated_matches = simulated_matches
+        return match_teams, np.array(match_rps).reshape(-1, 2, self.NUM_SIMULATIONS)
+
+    def get_tiebreak_order(self, teams: List[str], ranking_data: List[dict]) -> np.ndarray:
+        """Orders teams that have the same ranking score, using the TBA tiebreakers (sort_orders
+        after the ranking score) and then the current rank
+
+        Teams without ranking data are ordered after teams with ranking data
+        Returns the position of each team in the tiebreak order
+        """
+        tiebreakers = {team: (1,) for team in teams}
+        for team_data in ranking_data:
+            tiebreakers[team_data["team_key"][3:]] = (
+                0,
+                *[-(value or 0) for value in team_data.get("sort_orders", [])[1:]],
+                team_data["rank"],
+            )
+        tiebreak_order = np.empty(len(teams), dtype=int)
+        ordered_indexes = sorted(range(len(teams)), key=lambda index: tiebreakers[teams[index]])
+        tiebreak_order[ordered_indexes] = np.arange(len(teams))
+        return tiebreak_order
+
+    def calculate_simulated_ranks(self, updates, aim_list, ranking_data, predicted_aim):
+        """Simulates the rest of the qualification matches to find each team's rank distribution
+
+        RPs from simulated matches are added to the current RPs from TBA, then teams are ranked by
+        average RPs, with ties broken by get_tiebreak_order. Adds the chance of finishing at each
+        rank, the average rank and the chance of finishing as an alliance captain to each update.
+        """
+        match_teams, match_rps = self.get_simulated_matches(aim_list, predicted_aim)
+
+        # Every team at the event is ranked, not just the teams being updated
+        teams = list(
+            dict.fromkeys(
+                [update["team_number"] for update in updates]
+                + [team_data["team_key"][3:] for team_data in ranking_data]
+                + [team for red, blue in match_teams for team in red + blue]
+            )
+        )
+        team_indexes = {team: index for index, team in enumerate(teams)}
+        total_rps = np.zeros((len(teams), self.NUM_SIMULATIONS))
+        matches_played = np.zeros(len(teams))
+        for team_data in ranking_data:
+            index = team_indexes[team_data["team_key"][3:]]
+            total_rps[index] = team_data["extra_stats"][0]
+            matches_played[index] = team_data["matches_played"]
+
+        # Add the RPs of every alliance in every simulation to its teams
+        for color_index, color_teams in enumerate(zip(*match_teams)):
+            for alliance, alliance_teams in enumerate(color_teams):
+                for team in alliance_teams:
+                    total_rps[team_indexes[team]] += match_rps[alliance, color_index]
+                    matches_played[team_indexes[team]] += 1
+        ranking_scores = np.divide(
+            total_rps,
+            matches_played[:, None],
+            out=np.zeros_like(total_rps),
+            where=matches_played[:, None] != 0,
+        )
+
+        # Rank each simulation by ranking score, then by the tiebreak order
+        tiebreak_order = np.repeat(
+            self.get_tiebreak_order(teams, ranking_data)[:, None], self.NUM_SIMULATIONS, axis=1
+        )
+        order = np.lexsort((tiebreak_order, -ranking_scores), axis=0)
+        ranks = np.empty_like(order)
+        np.put_along_axis(ranks, order, np.arange(len(teams))[:, None], axis=0)
+        # Number of times each team finished at each rank
+        rank_counts = np.bincount(
+            (np.arange(len(teams))[:, None] * len(teams) + ranks).ravel(),
+            minlength=len(teams) ** 2,
+        ).reshape(len(teams), len(teams))
+
+        for update in updates:
+            index = team_indexes[update["team_number"]]
+            rank_chances = rank_counts[index] / self.NUM_SIMULATIONS
+            update["simulated_rank_chances"] = rank_chances.tolist()
+            update["simulated_avg_rank"] = float(ranks[index].mean() + 1)
+            update["captain_chance"] = float(rank_chances[: self.NUM_CAPTAINS].sum())
+        return updates
+
     def update_predicted_team(self, predicted_aim):
         updates = []
         ranking_data = tba_communicator.tba_request(f"event/{self.server.TBA_EVENT_KEY}/rankings")[
@@ -150,6 +332,9 @@ class PredictedTeamCalc(BaseCalculations):
             update["predicted_rps"] = predicted_rps
             updates.append(update)
         final_updates = self.calculate_predicted_ranks(updates, aim_list, ranking_data)
+        final_updates = self.calculate_simulated_ranks(
+            final_updates, aim_list, ranking_data, predicted_aim
+        )
 
         return final_updates
 
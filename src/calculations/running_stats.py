@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""Statistics that are updated one value at a time instead of being recalculated from every value.
+
+The module level functions accept either a RunningStat or a plain list of values, so calculations
+can share the same code for full recalculations and incremental updates.
+"""
+
+import bisect
+import math
+import statistics
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Union
+
+
+class RunningStat:
+    """Keeps the count, mean, M2, min, max, sum and sorted values of a group of numbers
+
+    The mean and M2 (sum of squared differences from the mean) are updated with Welford's algorithm,
+    and the sorted values are kept for medians, minimums and maximums.
+    """
+
+    def __init__(self, values: Optional[list] = None):
+        self.count = 0
+        self.mean = 0
+        self.m2 = 0
+        self.sum = 0
+        self.sorted_values = []
+        for value in values or []:
+            self.add(value)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, value: Union[int, float]) -> None:
+        """Adds one value"""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.sum += value
+        bisect.insort(self.sorted_values, value)
+
+    def remove(self, value: Union[int, float]) -> None:
+        """Removes one value that was previously added"""
+        index = bisect.bisect_left(self.sorted_values, value)
+        if index == self.count or self.sorted_values[index] != value:
+            raise ValueError(f"running_stats: {value} was never added")
+        self.sorted_values.pop(index)
+        self.count -= 1
+        self.sum -= value
+        if self.count <= 1:
+            # Reset to avoid leftover float errors
+            self.mean = self.sorted_values[0] if self.count == 1 else 0
+            self.m2 = 0
+            return
+        delta = value - self.mean
+        self.mean -= delta / self.count
+        self.m2 -= delta * (value - self.mean)
+
+    def pstdev(self) -> float:
+        """Population standard deviation"""
+        if self.count == 0:
+            raise statistics.StatisticsError("pstdev requires at least one data point")
+        # M2 can drift slightly below zero from float errors when values are removed
+        return math.sqrt(max(self.m2, 0) / self.count)
+
+    def median(self, ignore=None) -> Optional[Union[int, float]]:
+        """Median of the values that are not equal to `ignore`, None if there are none"""
+        values = self.sorted_values
+        # Values equal to ignore are next to each other, so skip over them by index
+        ignore_start = ignore_end = len(values)
+        if ignore is not None and not isinstance(ignore, str):
+            ignore_start = bisect.bisect_left(values, ignore)
+            ignore_end = bisect.bisect_right(values, ignore)
+        num_ignored = ignore_end - ignore_start
+        num_values = len(values) - num_ignored
+        if num_values == 0:
+            return None
+
+        def value_at(index):
+            return values[index] if index < ignore_start else values[index + num_ignored]
+
+        if num_values % 2 == 1:
+            return value_at(num_values // 2)
+        return (value_at(num_values // 2 - 1) + value_at(num_values // 2)) / 2
+
+
+class LastMatchesWindow:
+    """Keeps the TIMs of a team's last `size` matches, along with RunningStats of their numeric
+    fields and Counters of their categorical fields
+
+    TIMs can be added in any order. Adding a TIM for a match that is already in the window replaces
+    it, and a TIM older than every match in a full window is ignored.
+    """
+
+    def __init__(self, size: int, stat_fields: Iterable[str] = (), category_fields=()):
+        self.size = size
+        # Match numbers in the window, from oldest to newest
+        self.match_numbers = []
+        self.tims = {}
+        self.stats: Dict[str, RunningStat] = {field: RunningStat() for field in stat_fields}
+        self.categories: Dict[str, Counter] = {field: Counter() for field in category_fields}
+
+    def __len__(self) -> int:
+        return len(self.match_numbers)
+
+    def get_tims(self) -> List[dict]:
+        """Returns the TIMs in the window, from oldest to newest"""
+        return [self.tims[match_number] for match_number in self.match_numbers]
+
+    def get_categories(self) -> Dict[str, Counter]:
+        """Returns the Counters of each categorical field, with the categories in the order they
+        first occurred in the window so tied modes keep the same order as statistics.multimode"""
+        tims = self.get_tims()
+        return {
+            field: Counter(
+                {value: categories[value] for value in dict.fromkeys(tim[field] for tim in tims)}
+            )
+            for field, categories in self.categories.items()
+        }
+
+    def add(self, tim: dict) -> None:
+        """Adds a TIM to the window, removing the oldest TIM if the window is full"""
+        match_number = tim["match_number"]
+        if match_number in self.tims:
+            self.remove(match_number)
+        elif len(self.match_numbers) == self.size:
+            if self.size == 0 or match_number < self.match_numbers[0]:
+                return
+            self.remove(self.match_numbers[0])
+        bisect.insort(self.match_numbers, match_number)
+        self.tims[match_number] = tim
+        for field, stat in self.stats.items():
+            stat.add(tim[field])
+        for field, categories in self.categories.items():
+            categories[tim[field]] += 1
+
+    def remove(self, match_number: int, older_tim: Optional[dict] = None) -> None:
+        """Removes the TIM of a match from the window
+
+        older_tim is the newest TIM that is older than the window, it takes the removed TIM's place
+        """
+        tim = self.tims.pop(match_number)
+        self.match_numbers.remove(match_number)
+        for field, stat in self.stats.items():
+            stat.remove(tim[field])
+        for field, categories in self.categories.items():
+            categories[tim[field]] -= 1
+            # Remove categories that no longer occur so they aren't counted as modes
+            if categories[tim[field]] == 0:
+                del categories[tim[field]]
+        if older_tim is not None:
+            self.add(older_tim)
+
+
+def mean(values: Union[RunningStat, List]) -> float:
+    """Mean of a RunningStat or list, 0 if there are no values"""
+    if isinstance(values, RunningStat):
+        return values.mean
+    if len(values) == 0:
+        return 0
+    return sum(values) / len(values)
+
+
+def pstdev(values: Union[RunningStat, List]) -> float:
+    """Population standard deviation of a RunningStat or list"""
+    if isinstance(values, RunningStat):
+        return values.pstdev()
+    return statistics.pstdev(values)
+
+
+def maximum(values: Union[RunningStat, List]):
+    """Largest value of a RunningStat or list"""
+    if isinstance(values, RunningStat):
+        if values.count == 0:
+            raise ValueError("maximum() arg is an empty RunningStat")
+        return values.sorted_values[-1]
+    return max(values)
+
+
+def minimum(values: Union[RunningStat, List]):
+    """Smallest value of a RunningStat or list"""
+    if isinstance(values, RunningStat):
+        if values.count == 0:
+            raise ValueError("minimum() arg is an empty RunningStat")
+        return values.sorted_values[0]
+    return min(values)
+
+
+def median(values: Union[RunningStat, List], ignore=None) -> Optional[Union[int, float]]:
+    """Median of the values of a RunningStat or list that are not equal to `ignore`,
+    None if there are none"""
+    if isinstance(values, RunningStat):
+        return values.median(ignore)
+    values_to_count = [value for value in values if value != ignore]
+    if values_to_count == []:
+        return None
+    return statistics.median(values_to_count)
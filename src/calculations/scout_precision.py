@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """Calculates scout precisions to determine scout accuracy compared to TBA."""
 
+import bisect
 from datetime import datetime
 
 from calculations.base_calculations import BaseCalculations
@@ -8,6 +9,7 @@ from data_transfer import tba_communicator
 import utils
 import time
 import logging
+import pymongo
 
 log = logging.getLogger(__name__)
 server_log = logging.FileHandler("server.log")
@@ -19,6 +21,12 @@ class ScoutPrecisionCalc(BaseCalculations):
         super().__init__(server)
         self.watched_collections = ["unconsolidated_totals"]
         self.overall_schema = utils.read_schema("schema/calc_scout_precision_schema.yml")
+        # Overall precisions of every scout that has been ranked, without ranks
+        self.scout_precisions = {}
+        # The rank keys of every ranked scout, sorted from first to last for each rank
+        self.rank_orders = {rank: [] for rank in self.overall_schema["ranks"]}
+        # The last update written to the database for each scout
+        self.written_scouts = {}
 
     def find_updated_scouts(self):
         """Returns a list of scout names that appear in entries_since_last"""
@@ -50,41 +58,55 @@ class ScoutPrecisionCalc(BaseCalculations):
                 calculations[calculation] = abs(self.avg(all_sim_errors))
         return calculations
 
-    def calc_ranks(self, scouts):
-        """Ranks a scout based on their overall precision."""
-        for rank, schema in self.overall_schema["ranks"].items():
-            for scout in scouts:
-                # If there is no scout precision, set it to None
-                if schema["requires"].split(".")[1] not in scout.keys():
-                    scout[schema["requires"].split(".")[1]] = None
-
-            # This is a bit complex, but works as follows. It constructs a tuple for every scout in the list, where the first value
-            # is whether the scout precision is None, and the second is the value itself. Tuples are sorted item by item, so those
-            # with False as the first value (if its not None) will come before those where it is true (if it is None), because False < True
-            scouts = sorted(
-                scouts,
-                key=lambda s: (
-                    s[schema["requires"].split(".")[1]] is None,
-                    s[schema["requires"].split(".")[1]],
-                ),
-            )
-
-            # Go through the list and assign the ranks accordingly
-            for i in range(len(scouts)):
-                scouts[i][rank] = i + 1
+    @staticmethod
+    def get_rank_key(scout: dict, datapoint: str) -> tuple:
+        """Gets the key a scout is sorted by in a rank.
+        Scouts without a precision are ranked last, and ties are broken by scout name."""
+        precision = scout.get(datapoint)
+        return (precision is None, 0 if precision is None else precision, scout["scout_name"])
 
+    def calc_ranks(self, scouts):
+        """Ranks a scout based on their overall precision.
+        The scouts are added to the ranks of previously ranked scouts, and every ranked scout is returned
+        sorted by rank."""
+        for scout in scouts:
             # Delete scout_precision if it is None (So it doesn't break validation)
-            for scout in scouts:
-                if scout[schema["requires"].split(".")[1]] == None:
-                    del scout[schema["requires"].split(".")[1]]
-
-        return scouts
-
-    def update_scout_precision_calcs(self, scouts):
-        """Creates overall precision updates."""
+            scout = {field: value for field, value in scout.items() if value is not None}
+            previous_scout = self.scout_precisions.get(scout["scout_name"])
+            for rank, schema in self.overall_schema["ranks"].items():
+                datapoint = schema["requires"].split(".")[1]
+                rank_order = self.rank_orders[rank]
+                # Move the scout from their old position to their new position
+                if previous_scout is not None:
+                    rank_order.pop(
+                        bisect.bisect_left(rank_order, self.get_rank_key(previous_scout, datapoint))
+                    )
+                bisect.insort(rank_order, self.get_rank_key(scout, datapoint))
+            self.scout_precisions[scout["scout_name"]] = scout
+
+        ranked_scouts = {name: dict(scout) for name, scout in self.scout_precisions.items()}
+        # Go through the sorted keys and assign the ranks accordingly
+        for rank, rank_order in self.rank_orders.items():
+            for position, (*_, name) in enumerate(rank_order):
+                ranked_scouts[name][rank] = position + 1
+        if not self.rank_orders:
+            return list(ranked_scouts.values())
+        return [ranked_scouts[name] for *_, name in list(self.rank_orders.values())[-1]]
+
+    def get_scout_sims(self, scouts, all_scouts=False):
+        """Gets the sim_precision documents of each scout with one query.
+        If all_scouts is True, the documents of every scout in sim_precision are also included."""
+        scout_sims = {scout: [] for scout in scouts}
+        query = {} if all_scouts else {"scout_name": {"$in": list(scouts)}}
+        for sim in self.server.db.find("sim_precision", query):
+            scout_sims.setdefault(sim["scout_name"], []).append(sim)
+        return scout_sims
+
+    def update_scout_precision_calcs(self, scouts, all_scouts=False):
+        """Creates overall precision updates.
+        Returns the updates of every ranked scout, since other scouts' ranks can change."""
         updates = []
-        for scout in scouts:
-            scout_sims = self.server.db.find("sim_precision", {"scout_name": scout})
+        for scout, scout_sims in self.get_scout_sims(scouts, all_scouts).items():
             update = {}
             update["scout_name"] = scout
             if (scout_precision := self.calc_scout_precision(scout_sims)) != {}:
@@ -100,11 +122,30 @@ class ScoutPrecisionCalc(BaseCalculations):
 
         if self.calc_all_data:
             self.server.db.delete_data("scout_precision")
-
-        for update in self.update_scout_precision_calcs(scouts):
-            self.server.db.update_document(
-                "scout_precision", update, {"scout_name": update["scout_name"]}
+            self.scout_precisions = {}
+            self.rank_orders = {rank: [] for rank in self.rank_orders}
+            self.written_scouts = {}
+
+        # Every scout is needed to rank them, so every scout is loaded on the first run
+        updates = self.update_scout_precision_calcs(scouts, not self.scout_precisions)
+        # Only scouts with a changed precision or rank are written
+        updates = [
+            update for update in updates if self.written_scouts.get(update["scout_name"]) != update
+        ]
+        if updates:
+            result = self.server.db.bulk_write(
+                "scout_precision",
+                [
+                    pymongo.UpdateOne(
+                        {"scout_name": update["scout_name"]}, {"$set": update}, upsert=True
+                    )
+                    for update in updates
+                ],
             )
+            # Scouts are only skipped in later runs if they were actually written
+            if result is not None:
+                for update in updates:
+                    self.written_scouts[update["scout_name"]] = update
         end_time = time.time()
         # Get total calc time
         total_time = end_time - start_time
@@ -1,4 +1,7 @@
 from datetime import datetime
+import json
+
+import numpy as np
 
 from calculations.base_calculations import BaseCalculations
 from data_transfer import tba_communicator
@@ -17,13 +20,77 @@ class SimPrecisionCalc(BaseCalculations):
         super().__init__(server)
         self.watched_collections = ["unconsolidated_totals"]
         self.sim_schema = utils.read_schema("schema/calc_sim_precision_schema.yml")
+        # unconsolidated_totals indexed by match number, alliance color, team number and scout name,
+        # loaded by load_scout_index. Looks like {match_number: {alliance_color_is_red:
+        # {team_number: {scout_name: {"document": document, "scores": {calculation: score}}}}}}
+        self.scout_index = None
+        # The first entry of each (match_number, scout_name) in scout_index
+        self.scout_match_index = {}
+        # Intermediate results of each match and the fingerprint of the inputs they were calculated
+        # from, so matches are only recalculated when their scout data or TBA result changes.
+        # Looks like {match_number: (fingerprint, calc_match_results(match_number, tba_match))}
+        self.match_results = {}
+
+    def load_scout_index(self) -> None:
+        """Loads every unconsolidated_totals document into scout_index with one query, and
+        calculates the score of every calculation in the schema for each document"""
+        self.scout_index = {}
+        self.scout_match_index = {}
+        for document in self.server.db.find("unconsolidated_totals"):
+            entry = {
+                "document": document,
+                "scores": {
+                    calculation: self.calc_scout_score(document, schema["requires"])
+                    for calculation, schema in self.sim_schema["calculations"].items()
+                },
+            }
+            match_index = self.scout_index.setdefault(document["match_number"], {})
+            team_index = match_index.setdefault(document["alliance_color_is_red"], {})
+            scout_index = team_index.setdefault(document["team_number"], {})
+            scout_index.setdefault(document["scout_name"], entry)
+            self.scout_match_index.setdefault(
+                (document["match_number"], document["scout_name"]), entry
+            )
+
+    @staticmethod
+    def calc_scout_score(
+        scout_document: dict, required: Dict[str, Dict[str, Union[int, List[str]]]]
+    ) -> Union[int, float]:
+        """Calculates the linear combination of required datapoints in a scout's document"""
+        total_score = 0
+        for datapoint, weight in required.items():
+            # split using . to get rid of collection name
+            collection, datapoint = datapoint.split(".")
+            # Check if the collection is valid
+            if collection != "unconsolidated_totals":
+                log.fatal(
+                    f"Getting data from {collection} is not implemented. Only uncosolidated_totals."
+                )
+                raise NotImplementedError
+            total_score += scout_document[datapoint] * weight
+        return total_score
 
     def get_scout_tim_score(
-        self, scout: str, match_number: int, required: Dict[str, Dict[str, Union[int, List[str]]]]
+        self,
+        scout: str,
+        match_number: int,
+        required: Dict[str, Dict[str, Union[int, List[str]]]],
+        calculation: Union[str, None] = None,
     ) -> Union[int, None]:
         """Gets the score for a team in a match reported by a scout.
         required is the dictionary of required datapoints: {weight: value, calculation: [calculations]} from schema
+        calculation is the name of the schema calculation, its score is looked up in scout_index
+        if the index is loaded. Otherwise, the scout's data is queried from the database.
         """
+        if self.scout_index is not None:
+            entry = self.scout_match_index.get((match_number, scout))
+            if entry is None:
+                log.warning(f"No data from Scout {scout} in Match {match_number}")
+                return
+            if calculation is not None:
+                return entry["scores"][calculation]
+            return self.calc_scout_score(entry["document"], required)
+
         scout_data = self.server.db.find(
             "unconsolidated_totals", {"match_number": match_number, "scout_name": scout}
         )
@@ -32,30 +99,29 @@ class SimPrecisionCalc(BaseCalculations):
             log.warning(f"No data from Scout {scout} in Match {match_number}")
             return
 
-        scout_document = scout_data[0]
-        total_score = 0
-        for datapoint, weight in required.items():
-            # split using . to get rid of collection name
-            collection, datapoint = datapoint.split(".")
-            # Check if the collection is valid
-            if collection != "unconsolidated_totals":
-                log.fatal(
-                    f"Getting data from {collection} is not implemented. Only uncosolidated_totals."
-                )
-                raise NotImplementedError
-            total_score += scout_document[datapoint] * weight
-        return total_score
+        return self.calc_scout_score(scout_data[0], required)
 
     def get_aim_scout_scores(
         self,
         match_number: int,
         alliance_color_is_red: bool,
         required: Dict[str, Dict[str, Union[int, List[str]]]],
+        calculation: Union[str, None] = None,
     ) -> Dict[str, Dict[str, int]]:
         """Gets the individual TIM scores reported by each scout for an alliance in a match.
         required is the dictionary of required datapoints: {weight: value, calculation: [calculations]} from schema.
         Returns a dictionary where keys are team numbers and values are dictionaries of scout name: tim score.
         """
+        if self.scout_index is not None:
+            alliance_index = self.scout_index.get(match_number, {}).get(alliance_color_is_red, {})
+            return {
+                team: {
+                    scout: self.get_scout_tim_score(scout, match_number, required, calculation)
+                    for scout in team_index
+                }
+                for team, team_index in alliance_index.items()
+            }
+
         scores_per_team = {}
         scout_data = self.server.db.find(
             "unconsolidated_totals",
@@ -92,26 +158,67 @@ class SimPrecisionCalc(BaseCalculations):
             )
             return {}
 
-        # Get the reported values for each scout
-        team1_scouts, team2_scouts, team3_scouts = aim_scout_scores.values()
-
-        all_scout_errors = {}
-        for scout1, score1 in team1_scouts.items():
-            scout1_errors = all_scout_errors.get(scout1, [])
-            for scout2, score2 in team2_scouts.items():
-                scout2_errors = all_scout_errors.get(scout2, [])
-                for scout3, score3 in team3_scouts.items():
-                    scout3_errors = all_scout_errors.get(scout3, [])
-                    error = tba_aim_score - (score1 + score2 + score3)
-                    scout1_errors.append(error)
-                    scout2_errors.append(error)
-                    scout3_errors.append(error)
-                    all_scout_errors[scout3] = scout3_errors
-                all_scout_errors[scout2] = scout2_errors
-            all_scout_errors[scout1] = scout1_errors
-        scout_avg_errors = {scout: self.avg(errors) for scout, errors in all_scout_errors.items()}
+        errors = self.get_aim_error_tensor(aim_scout_scores, tba_aim_score)
+        # Sum the errors of every combination each scout is part of
+        error_sums = {}
+        error_counts = {}
+        for axis, team_scouts in enumerate(aim_scout_scores.values()):
+            other_axes = tuple(other_axis for other_axis in range(3) if other_axis != axis)
+            num_combinations = errors.size // errors.shape[axis]
+            for scout, error_sum in zip(team_scouts, errors.sum(axis=other_axes).tolist()):
+                error_sums[scout] = error_sums.get(scout, 0) + error_sum
+                error_counts[scout] = error_counts.get(scout, 0) + num_combinations
+        # A scout has no combinations if a team in the alliance has no scouts
+        scout_avg_errors = {
+            scout: error_sum / error_counts[scout] if error_counts[scout] > 0 else 0
+            for scout, error_sum in error_sums.items()
+        }
         return scout_avg_errors
 
+    @staticmethod
+    def get_aim_error_tensor(
+        aim_scout_scores: Dict[str, Dict[str, int]], tba_aim_score: int
+    ) -> np.ndarray:
+        """Gets the error from TBA of every combination of scouts in an AIM.
+        errors[i, j, k] is the error of the ith, jth and kth scouts of the first, second and third teams
+        """
+        team1_scores, team2_scores, team3_scores = [
+            np.array(list(team_scouts.values()), dtype=float)
+            for team_scouts in aim_scout_scores.values()
+        ]
+        return tba_aim_score - (
+            team1_scores[:, None, None] + team2_scores[None, :, None] + team3_scores[None, None, :]
+        )
+
+    def calc_aim_sim_precisions(
+        self,
+        aim_scout_scores: Dict[str, Dict[str, int]],
+        aim_scout_errors: Dict[str, float],
+        tba_aim_score: int,
+    ) -> Dict[str, Dict[str, float]]:
+        """Calculates the sim precision of every scout in an AIM at once.
+        Returns a dictionary where keys are team numbers and values are dictionaries of scout name: precision.
+        """
+        if aim_scout_errors == {}:
+            return {}
+        errors = self.get_aim_error_tensor(aim_scout_scores, tba_aim_score)
+        # Each aim_scout_error value represents the average error of 3 scouts, so divide by 3
+        partner_errors = [
+            np.array([aim_scout_errors[scout] for scout in team_scouts]) / 3
+            for team_scouts in aim_scout_scores.values()
+        ]
+        precisions = {}
+        for axis, (team, team_scouts) in enumerate(aim_scout_scores.items()):
+            ally1_axis, ally2_axis = [other_axis for other_axis in range(3) if other_axis != axis]
+            # Move the team's axis first, so the alliance partners are the last two axes
+            combo_errors = np.moveaxis(errors, axis, 0)
+            average_partner_errors = (
+                partner_errors[ally1_axis][:, None] + partner_errors[ally2_axis][None, :]
+            )
+            error_differences = average_partner_errors[None, :, :] - combo_errors
+            precisions[team] = dict(zip(team_scouts, error_differences.mean(axis=(1, 2)).tolist()))
+        return precisions
+
     def get_tba_value(
         self,
         tba_match_data: List[dict],
@@ -131,59 +238,117 @@ class SimPrecisionCalc(BaseCalculations):
 
         return total
 
-    def calc_sim_precision(self, sim, aim_match_errors, aim_match_reported_values, tba_aim_scores):
+    def calc_sim_precision(
+        self,
+        sim,
+        aim_match_errors,
+        aim_match_reported_values,
+        tba_aim_scores,
+        aim_match_precisions=None,
+    ):
         """Calculates the average difference between errors where the scout was part of the combination, and errors where the scout wasn't.
-        sim is a scout-in-match document."""
+        sim is a scout-in-match document.
+        aim_match_precisions are the precisions of every scout from calc_aim_sim_precisions. If they
+        aren't given, the precisions of the sim's AIM are calculated from the other arguments."""
+        match_number = sim["match_number"]
+        alliance_color_is_red = sim["alliance_color_is_red"]
         calculations = {}
+        for calculation in self.sim_schema["calculations"]:
+            if aim_match_precisions is None:
+                aim_precisions = self.calc_aim_sim_precisions(
+                    aim_match_reported_values[match_number][calculation][alliance_color_is_red],
+                    aim_match_errors[match_number][calculation][alliance_color_is_red],
+                    tba_aim_scores[match_number][calculation][alliance_color_is_red],
+                )
+            else:
+                aim_precisions = aim_match_precisions[match_number][calculation][
+                    alliance_color_is_red
+                ]
+            if aim_precisions == {}:
+                return {}
+            calculations[calculation] = aim_precisions[sim["team_number"]][sim["scout_name"]]
+        return calculations
+
+    def get_match_fingerprint(self, match_number: int, tba_match: dict) -> tuple:
+        """Gets a summary of every input to a match's intermediate results: each scout's scores and
+        the TBA score breakdown. load_scout_index must be called first."""
+        scout_scores = tuple(
+            (
+                alliance_color_is_red,
+                team,
+                scout,
+                tuple(self.scout_match_index[(match_number, scout)]["scores"].values()),
+            )
+            for alliance_color_is_red, teams in self.scout_index.get(match_number, {}).items()
+            for team, scouts in teams.items()
+            for scout in scouts
+        )
+        return scout_scores, json.dumps(tba_match["score_breakdown"], sort_keys=True)
+
+    def calc_match_results(self, match_number: int, tba_match: dict) -> tuple:
+        """Calculates the TBA scores, scout errors, scout reported values and scout precisions of both
+        alliances in a match for each calculation. load_scout_index must be called first.
+        Each is a dictionary of {calculation: {alliance_color_is_red: value}}"""
+        tba_aim_scores = {}
+        aim_match_errors = {}
+        aim_match_reported_values = {}
+        aim_match_precisions = {}
+        # Calculate data for each calculation
         for calculation, schema in self.sim_schema["calculations"].items():
             required = schema["requires"]
+            tba_points = schema["tba_datapoints"]
+
+            # Get the scores from TBA
+            red_tba_aim_score = self.get_tba_value([tba_match], tba_points, match_number, True)
+            blue_tba_aim_score = self.get_tba_value([tba_match], tba_points, match_number, False)
 
-            # Value reported for datapoint by a specific scout for a robot in a match
-            scout_reported_value = self.get_scout_tim_score(
-                sim["scout_name"], sim["match_number"], required
+            # Get the scores of all scouts in a match
+            red_aim_scouts_reported_values = self.get_aim_scout_scores(
+                match_number, True, required, calculation
             )
 
-            # Use match number, calculation type, and alliance color to query for the necessary data
-            tba_aim_score = tba_aim_scores[sim["match_number"]][calculation][
-                sim["alliance_color_is_red"]
-            ]
-            aim_scout_errors = aim_match_errors[sim["match_number"]][calculation][
-                sim["alliance_color_is_red"]
-            ]
-            aim_scouts_reported_values = aim_match_reported_values[sim["match_number"]][
-                calculation
-            ][sim["alliance_color_is_red"]]
+            blue_aim_scouts_reported_values = self.get_aim_scout_scores(
+                match_number, False, required, calculation
+            )
 
-            if aim_scout_errors == {}:
-                return {}
+            # Get the average errors of all scouts in a match
+            red_aim_scout_errors = self.get_aim_scout_avg_errors(
+                red_aim_scouts_reported_values,
+                red_tba_aim_score,
+                match_number,
+                True,
+            )
 
-            # Find alliance partners
-            count = 0
-            for team, aim_data in aim_scouts_reported_values.items():
-                # Excludes the scout's own team
-                if team == sim["team_number"]:
-                    continue
-                if count == 0:
-                    ally1_scouts = aim_data
-                    count += 1
-                else:
-                    ally2_scouts = aim_data
-
-            # Calculate the sim precision using the avg errors of the scout vs the avg error of each scout
-            sim_errors = []
-            for scout1, ally1_score in ally1_scouts.items():
-                for scout2, ally2_score in ally2_scouts.items():
-                    current_combo_error = tba_aim_score - (
-                        scout_reported_value + ally1_score + ally2_score
-                    )
-                    # Each aim_scout_error value represents the average error of 3 scouts, so divide by 3
-                    average_partner_error = (
-                        aim_scout_errors[scout1] + aim_scout_errors[scout2]
-                    ) / 3
-                    error_difference = average_partner_error - current_combo_error
-                    sim_errors.append(error_difference)
-            calculations[calculation] = self.avg(sim_errors)
-        return calculations
+            blue_aim_scout_errors = self.get_aim_scout_avg_errors(
+                blue_aim_scouts_reported_values,
+                blue_tba_aim_score,
+                match_number,
+                False,
+            )
+
+            # Update to their respective dictionaries
+            # True is for red alliance and False is for blue alliance
+            tba_aim_scores[calculation] = {
+                True: red_tba_aim_score,
+                False: blue_tba_aim_score,
+            }
+            aim_match_errors[calculation] = {
+                True: red_aim_scout_errors,
+                False: blue_aim_scout_errors,
+            }
+            aim_match_reported_values[calculation] = {
+                True: red_aim_scouts_reported_values,
+                False: blue_aim_scouts_reported_values,
+            }
+            aim_match_precisions[calculation] = {
+                True: self.calc_aim_sim_precisions(
+                    red_aim_scouts_reported_values, red_aim_scout_errors, red_tba_aim_score
+                ),
+                False: self.calc_aim_sim_precisions(
+                    blue_aim_scouts_reported_values, blue_aim_scout_errors, blue_tba_aim_score
+                ),
+            }
+        return tba_aim_scores, aim_match_errors, aim_match_reported_values, aim_match_precisions
 
     def update_sim_precision_calcs(self, unconsolidated_sims):
         """Creates scout-in-match precision updates"""
@@ -201,72 +366,36 @@ class SimPrecisionCalc(BaseCalculations):
             ]
             + [0]
         )
+        # Only use qualification matches, keyed by match number
+        tba_matches = {
+            match["match_number"]: match for match in tba_match_data if match["comp_level"] == "qm"
+        }
         updates = []
+        # Every scout's scores are looked up in the index instead of queried
+        self.load_scout_index()
         # Create dicts for shared data between scouts
         tba_aim_scores = {}
         aim_match_errors = {}
         aim_match_reported_values = {}
+        aim_match_precisions = {}
         # Iterate up to either the latest tba match or match where we have data (To avoid crashing)
         for match_number in range(1, min(latest_match, latest_tba_match) + 1):
-            # Create match_number keys
-            tba_aim_scores[match_number] = {}
-            aim_match_errors[match_number] = {}
-            aim_match_reported_values[match_number] = {}
-            # Calculate data for each calculation
-            for calculation, schema in self.sim_schema["calculations"].items():
-                required = schema["requires"]
-                tba_points = schema["tba_datapoints"]
-
-                # Get the scores from TBA
-                red_tba_aim_score = self.get_tba_value(
-                    tba_match_data, tba_points, match_number, True
-                )
-
-                blue_tba_aim_score = self.get_tba_value(
-                    tba_match_data, tba_points, match_number, False
-                )
-
-                # Get the scores of all scouts in a match
-                red_aim_scouts_reported_values = self.get_aim_scout_scores(
-                    match_number, True, required
-                )
-
-                blue_aim_scouts_reported_values = self.get_aim_scout_scores(
-                    match_number, False, required
-                )
-
-                # Get the average errors of all scouts in a match
-                red_aim_scout_errors = self.get_aim_scout_avg_errors(
-                    red_aim_scouts_reported_values,
-                    red_tba_aim_score,
-                    match_number,
-                    True,
-                )
-
-                blue_aim_scout_errors = self.get_aim_scout_avg_errors(
-                    blue_aim_scouts_reported_values,
-                    blue_tba_aim_score,
-                    match_number,
-                    False,
-                )
-
-                # Update to their respective dictionaries
-                # True is for red alliance and False is for blue alliance
-                tba_aim_scores[match_number][calculation] = {
-                    True: red_tba_aim_score,
-                    False: blue_tba_aim_score,
-                }
-                aim_match_errors[match_number][calculation] = {
-                    True: red_aim_scout_errors,
-                    False: blue_aim_scout_errors,
-                }
-                aim_match_reported_values[match_number][calculation] = {
-                    True: red_aim_scouts_reported_values,
-                    False: blue_aim_scouts_reported_values,
-                }
+            tba_match = tba_matches[match_number]
+            fingerprint = self.get_match_fingerprint(match_number, tba_match)
+            cached_results = self.match_results.get(match_number)
+            # Recalculate the match if scout data or TBA data changed since the last run
+            if cached_results is None or cached_results[0] != fingerprint:
+                cached_results = (fingerprint, self.calc_match_results(match_number, tba_match))
+                self.match_results[match_number] = cached_results
+            (
+                tba_aim_scores[match_number],
+                aim_match_errors[match_number],
+                aim_match_reported_values[match_number],
+                aim_match_precisions[match_number],
+            ) = cached_results[1]
 
         for sim in unconsolidated_sims:
-            sim_data = self.server.db.find("unconsolidated_totals", sim)[0]
+            sim_data = self.scout_match_index[(sim["match_number"], sim["scout_name"])]["document"]
             if sim_data["match_number"] > latest_tba_match:
                 continue
             update = {
@@ -275,19 +404,17 @@ class SimPrecisionCalc(BaseCalculations):
                 "team_number": sim_data["team_number"],
                 "alliance_color_is_red": sim_data["alliance_color_is_red"],
             }
-            for match in tba_match_data:
-                if (
-                    match["match_number"] == sim_data["match_number"]
-                    and match["comp_level"] == "qm"
-                ):
-                    # Convert match timestamp from Unix time (on TBA) to human-readable
-                    update["timestamp"] = datetime.fromtimestamp(match["actual_time"])
-                    break
-            else:
+            if (match := tba_matches.get(sim_data["match_number"])) is None:
                 continue
+            # Convert match timestamp from Unix time (on TBA) to human-readable
+            update["timestamp"] = datetime.fromtimestamp(match["actual_time"])
             if (
                 sim_precision := self.calc_sim_precision(
-                    sim_data, aim_match_errors, aim_match_reported_values, tba_aim_scores
+                    sim_data,
+                    aim_match_errors,
+                    aim_match_reported_values,
+                    tba_aim_scores,
+                    aim_match_precisions,
                 )
             ) != {}:
                 update.update(sim_precision)
@@ -310,6 +437,7 @@ class SimPrecisionCalc(BaseCalculations):
         # Delete and re-insert if updating all data
         if self.calc_all_data:
             self.server.db.delete_data("sim_precision")
+            self.match_results = {}
 
         for update in self.update_sim_precision_calcs(sims):
             self.server.db.update_document(
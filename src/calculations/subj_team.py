@@ -4,8 +4,10 @@
 import utils
 import time
 import logging
+import numpy as np
+import pymongo
 from calculations import base_calculations
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
 log = logging.getLogger(__name__)
 server_log = logging.FileHandler("server.log")
@@ -39,9 +41,70 @@ class SubjTeamCalcs(base_calculations.BaseCalculations):
             partners.extend([tim["team_number"] for tim in alliance_data])
         return partners
 
-    def unadjusted_ability_calcs(self, team: str) -> Dict[str, float]:
+    def get_partner_matrix(
+        self, subj_tims: Optional[List[Dict]] = None
+    ) -> Tuple[Dict[str, int], np.ndarray]:
+        """Returns a dictionary of team numbers to indexes and a partner matrix, where each row is
+        how many times each team shows up in teams_played_with for the team at that index
+
+        Uses every subj_tim in the database if subj_tims isn't given
+        """
+        if subj_tims is None:
+            subj_tims = self.server.db.find("subj_tim")
+        team_indexes = {
+            team: index
+            for index, team in enumerate(sorted({tim["team_number"] for tim in subj_tims}))
+        }
+        # Each alliance is a match number and alliance color
+        alliance_indexes = {}
+        # matches_played has the alliance color of each team in each match, the same as in
+        # teams_played_with
+        matches_played = {}
+        for tim in subj_tims:
+            alliance = (tim["match_number"], tim["alliance_color_is_red"])
+            alliance_indexes.setdefault(alliance, len(alliance_indexes))
+            matches_played[(tim["team_number"], tim["match_number"])] = alliance
+        # How many subj_tims each team has in each alliance
+        alliance_tims = np.zeros((len(team_indexes), len(alliance_indexes)))
+        for tim in subj_tims:
+            alliance = (tim["match_number"], tim["alliance_color_is_red"])
+            alliance_tims[team_indexes[tim["team_number"]], alliance_indexes[alliance]] += 1
+        # Which alliances each team played in
+        alliances_played = np.zeros((len(team_indexes), len(alliance_indexes)))
+        for (team, _), alliance in matches_played.items():
+            alliances_played[team_indexes[team], alliance_indexes[alliance]] = 1
+        return team_indexes, alliances_played @ alliance_tims.T
+
+    def find_team_documents(
+        self, collection: str, team: str, loaded: Optional[Dict[str, Dict[str, List[Dict]]]] = None
+    ) -> List[Dict]:
+        """Returns the documents of a team in a collection
+
+        loaded is a dictionary of collection names to team numbers to their documents, collections
+        that aren't in it are read from the database
+        """
+        if loaded is not None and collection in loaded:
+            return loaded[collection].get(team, [])
+        return self.server.db.find(collection, {"team_number": team})
+
+    @staticmethod
+    def get_loaded_subj_teams(
+        subj_teams: Optional[Dict[str, Dict]],
+    ) -> Optional[Dict[str, Dict[str, List[Dict]]]]:
+        """Formats a dictionary of team numbers to subj_team documents for find_team_documents"""
+        if subj_teams is None:
+            return None
+        return {"subj_team": {team: [document] for team, document in subj_teams.items()}}
+
+    def unadjusted_ability_calcs(
+        self, team: str, subj_tims: Optional[List[Dict]] = None
+    ) -> Dict[str, float]:
         """Retrieves subjective AIM info for the given team and returns a dictionary with
-        calculations for that team"""
+        calculations for that team
+
+        subj_tims are the team's subj_tims, they are loaded from the database if not given
+        """
+        loaded = {"subj_tim": {team: subj_tims}} if subj_tims is not None else None
         calculations = {}
         # self.SCHEMA['data'] tells us which fields we need to put in the database that don't
         # require calculations
@@ -58,7 +121,7 @@ class SubjTeamCalcs(base_calculations.BaseCalculations):
             team_rankings = []
             ignore_filter = lambda data: not ("ignore" in calc_info and data in calc_info["ignore"])
             is_list = calc_info["type"] == "List"
-            for tim in self.server.db.find(collection_name, {"team_number": team}):
+            for tim in self.find_team_documents(collection_name, team, loaded):
                 tim_value = tim[ranking_name]
                 if is_list:
                     team_rankings.append(tim_value)
@@ -77,22 +140,32 @@ class SubjTeamCalcs(base_calculations.BaseCalculations):
             calculations[calc_name] = average_team_rankings
         return calculations
 
-    def adjusted_ability_calcs(self) -> Dict[str, Dict[int, float]]:
+    def adjusted_ability_calcs(
+        self,
+        subj_teams: Optional[Dict[str, Dict]] = None,
+        subj_tims: Optional[List[Dict]] = None,
+    ) -> Dict[str, Dict[int, float]]:
         """Retrieves subjective AIM data for all teams and recalculates adjusted ability scores
         for each team. Recalculating all of them is necessary because ability scores compensate for
         luck of match schedule, so a team's ability score will depend on the unadjusted
-        scores for all of their alliance partners"""
+        scores for all of their alliance partners
+
+        subj_teams (team numbers to subj_team documents) and subj_tims are loaded from the
+        database if not given"""
         # If no teams have competed yet, there is not point in running the calculation
         if len(self.teams_that_have_competed) == 0:
             return {}
 
         calculations = {}
+        loaded = self.get_loaded_subj_teams(subj_teams)
+        # Only load partners once, instead of for every team for every calculation
+        partners = self.get_partner_matrix(subj_tims)
         for calc_name, calc_info in self.SCHEMA["component_calculations"].items():
             collection_name, _, unadjusted_calc = calc_info["requires"][0].partition(".")
             # scores is a dictionary of team numbers to rank score
             scores = {}
             for team in self.teams_that_have_competed:
-                tim = self.server.db.find(collection_name, {"team_number": team})
+                tim = self.find_team_documents(collection_name, team, loaded)
                 if tim:
                     scores[team] = tim[0][unadjusted_calc]
             # Now scale the scores so they range from 0 to 1, and use those scaled scores to
@@ -108,9 +181,10 @@ class SubjTeamCalcs(base_calculations.BaseCalculations):
                         calculations,
                         calc_name,
                         index,
+                        partners,
                     )
             else:
-                self.scale_scores(scores, calculations, calc_name)
+                self.scale_scores(scores, calculations, calc_name, partners=partners)
         return calculations
 
     def scale_scores(
@@ -119,30 +193,54 @@ class SubjTeamCalcs(base_calculations.BaseCalculations):
         calculations: Dict[str, Dict[str, float]],
         calc_name: str,
         index: int = None,
+        partners: Optional[Tuple[Dict[str, int], np.ndarray]] = None,
     ) -> None:
-        """Calculates scores adjusted for teammate score and scaled from 0 to 1"""
+        """Calculates scores adjusted for teammate score and scaled from 0 to 1
+
+        partners is the output of get_partner_matrix, it is loaded from the database if not given
+        """
         worst = min(scores.values())
         best = max(scores.values())
-        scaled_scores = {
-            team: (((score - worst) / (best - worst)) if best - worst != 0 else 0)
-            for team, score in scores.items()
-        }
-        for team, score in scores.items():
-            teammate_scaled_scores = [
-                scaled_scores[partner] for partner in self.teams_played_with(team)
+        scaled_scores = np.array(
+            [
+                ((score - worst) / (best - worst)) if best - worst != 0 else 0
+                for score in scores.values()
             ]
+        )
+        team_indexes, partner_matrix = (
+            partners if partners is not None else self.get_partner_matrix()
+        )
+        # Partner counts between the teams with scores, teams without a subj_tim have no partners
+        score_indexes = [team_indexes.get(team) for team in scores]
+        has_partners = np.array([team_index is not None for team_index in score_indexes])
+        rows = [team_index for team_index in score_indexes if team_index is not None]
+        team_partners = np.zeros((len(scores), len(scores)))
+        team_partners[np.ix_(has_partners, has_partners)] = partner_matrix[np.ix_(rows, rows)]
+        partner_counts = team_partners.sum(axis=1)
+        # Average scaled score of each team's partners, 0 if a team has no partners
+        teammate_averages = np.divide(
+            team_partners @ scaled_scores,
+            partner_counts,
+            out=np.zeros(len(scores)),
+            where=partner_counts != 0,
+        )
+        for (team, score), teammate_average in zip(scores.items(), teammate_averages.tolist()):
             calculations[team] = calculations.get(team, {})
             # If teammates tend to rank low, the team's score is lowered more than if teammates tend to rank high
             if index is None:
-                calculations[team][calc_name] = score * self.avg(teammate_scaled_scores)
+                calculations[team][calc_name] = score * teammate_average
             elif index == 0:
-                calculations[team][calc_name] = [score * self.avg(teammate_scaled_scores)]
+                calculations[team][calc_name] = [score * teammate_average]
             else:
-                calculations[team][calc_name].append(score * self.avg(teammate_scaled_scores))
+                calculations[team][calc_name].append(score * teammate_average)
+
+    def calculate_driver_ability(self, subj_teams: Optional[Dict[str, Dict]] = None):
+        """Takes a weighted average of all the adjusted component scores to calculate overall driver ability.
 
-    def calculate_driver_ability(self):
-        """Takes a weighted average of all the adjusted component scores to calculate overall driver ability."""
+        subj_teams is a dictionary of team numbers to subj_team documents, they are loaded from the
+        database if not given"""
         calculations = {}
+        loaded = self.get_loaded_subj_teams(subj_teams)
         for calc_name, calc_info in self.SCHEMA["averaged_calculations"].items():
             # ability_dict is a dictionary where keys are team numbers
             # and values are driver_ability scores
@@ -155,7 +253,7 @@ class SubjTeamCalcs(base_calculations.BaseCalculations):
                 for requirement in calc_info["requires"]:
                     collection_name, _, score_name = requirement.partition(".")
                     scores.append(
-                        self.server.db.find(collection_name, {"team_number": team})[0][score_name]
+                        self.find_team_documents(collection_name, team, loaded)[0][score_name]
                     )
                 # driver_ability is a weighted average of its component scores
                 ability_dict[team] = self.avg(scores, calc_info["weights"])
@@ -179,34 +277,49 @@ class SubjTeamCalcs(base_calculations.BaseCalculations):
         info, then puts those calculations in the database"""
         # Get calc start time
         start_time = time.time()
+        # Load subj_tim and subj_team once, then run every stage in memory
+        subj_tims = self.server.db.find("subj_tim")
+        team_subj_tims = {}
+        for tim in subj_tims:
+            team_subj_tims.setdefault(tim["team_number"], []).append(tim)
         # Adjusted calcs have to be re-run on all teams that have competed
         # because team data changing for one team affects all teams that played with that team
-        self.teams_that_have_competed = set()
-        for tim in self.server.db.find("subj_tim"):
-            self.teams_that_have_competed.add(tim["team_number"])
+        self.teams_that_have_competed = set(team_subj_tims.keys())
         # Delete and re-insert if updating all data
         if self.calc_all_data:
             self.server.db.delete_data("subj_team")
+        subj_teams = {
+            document["team_number"]: document for document in self.server.db.find("subj_team")
+        }
+        # Team numbers to everything that changed in their subj_team document
+        updates = {}
+
+        def update_team(team, new_calc):
+            updates.setdefault(team, {}).update(new_calc)
+            subj_teams.setdefault(team, {"team_number": team}).update(new_calc)
+
         # See which teams are affected by new subj TIM data
         updated_teams = self.get_updated_teams()
         for team in updated_teams:
-            new_calc = self.unadjusted_ability_calcs(team)
-            self.server.db.update_document(
-                "subj_team", new_calc, {"team_number": new_calc["team_number"]}
-            )
+            update_team(team, self.unadjusted_ability_calcs(team, team_subj_tims.get(team, [])))
         if len(self.teams_that_have_competed) != 0:
             # Now use the new info to recalculate adjusted ability scores
-            adjusted_calcs = self.adjusted_ability_calcs()
+            adjusted_calcs = self.adjusted_ability_calcs(subj_teams, subj_tims)
             for team in self.teams_that_have_competed:
-                self.server.db.update_document(
-                    "subj_team", adjusted_calcs[team], {"team_number": team}
-                )
+                update_team(team, adjusted_calcs[team])
             # Use the adjusted ability scores to calculate driver ability
-            driver_ability_calcs = self.calculate_driver_ability()
+            driver_ability_calcs = self.calculate_driver_ability(subj_teams)
             for team in self.teams_that_have_competed:
-                self.server.db.update_document(
-                    "subj_team", driver_ability_calcs[team], {"team_number": team}
-                )
+                update_team(team, driver_ability_calcs[team])
+        # Write each team's document once
+        if updates:
+            self.server.db.bulk_write(
+                "subj_team",
+                [
+                    pymongo.UpdateOne({"team_number": team}, {"$set": update}, upsert=True)
+                    for team, update in updates.items()
+                ],
+            )
         end_time = time.time()
         # Get total calc time
         total_time = end_time - start_time
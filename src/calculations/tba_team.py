@@ -2,14 +2,14 @@
 
 """Runs team calculations dependent on TBA data"""
 
-from typing import Dict, List
+from typing import Dict, List, Optional
 from calculations import base_calculations
 import utils
 from server import Server
 from data_transfer import tba_communicator
 import numpy as np
 import numpy.linalg as nl
-from cc import cc, CCEvent
+from cc import CCMetricsEvent, IncrementalCC
 import logging
 import time
 
@@ -28,6 +28,8 @@ class TBATeamCalc(base_calculations.BaseCalculations):
         """Overrides watched collections, passes server object"""
         super().__init__(server)
         self.watched_collections = ["obj_tim", "tba_tim"]
+        # Normal equations of the CCs of every match so far
+        self.cc_solver = IncrementalCC()
 
     def tim_counts(self, obj_tims, tba_tims):
         """Gets the counts for each schema entry for the given tims"""
@@ -79,44 +81,75 @@ class TBATeamCalc(base_calculations.BaseCalculations):
             out["leave_success_rate"] = out["leave_successes"] / (match_count)
         return out
 
-    def calculate_cc(self, cc_type, precision: int = 2) -> Dict[str, float]:
+    def get_tba_matches(self) -> List[dict]:
+        """Gets the matches at the event from the TBA cache, or from TBA if they aren't cached"""
+        matches_endpoint = f"event/{Server.TBA_EVENT_KEY}/matches"
+        matches_resp = self.server.db.get_tba_cache(matches_endpoint)
+        if matches_resp is None:
+            matches_resp = {"data": tba_communicator.tba_request(matches_endpoint)}
+        return matches_resp.get("data", [])
+
+    @staticmethod
+    def get_match_cc_events(match: dict) -> List[CCMetricsEvent]:
+        """Creates a CC event for each alliance in a match, with the value of every numeric
+        score_breakdown field of the alliance. Returns an empty list if the match wasn't played
+
+        Foul points are given to an alliance for the fouls of the other alliance, so each event also
+        has the foul points its alliance gave to the other alliance as "foul"
         """
-        Calculates the amount of foul/link points each team contributes.
+        if match.get("score_breakdown", None) is None:
+            return []
+        cc_aims: List[CCMetricsEvent] = []
+        for alliance, other_alliance in [("red", "blue"), ("blue", "red")]:
+            breakdown = match["score_breakdown"][alliance]
+            values = {
+                field: value
+                for field, value in breakdown.items()
+                if isinstance(value, (int, float)) and not isinstance(value, bool)
+            }
+            values["foul"] = match["score_breakdown"][other_alliance]["foulPoints"]
+            cc_aims.append({"parties": utils.get_teams_in_match(match, alliance), "values": values})
+        return cc_aims
+
+    def get_cc_events(self, tba_matches: List[dict]) -> List[CCMetricsEvent]:
+        """Creates a CC event for each alliance in each played match, see get_match_cc_events"""
+        return [event for match in tba_matches for event in self.get_match_cc_events(match)]
+
+    def calculate_ccs(
+        self, tba_matches: Optional[List[dict]] = None, precision: int = 2
+    ) -> Dict[str, Dict[str, float]]:
+        """
+        Calculates the amount each team contributes to every numeric score_breakdown field at once,
+        which looks like {team_number: {field: cc}}.
 
         Calculated contribution (a.k.a. OPR) is a method of estimating the amount of something a team contributes to an alliance.
 
-        It uses a numpy matrix and calculates a least squares solution for each team.
+        The normal equations are kept between runs, so only matches that were played or changed
+        since the last run are added to them, and the cached factorization is updated instead of
+        solving every match again.
 
         See Also
         ---------
         TBA Blog post discussing OPR https://blog.thebluealliance.com/2017/10/05/the-math-behind-opr-an-introduction/
         """
-        matches_endpoint = f"event/{Server.TBA_EVENT_KEY}/matches"
-        matches_resp = self.server.db.get_tba_cache(matches_endpoint)
-        if matches_resp is None:
-            matches_resp = {"data": tba_communicator.tba_request(matches_endpoint)}
-        tba_matches = matches_resp.get("data", [])
-        cc_aims: List[CCEvent] = []
-        if cc_type == "foul":
-            # For each AIM, add the foul points for the other alliance in a dictionary
-            # with the team numbers and foul points contributed
-            for match in tba_matches:
-                if match.get("score_breakdown", None) is None:
-                    continue
-                cc_aims.append(
-                    {
-                        "parties": utils.get_teams_in_match(match, "red"),
-                        "value": match["score_breakdown"]["blue"]["foulPoints"],
-                    }
-                )
-                cc_aims.append(
-                    {
-                        "parties": utils.get_teams_in_match(match, "blue"),
-                        "value": match["score_breakdown"]["red"]["foulPoints"],
-                    }
-                )
-        solved = cc(cc_aims)
-        return solved
+        if tba_matches is None:
+            tba_matches = self.get_tba_matches()
+        for match_index, match in enumerate(tba_matches):
+            for alliance_index, event in enumerate(self.get_match_cc_events(match)):
+                self.cc_solver.add_event(event, (match.get("key", match_index), alliance_index))
+        return self.cc_solver.solve(precision)
+
+    def calculate_cc(self, cc_type, precision: int = 2) -> Dict[str, float]:
+        """
+        Calculates the amount of foul/link points each team contributes.
+
+        cc_type is "foul" or the name of a score_breakdown field, see calculate_ccs
+        """
+        return {
+            team: ccs[cc_type]
+            for team, ccs in self.calculate_ccs(precision=precision).items()
+            if cc_type in ccs
+        }
 
     def update_team_calcs(self, teams: list) -> list:
         """Returns updates to team calculations based on refs"""
@@ -130,8 +163,10 @@ class TBATeamCalc(base_calculations.BaseCalculations):
 
         tba_team_updates = {}
 
-        foul_ccs = self.calculate_cc(cc_type="foul")
-        link_ccs = self.calculate_cc(cc_type="link")
+        # Calculate every CC with one solve
+        ccs = self.calculate_ccs()
+        foul_ccs = {team: team_ccs["foul"] for team, team_ccs in ccs.items() if "foul" in team_ccs}
+        link_ccs = {team: team_ccs["link"] for team, team_ccs in ccs.items() if "link" in team_ccs}
         for team in teams:
             # Load team data from database
             obj_tims = self.server.db.find("obj_tim", {"team_number": team})
@@ -168,6 +203,7 @@ class TBATeamCalc(base_calculations.BaseCalculations):
         # Delete and re-insert if updating all data
         if self.calc_all_data:
             self.server.db.delete_data("tba_team")
+            self.cc_solver = IncrementalCC()
         for update in self.update_team_calcs(self.get_updated_teams()):
             self.server.db.update_document(
                 "tba_team", update, {"team_number": update["team_number"]}
@@ -2,7 +2,6 @@
 
 """Run TIM calculations dependent on TBA data."""
 
-import copy
 from typing import List, Dict, Tuple, Any
 
 from calculations import base_calculations
@@ -10,6 +9,7 @@ from data_transfer import tba_communicator
 import utils
 from server import Server
 import logging
+import pymongo
 import time
 
 log = logging.getLogger(__name__)
@@ -26,6 +26,7 @@ class TBATIMCalc(base_calculations.BaseCalculations):
         """Creates an empty list to add references of calculated tims to"""
         super().__init__(server)
         self.calculated = set([tim["match_number"] for tim in self.server.db.find("tba_tim")])
+        self.slot_requirements = self.compile_schema(self.SCHEMA)
 
     def entries_since_last(self) -> List[Dict[str, Any]]:
         """Checks for uncalculated matches, returns the match data
@@ -160,64 +161,91 @@ class TBATIMCalc(base_calculations.BaseCalculations):
             i += 1
         return teams_climbed_opposite
 
-    def calculate_tim(self, team_number: str, match) -> List[Dict[str, Any]]:
-        """Given a team number and a match that it's from, calculate that tim"""
+    @staticmethod
+    def compile_schema(schema: Dict[str, Dict]) -> Dict[int, List[Tuple[str, Tuple]]]:
+        """Creates the requirements of each calculation for each robot number, which looks like
+        {1: [("leave", (("autoLineRobot1", "Yes"),)), ("spotlight", ()), ...], 2: [...], 3: [...]}
+
+        type does not need to be in the final data, so it is removed, and a number is added after
+        each field that ends in Robot, so {"type": "bool", "autoLineRobot": "Yes"} becomes
+        (("autoLineRobot1", "Yes"),) for robot 1
+        """
+        return {
+            robot_number: [
+                (
+                    calculation,
+                    tuple(
+                        (f"{field}{robot_number}" if field.endswith("Robot") else field, value)
+                        for field, value in tim_requirements.items()
+                        if field != "type"
+                    ),
+                )
+                for calculation, tim_requirements in schema.items()
+            ]
+            for robot_number in range(1, 4)
+        }
+
+    def get_match_calculations(self, match) -> Dict[str, Any]:
+        """Calculates the spotlit teams, driver stations and teams that climbed opposite once for
+        every team in a match"""
+        return {
+            "spotlight": set(self.calculate_spotlight(match)),
+            "driver_station": self.calculate_driver_stations(match),
+            "climbed_opposite": set(self.calculate_climbed_opposite(match)),
+        }
+
+    def calculate_slot_tim(
+        self,
+        team_number: str,
+        match,
+        robot_number: int,
+        alliance: str,
+        match_calculations: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        """Calculates the tim of the team in a robot slot (robot number and alliance) of a match,
+        using the calculations from get_match_calculations"""
         match_number: int = match["match_number"]
         tim = {"team_number": team_number, "match_number": match_number}
+        breakdown = match["score_breakdown"][alliance]
+        for calculation, requirements in self.slot_requirements[robot_number]:
+            if calculation == "driver_station":
+                tim[calculation] = match_calculations["driver_station"][team_number]
+            elif calculation == "climbed_opposite":
+                tim[calculation] = team_number in match_calculations["climbed_opposite"]
+            # Only calculate bools for each calculation if the match number is valid
+            elif isinstance(match_number, int):
+                if calculation == "spotlight":
+                    tim[calculation] = team_number in match_calculations["spotlight"]
+                else:
+                    tim[calculation] = all(
+                        breakdown[field] == value for field, value in requirements
+                    )
+        return tim
 
+    def calculate_tim(self, team_number: str, match) -> List[Dict[str, Any]]:
+        """Given a team number and a match that it's from, calculate that tim"""
         # Check if an important thing like score_breakdown is in the match data
         if match["score_breakdown"] is None:
-            log.warning(f"TBA TIM Calculation on {match_number} missing match data")
+            log.warning(f"TBA TIM Calculation on {match['match_number']} missing match data")
 
         robot_number, alliance = self.get_robot_number_and_alliance(team_number, match)
-        match_spotlit_teams = self.calculate_spotlight(match)
-        driver_stations = self.calculate_driver_stations(match)
-        teams_climbed_opposite = self.calculate_climbed_opposite(match)
-
-        for calculation, tim_requirements in self.SCHEMA.items():
-            # calculation is the name of the field, like "mobility" for example
-            # tim_requirements is dict of stuff including {"type": "bool"} and something like
-            # {"taxiRobot": "Yes"}
-            tim_requirements_copy = copy.deepcopy(tim_requirements)
-
-            # type does not need to be in the final data, so we remove it
-            # {"type": "bool", "field": "value"} -> {"field": "value"}
-            del tim_requirements_copy["type"]
-
-            # Add a number after each field that ends in Robot
-            # {"field": "value"} -> {"field1": "value"}
-            for field, expected_value in tim_requirements.items():
-                if field.endswith("Robot"):
-                    del tim_requirements_copy[field]
-                    tim_requirements_copy[f"{field}{robot_number}"] = expected_value
-
-            # calculate driver stations
-            if calculation == "driver_station":
-                tim[calculation] = driver_stations[team_number]
-                continue
-
-            # calculate teams climbed opposite
-            if calculation == "climbed_opposite":
-                tim[calculation] = team_number in teams_climbed_opposite
-                continue
-
-            # Fun calc_tba_bool for each calculation, and add it to tim
-            if isinstance(tim["match_number"], int):
-                # since spotlight doesn't have a tim_requirements field
-
-                if calculation == "spotlight":
-                    if team_number in match_spotlit_teams:
-                        tim[calculation] = True
-                    else:
-                        tim[calculation] = False
-                else:
-                    tim[calculation] = self.calc_tba_bool(
-                        match,
-                        alliance,
-                        tim_requirements_copy,
-                    )
+        return self.calculate_slot_tim(
+            team_number, match, robot_number, alliance, self.get_match_calculations(match)
+        )
 
-        return tim
+    def calculate_match_tims(self, match) -> List[Dict[str, Any]]:
+        """Calculates the tims of every team in a match, in the order of get_team_list_from_match"""
+        if match["score_breakdown"] is None:
+            log.warning(f"TBA TIM Calculation on {match['match_number']} missing match data")
+            return []
+        match_calculations = self.get_match_calculations(match)
+        return [
+            self.calculate_slot_tim(team_key[3:], match, robot_number, alliance, match_calculations)
+            for alliance in ["red", "blue"]
+            for robot_number, team_key in enumerate(
+                match["alliances"][alliance]["team_keys"], start=1
+            )
+        ]
 
     def run(self):
         """Executes the TBA Team calculations"""
@@ -231,26 +259,29 @@ class TBATIMCalc(base_calculations.BaseCalculations):
         if self.calc_all_data:
             self.server.db.delete_data("tba_tim")
 
+        # Calculate every tim of every match, then write them with one bulk write
+        calculated_tims = []
         for match in entries:
-            for team_number in self.get_team_list_from_match(match):
-                # Calculate the tim, getting the team and match from entry
-                calculated_tim = self.calculate_tim(team_number, match)
-
-                # Ensure we don't write results from a calculation that errorred
-                if calculated_tim is None:
-                    continue
-
-                # Add the tim ref to calculated, right after it gets calculated
-                self.calculated.add(match["match_number"])
-
-                self.server.db.update_document(
-                    "tba_tim",
-                    calculated_tim,
-                    {
-                        "match_number": calculated_tim["match_number"],
-                        "team_number": calculated_tim["team_number"],
-                    },
-                )
+            calculated_tims.extend(self.calculate_match_tims(match))
+        if calculated_tims:
+            self.server.db.bulk_write(
+                "tba_tim",
+                [
+                    pymongo.UpdateOne(
+                        {
+                            "match_number": calculated_tim["match_number"],
+                            "team_number": calculated_tim["team_number"],
+                        },
+                        {"$set": calculated_tim},
+                        upsert=True,
+                    )
+                    for calculated_tim in calculated_tims
+                ],
+            )
+            # Add the tim refs to calculated, after they are written
+            self.calculated.update(
+                calculated_tim["match_number"] for calculated_tim in calculated_tims
+            )
         end_time = time.time()
         # Get total calc time
         total_time = end_time - start_time
@@ -1,6 +1,8 @@
 import numpy as np
 import numpy.linalg as nl
-from typing import List, TypedDict
+import scipy.linalg as sl
+from scipy import sparse
+from typing import Dict, Hashable, List, Optional, Tuple, TypedDict
 
 
 class CCEvent(TypedDict):
@@ -12,6 +14,132 @@ class CCEvent(TypedDict):
     value: float  # The value of the event
 
 
+class CCMetricsEvent(TypedDict):
+    """
+    Data structure to hold the values of many metrics for a calculated contribution event.
+    """
+
+    parties: List[str]  # List of parties involved in the event
+    values: Dict[str, float]  # The value of each metric for the event
+
+
+def incidence_matrix(events: List[List[str]]) -> Tuple[List[str], sparse.csr_matrix]:
+    """
+    Creates a sparse matrix of which parties are involved in each event.
+
+    Parameters
+    ----------
+    events : List[List[str]]
+        The parties involved in each event.
+
+    Returns
+    -------
+    Tuple[List[str], sparse.csr_matrix]
+        The sorted parties, and an events x parties matrix which is 1 where a party is involved
+        in an event.
+    """
+    parties = sorted({party for event in events for party in event})
+    party_indexes = {party: index for index, party in enumerate(parties)}
+    # A party listed twice is still only involved in an event once
+    events = [list(dict.fromkeys(event)) for event in events]
+    rows = [event_index for event_index, event in enumerate(events) for _ in event]
+    columns = [party_indexes[party] for event in events for party in event]
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows)), (rows, columns)), shape=(len(events), len(parties))
+    )
+    return parties, matrix
+
+
+def factor_normal_equations(left_side: np.ndarray) -> Optional[tuple]:
+    """
+    Factors the normal equations so they can be solved for many right sides.
+
+    Parameters
+    ----------
+    left_side : np.ndarray
+        The parties x parties matrix AᵀA.
+
+    Returns
+    -------
+    Optional[tuple]
+        The Cholesky factorization of the left side, or None if the equations don't have a unique
+        solution (e.g. a party that is always with the same partner).
+    """
+    try:
+        factor = sl.cho_factor(left_side)
+    except sl.LinAlgError:
+        return None
+    # Rounding errors can leave a tiny positive pivot instead of failing when the matrix is singular
+    pivots = np.abs(np.diag(factor[0]))
+    if len(pivots) == 0 or pivots.min() ** 2 <= 1e-10 * pivots.max() ** 2:
+        return None
+    return factor
+
+
+def solve_normal_equations(left_side: np.ndarray, right_side: np.ndarray) -> np.ndarray:
+    """
+    Solves the normal equations for every column of the right side with one factorization.
+
+    Parameters
+    ----------
+    left_side : np.ndarray
+        The parties x parties matrix AᵀA.
+    right_side : np.ndarray
+        The parties x metrics matrix Aᵀb.
+
+    Returns
+    -------
+    np.ndarray
+        The parties x metrics calculated contributions.
+    """
+    if (factor := factor_normal_equations(left_side)) is not None:
+        return sl.cho_solve(factor, right_side)
+    # Without a unique solution, use the least squares solution with the smallest values
+    return nl.lstsq(left_side, right_side, rcond=None)[0]
+
+
+def cc_metrics(data: List[CCMetricsEvent], precision: int = 2) -> Dict[str, Dict[str, float]]:
+    """
+    Calculates the contribution of each party to every metric of a set of events at once.
+
+    The matrix of which parties are involved in each event is the same for every metric, so it is
+    built and factored once, and each metric only adds a column to the right side of the equation.
+
+    Parameters
+    ----------
+    data : List[CCMetricsEvent]
+        A list of `CCMetricsEvent` objects, representing each event. Metrics missing from an
+        event count as 0.
+    precision : int, optional
+        The precision to round the calculated contributions to. Default is 2.
+
+    Returns
+    -------
+    Dict[str, Dict[str, float]]
+        A dictionary mapping party names to the calculated contribution to each metric.
+    """
+    if not data:
+        return {}
+    parties, matrix = incidence_matrix([event["parties"] for event in data])
+    # Metrics in the order they are first seen
+    metrics = list({metric: None for event in data for metric in event["values"]})
+    values = np.array(
+        [[event["values"].get(metric, 0) for metric in metrics] for event in data], dtype=float
+    ).reshape(len(data), len(metrics))
+
+    transposed_matrix = matrix.transpose().tocsr()
+    left_side = (transposed_matrix @ matrix).toarray()
+    right_side = transposed_matrix @ values
+    solved = solve_normal_equations(left_side, right_side)
+    return {
+        party: {
+            metric: round(float(solved[party_index, metric_index]), precision)
+            for metric_index, metric in enumerate(metrics)
+        }
+        for party_index, party in enumerate(parties)
+    }
+
+
 def cc(data: List[CCEvent], precision: int = 2) -> dict:
     """
     Calculates the contribution of each party to a set of events.
@@ -28,38 +156,200 @@ def cc(data: List[CCEvent], precision: int = 2) -> dict:
     dict
         A dictionary mapping party names to their calculated contribution.
     """
-    # Create a set to store the unique parties involved in the events
-    parties = set()
+    solved = cc_metrics(
+        [{"parties": event["parties"], "values": {"value": event["value"]}} for event in data],
+        precision,
+    )
+    return {party: ccs["value"] for party, ccs in solved.items()}
+
+
+class IncrementalCC:
+    """
+    Calculates the contributions of parties to many metrics, updating the normal equations as
+    each event is added instead of rebuilding them from every event.
+
+    Each new event is a rank one update to AᵀA, which is also applied to the cached Cholesky
+    factorization, so solving after an event doesn't need a new factorization. Until the events
+    have a unique solution (e.g. early in a competition), there is no factorization, and the
+    equations are solved with the same least squares solution as `cc_metrics`, unless
+    regularization is given. The equations are small while they are underdetermined, so this is
+    still fast.
+    """
+
+    def __init__(self, regularization: float = 0):
+        """
+        Parameters
+        ----------
+        regularization : float, optional
+            Amount added to the diagonal of AᵀA when it is singular. Larger values move the
+            contributions of parties with few events towards 0, instead of using the least squares
+            solution. Default is 0, which gives the same contributions as `cc_metrics`.
+        """
+        self.regularization = regularization
+        self.parties: List[str] = []
+        self.party_indexes: Dict[str, int] = {}
+        self.metrics: List[str] = []
+        self.metric_indexes: Dict[str, int] = {}
+        # Number of events with each metric, so metrics are removed with their last event
+        self.metric_counts: Dict[str, int] = {}
+        # AᵀA and Aᵀb, with a row for each party and a column of Aᵀb for each metric
+        self.left_side = np.zeros((0, 0))
+        self.right_side = np.zeros((0, 0))
+        # Events by key, so an event is replaced if its values change
+        self.events: Dict[Hashable, CCMetricsEvent] = {}
+        # Upper triangular Cholesky factor of the left side, None if it needs to be recalculated
+        # or if the equations are underdetermined
+        self.factor: Optional[np.ndarray] = None
+        self.is_underdetermined = False
+
+    def add_event(self, event: CCMetricsEvent, key: Optional[Hashable] = None) -> bool:
+        """
+        Adds an event to the normal equations.
+
+        Parameters
+        ----------
+        event : CCMetricsEvent
+            The parties and metric values of the event. Metrics missing from an event count as 0.
+        key : Hashable, optional
+            Identifies the event. An event with the key of an earlier event replaces it. Default
+            is the number of events already added.
+
+        Returns
+        -------
+        bool
+            Whether the normal equations changed.
+        """
+        if key is None:
+            key = len(self.events)
+        if key in self.events:
+            if self.events[key] == event:
+                return False
+            self.update_equations(self.events[key], -1)
+            # Removing an event from the factorization is not numerically stable, so refactor
+            self.factor = None
+        self.events[key] = event
+        self.update_equations(event, 1)
+        return True
 
-    # Iterate through each event to add each involved party to the set
-    for event in data:
-        for party in event["parties"]:
-            parties.add(party)
+    def update_equations(self, event: CCMetricsEvent, sign: int) -> None:
+        """Adds (sign=1) or removes (sign=-1) the values of an event from the normal equations"""
+        parties = list(dict.fromkeys(event["parties"]))
+        for party in parties:
+            if party not in self.party_indexes:
+                self.party_indexes[party] = len(self.parties)
+                self.parties.append(party)
+                self.left_side = np.pad(self.left_side, ((0, 1), (0, 1)))
+                self.right_side = np.pad(self.right_side, ((0, 1), (0, 0)))
+                self.factor = None
+        for metric in event["values"]:
+            if metric not in self.metric_indexes:
+                self.metric_indexes[metric] = len(self.metrics)
+                self.metrics.append(metric)
+                self.right_side = np.pad(self.right_side, ((0, 0), (0, 1)))
+            self.metric_counts[metric] = self.metric_counts.get(metric, 0) + sign
 
-    # Sort the parties and create a matrix to store the parties' involvement in each event
-    parties = sorted(parties)
-    party_matrix = np.zeros((len(parties), len(data)))
+        indexes = np.array([self.party_indexes[party] for party in parties], dtype=int)
+        self.left_side[np.ix_(indexes, indexes)] += sign
+        metric_indexes = np.array(
+            [self.metric_indexes[metric] for metric in event["values"]], dtype=int
+        )
+        values = np.array(list(event["values"].values()), dtype=float)
+        self.right_side[np.ix_(indexes, metric_indexes)] += sign * values
 
-    # Create a matrix to store the values of each event
-    value_matrix = np.zeros((1, len(data)))
+        if sign > 0 and self.factor is not None and not self.is_underdetermined:
+            vector = np.zeros(len(self.parties))
+            vector[indexes] = 1
+            self.update_factor(self.factor, vector)
+        elif sign < 0:
+            self.remove_unused()
 
-    # Iterate through each event to fill the party matrix and value matrix
-    for event_index, event in enumerate(data):
-        for team in event["parties"]:
-            party_matrix[parties.index(team), event_index] = 1
-        value_matrix[0, event_index] = event["value"]
+    def remove_unused(self) -> None:
+        """Removes the parties and metrics that are no longer in any event"""
+        # The diagonal of AᵀA is the number of events of each party
+        if len(unused_parties := np.flatnonzero(np.diag(self.left_side) == 0)) > 0:
+            self.left_side = np.delete(
+                np.delete(self.left_side, unused_parties, axis=0), unused_parties, axis=1
+            )
+            self.right_side = np.delete(self.right_side, unused_parties, axis=0)
+            self.parties = [
+                party for index, party in enumerate(self.parties) if index not in unused_parties
+            ]
+            self.party_indexes = {party: index for index, party in enumerate(self.parties)}
+            self.factor = None
+        if unused_metrics := [metric for metric, count in self.metric_counts.items() if count == 0]:
+            self.right_side = np.delete(
+                self.right_side, [self.metric_indexes[metric] for metric in unused_metrics], axis=1
+            )
+            self.metrics = [metric for metric in self.metrics if metric not in unused_metrics]
+            self.metric_indexes = {metric: index for index, metric in enumerate(self.metrics)}
+            for metric in unused_metrics:
+                del self.metric_counts[metric]
 
-    # Transpose the party matrix to prepare it for matrix multiplication
-    transposed_party_matrix = np.transpose(party_matrix)
+    @staticmethod
+    def update_factor(factor: np.ndarray, vector: np.ndarray) -> None:
+        """
+        Updates an upper triangular Cholesky factor R of a matrix M in place, so it becomes the
+        factor of M + vector vectorᵀ. This takes O(n²) time instead of the O(n³) of refactoring.
+        """
+        vector = vector.astype(float)
+        for k in range(len(vector)):
+            if vector[k] == 0:
+                continue
+            diagonal = np.hypot(factor[k, k], vector[k])
+            cos, sin = diagonal / factor[k, k], vector[k] / factor[k, k]
+            factor[k, k] = diagonal
+            factor[k, k + 1 :] = (factor[k, k + 1 :] + sin * vector[k + 1 :]) / cos
+            vector[k + 1 :] = cos * vector[k + 1 :] - sin * factor[k, k + 1 :]
 
-    # Multiply the party matrix with its transpose to get the left side of the equation
-    left_side = np.matmul(party_matrix, transposed_party_matrix)
+    def get_factor(self) -> Optional[np.ndarray]:
+        """Returns the Cholesky factor of the left side, factoring it if needed. Returns None if
+        the equations are underdetermined, which is checked again each time until they aren't"""
+        if self.factor is None:
+            if (factor := factor_normal_equations(self.left_side)) is not None:
+                # cho_factor leaves other values below the diagonal
+                self.factor = np.triu(factor[0])
+                self.is_underdetermined = False
+            else:
+                self.is_underdetermined = True
+        return self.factor
 
-    # Multiply the value matrix with the transposed party matrix to get the right side of the equation
-    right_side = np.matmul(value_matrix, transposed_party_matrix)
+    def solve(self, precision: int = 2) -> Dict[str, Dict[str, float]]:
+        """
+        Solves the normal equations of the events added so far.
 
-    # Solve the equation to get the calculated contribution of each party
-    solved = nl.lstsq(left_side, right_side.transpose(), rcond=None)[0]
+        Returns
+        -------
+        Dict[str, Dict[str, float]]
+            A dictionary mapping party names to the calculated contribution to each metric, in the
+            same format as `cc_metrics`.
+        """
+        if not self.parties:
+            return {}
+        if (factor := self.get_factor()) is not None:
+            solved = sl.cho_solve((factor, False), self.right_side)
+        elif self.regularization > 0:
+            solved = sl.solve(
+                self.left_side + self.regularization * np.eye(len(self.parties)),
+                self.right_side,
+                assume_a="pos",
+            )
+        else:
+            solved = nl.lstsq(self.left_side, self.right_side, rcond=None)[0]
+        return {
+            party: {
+                metric: round(float(solved[self.party_indexes[party], metric_index]), precision)
+                for metric_index, metric in enumerate(self.metrics)
+            }
+            for party in sorted(self.parties)
+        }
 
-    # Return the calculated contribution rounded to the specified precision
-    return {parties[i]: round(cc[0], precision) for i, cc in enumerate(solved)}
+    def matches_full_solve(self, precision: int = 2) -> bool:
+        """Checks that the contributions are the same as solving every event with `cc_metrics`,
+        which is only expected without regularization"""
+        full_solve = cc_metrics(list(self.events.values()), precision)
+        incremental_solve = self.solve(precision)
+        return full_solve.keys() == incremental_solve.keys() and all(
+            abs(incremental_solve[party].get(metric, 0) - value) <= 1.5 * 10**-precision
+            for party, ccs in full_solve.items()
+            for metric, value in ccs.items()
+        )
@@ -36,6 +36,7 @@ VALID_COLLECTIONS = [
     "raw_obj_pit",
     "ss_tim",
     "ss_team",
+    "scout_precision",
 ]
 
 # Start mongod and initialize replica set
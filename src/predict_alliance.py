@@ -1,4 +1,8 @@
 from calculations.predicted_aim import *
+import argparse
+import heapq
+import itertools
+import numpy as np
 import server
 from unittest.mock import patch
 
@@ -35,19 +39,152 @@ def predict_alliance(team1, team2, team3, server, obj_team_data, tba_team_data):
     return output
 
 
+def score_alliances(calc, team_indexes, columns, features, team_lists, opponents=None):
+    """Predicts many alliances at once from the team feature matrix of calc.build_team_features
+
+    opponents: list of opposing alliances, the win chance of each alliance is its average win
+    chance against them
+    Returns a dictionary of datapoint names to an array with a value for each alliance
+    """
+    predictions = calc.predict_alliances(
+        columns, features, calc.get_alliance_rows(team_indexes, team_lists)
+    )
+    if opponents:
+        opponent_predictions = calc.predict_alliances(
+            columns, features, calc.get_alliance_rows(team_indexes, opponents)
+        )
+        win_chances = np.zeros(len(team_lists))
+        for opponent in range(len(opponents)):
+            win_chances += calc.calc_win_chances(
+                predictions,
+                {
+                    name: np.full(len(team_lists), opponent_predictions[name][opponent])
+                    for name in ["win_mean", "win_var"]
+                },
+            )
+        predictions["win_chance"] = win_chances / len(opponents)
+    return predictions
+
+
+def evaluate_alliance_combinations(
+    server,
+    teams,
+    fixed_teams=(),
+    alliance_size=3,
+    opponents=None,
+    sort_by="predicted_score",
+    top_k=10,
+    chunk_size=10000,
+    obj_team_data=None,
+):
+    """Scores every alliance made of the fixed teams and a combination of the other teams,
+    and returns the top_k alliances by predicted score or win chance
+
+    teams: teams to pick the rest of each alliance from, e.g. the top 24 teams
+    fixed_teams: teams in every alliance, e.g. our captain
+    opponents: list of opposing alliances, needed to sort by win chance
+    Combinations are enumerated lazily and scored chunk_size at a time, so the team feature matrix
+    is only built once and every combination doesn't need to be in memory at once
+    """
+    if sort_by == "win_chance" and not opponents:
+        raise ValueError("predict_alliance: opponents are needed to sort alliances by win chance")
+    calc = PredictedAimCalc(server)
+    if obj_team_data is None:
+        obj_team_data = server.db.find("obj_team")
+    team_indexes, columns, features = calc.build_team_features(obj_team_data)
+    fixed_teams = list(fixed_teams)
+    other_teams = [team for team in teams if team not in fixed_teams]
+    combinations = itertools.combinations(other_teams, alliance_size - len(fixed_teams))
+
+    # Best alliances so far as (value, -combination number, team list), earlier combinations
+    # come first when values are tied
+    best = []
+    num_scored = 0
+    while chunk := list(itertools.islice(combinations, chunk_size)):
+        team_lists = [fixed_teams + list(combination) for combination in chunk]
+        values = score_alliances(calc, team_indexes, columns, features, team_lists, opponents)[
+            sort_by
+        ]
+        # Only the top_k of each chunk can be in the overall top_k, a stable sort keeps earlier
+        # combinations first when values are tied
+        candidates = np.argsort(-values, kind="stable")[:top_k]
+        best = heapq.nlargest(
+            top_k,
+            best
+            + [(values[index], -(num_scored + index), team_lists[index]) for index in candidates],
+        )
+        num_scored += len(chunk)
+
+    if not best:
+        return []
+    top_team_lists = [team_list for _, _, team_list in best]
+    predictions = score_alliances(calc, team_indexes, columns, features, top_team_lists, opponents)
+    return [
+        {
+            "team_numbers": team_list,
+            **{
+                name: predictions[name][index].item()
+                for name in ["predicted_score", "predicted_rp1", "predicted_rp2"]
+            },
+            **({"win_chance": predictions["win_chance"][index].item()} if opponents else {}),
+        }
+        for index, team_list in enumerate(top_team_lists)
+    ]
+
+
+def parser():
+    parse = argparse.ArgumentParser()
+    parse.add_argument(
+        "--teams", nargs="+", help="Teams to make alliances from, all teams if not given"
+    )
+    parse.add_argument("--fixed", nargs="+", default=[], help="Teams in every alliance")
+    parse.add_argument(
+        "--opponents",
+        nargs="+",
+        default=[],
+        help="Opposing alliances as comma separated team numbers, e.g. 254,971,1323",
+    )
+    parse.add_argument(
+        "--sort_by", choices=["predicted_score", "win_chance"], default="predicted_score"
+    )
+    parse.add_argument("--top_k", type=int, default=10, help="Number of alliances to return")
+    parse.add_argument(
+        "--combinations",
+        help="Score every combination instead of asking for one alliance",
+        default=False,
+        action="store_true",
+    )
+    return parse.parse_args()
+
+
 def main():
+    args = parser()
     with patch("server.Server.ask_calc_all_data", return_value=False):
         server1 = server.Server()
-    log.info(
-        predict_alliance(
-            input("team 1: "),
-            input("team 2: "),
-            input("team 3: "),
-            server1,
-            server1.db.find("obj_team"),
-            server1.db.find("tba_team"),
+    if not args.combinations:
+        log.info(
+            predict_alliance(
+                input("team 1: "),
+                input("team 2: "),
+                input("team 3: "),
+                server1,
+                server1.db.find("obj_team"),
+                server1.db.find("tba_team"),
+            )
         )
-    )
+        return
+    obj_team_data = server1.db.find("obj_team")
+    teams = args.teams or [team_data["team_number"] for team_data in obj_team_data]
+    for alliance in evaluate_alliance_combinations(
+        server1,
+        teams,
+        fixed_teams=args.fixed,
+        opponents=[opponent.split(",") for opponent in args.opponents],
+        sort_by=args.sort_by,
+        top_k=args.top_k,
+        obj_team_data=obj_team_data,
+    ):
+        log.info(alliance)
 
 
 if __name__ == "__main__":
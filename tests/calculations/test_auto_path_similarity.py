@@ -0,0 +1,67 @@
+from calculations import auto_path_similarity
+import numpy as np
+
+
+class TestAutoPathIndex:
+    def setup_method(self):
+        self.index = auto_path_similarity.AutoPathIndex(max_distance=1)
+        self.timelines = {
+            ("254", 1): self.make_timeline("score_speaker", "auto_intake_spike_1", "score_amp"),
+            ("1678", 1): self.make_timeline("score_speaker", "auto_intake_spike_1"),
+            ("1678", 2): self.make_timeline("score_amp", "auto_intake_spike_1", "score_speaker"),
+            ("4414", 1): self.make_timeline("score_speaker", "auto_intake_spike_2", "score_amp"),
+        }
+        for key, timeline in self.timelines.items():
+            self.index.add(key, timeline)
+
+    @staticmethod
+    def make_timeline(*action_types):
+        return [
+            {"in_teleop": False, "time": 150 - num, "action_type": action_type}
+            for num, action_type in enumerate(action_types)
+        ]
+
+    def test_encode_timeline(self):
+        assert self.index.encode_timeline(self.timelines[("254", 1)]).tolist() == [0, 1, 2]
+        # Actions without an action type are skipped
+        assert self.index.encode_timeline(
+            self.timelines[("1678", 2)] + [{"in_teleop": False, "time": 140, "action_type": None}]
+        ).tolist() == [2, 1, 0]
+        assert self.index.encode_timeline([]).tolist() == []
+
+    def test_add(self):
+        assert len(self.index) == 4
+        assert sorted(self.index.groups) == [2, 3]
+        # Adding a key again replaces its timeline
+        self.index.add(("1678", 1), self.make_timeline("score_speaker"))
+        assert len(self.index) == 4
+        assert sorted(self.index.groups) == [1, 3]
+        self.index.remove(("1678", 1))
+        assert len(self.index) == 3
+        assert sorted(self.index.groups) == [3]
+
+    def test_edit_distances(self):
+        sequences = np.array([[0, 1, 2], [0, 2, 1], [2, 1, 0], [3, 3, 3]])
+        assert self.index.edit_distances(np.array([0, 1, 2]), sequences).tolist() == [0, 2, 2, 3]
+        assert self.index.edit_distances(np.array([0, 2]), sequences).tolist() == [1, 1, 3, 3]
+        assert self.index.edit_distances(np.array([], dtype=int), sequences).tolist() == [3] * 4
+
+    def test_find_similar(self):
+        assert self.index.find_similar(self.timelines[("254", 1)]) == [
+            (("254", 1), 0),
+            (("1678", 1), 1),
+            (("4414", 1), 1),
+        ]
+        assert self.index.find_similar(self.make_timeline("score_trap")) == []
+        assert len(self.index.find_similar(self.timelines[("254", 1)], max_distance=2)) == 4
+
+    def test_cluster(self):
+        # 1678's second path scores in the opposite order, so it is not similar to the others
+        assert self.index.cluster() == {
+            ("254", 1): 1,
+            ("1678", 1): 1,
+            ("1678", 2): 2,
+            ("4414", 1): 1,
+        }
+        assert set(self.index.cluster(max_distance=0).values()) == {1, 2, 3, 4}
+        assert set(self.index.cluster(max_distance=2).values()) == {1}
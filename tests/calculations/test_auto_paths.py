@@ -762,6 +762,76 @@ class TestAutoPathCalc:
         self.test_server.db.delete_data("auto_paths", {"team_number": "1678"})
         self.test_server.db.insert_documents("auto_paths", self.expected_group_auto_paths[4])
 
+    def test_build_path_index(self):
+        failed_path = dict(self.expected_group_auto_paths[0], path_number=2, score_2="fail_amp")
+        path_index = self.test_calculator.build_path_index(
+            [self.expected_group_auto_paths[0], failed_path, self.expected_group_auto_paths[1]]
+        )
+        assert set(path_index) == {"254", "1678"}
+        assert set(path_index["254"]["paths"]) == {1, 2}
+        assert list(path_index["254"]["signatures"].values()) == [[1]]
+        assert path_index["254"]["failed_paths"] == {2}
+        # Adding a path with the same path number replaces it
+        self.test_calculator.add_to_path_index(
+            path_index, dict(failed_path, score_2="speaker", num_matches_ran=2)
+        )
+        assert path_index["254"]["paths"][2]["num_matches_ran"] == 2
+        assert path_index["254"]["failed_paths"] == set()
+        assert sorted(path_index["254"]["signatures"].values()) == [[1], [2]]
+
+    def test_find_same_path(self):
+        failed_path = dict(self.expected_group_auto_paths[0], path_number=2, score_2="fail_amp")
+        path_index = self.test_calculator.build_path_index(
+            [failed_path, self.expected_group_auto_paths[0]]
+        )
+        # The lowest path number is used if multiple paths are the same
+        assert (
+            self.test_calculator.find_same_path(self.auto_pims[0], path_index["254"])["path_number"]
+            == 1
+        )
+        # A failed score in the pim matches any path
+        assert (
+            self.test_calculator.find_same_path(
+                dict(self.auto_pims[0], score_1="fail_speaker"), path_index["254"]
+            )
+            == self.expected_group_auto_paths[0]
+        )
+        # Only the path with the failed score matches a different score
+        assert (
+            self.test_calculator.find_same_path(
+                dict(self.auto_pims[0], score_2="speaker"), path_index["254"]
+            )
+            == failed_path
+        )
+        assert (
+            self.test_calculator.find_same_path(
+                dict(self.auto_pims[0], start_position="2"), path_index["254"]
+            )
+            is None
+        )
+
+    def test_find_similar_paths(self):
+        self.test_server.db.delete_data("auto_pim")
+        self.test_server.db.insert_documents(
+            "auto_pim",
+            [
+                dict(self.auto_pims[0], path_number=1),
+                dict(self.auto_pims[2], path_number=1, auto_timeline=[]),
+                dict(self.auto_pims[4], path_number=2),
+            ],
+        )
+        # 1678's path fails its last score
+        assert self.test_calculator.find_similar_paths(self.auto_pims[0]["auto_timeline"]) == [
+            {"team_number": "254", "path_number": 1, "distance": 0},
+            {"team_number": "1678", "path_number": 2, "distance": 1},
+        ]
+        assert len(self.test_calculator.find_similar_paths([], max_distance=5)) == 3
+        assert self.test_calculator.cluster_auto_paths() == {
+            ("254", 1): 1,
+            ("4414", 1): 2,
+            ("1678", 2): 1,
+        }
+
     def test_calculate_auto_paths(self):
         calculated_auto_paths = self.test_calculator.calculate_auto_paths(
             [{"match_number": 42, "team_number": "254"}]
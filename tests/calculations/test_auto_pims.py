@@ -310,11 +310,41 @@ class TestAutoPIMCalc:
             "sim_precision",
         ]
 
+    def test_get_tim_documents(self):
+        tim_documents = self.test_calculator.get_tim_documents(
+            "tba_tim",
+            [
+                {"match_number": 44, "team_number": "4414"},
+                {"match_number": 1, "team_number": "1678"},
+                {"match_number": 2, "team_number": "254"},
+            ],
+        )
+        assert set(tim_documents) == {("4414", 44), ("1678", 1)}
+        assert tim_documents[("4414", 44)][0]["leave"] == True
+        assert [
+            document["scout_name"]
+            for document in self.test_calculator.get_tim_documents(
+                "sim_precision", [{"match_number": 42, "team_number": "254"}]
+            )[("254", 42)]
+        ] == ["EDWIN", "RAY"]
+        assert self.test_calculator.get_tim_documents("tba_tim", []) == {}
+
+    def test_get_auto_timeline(self):
+        assert (
+            self.test_calculator.get_auto_timeline(self.unconsolidated_obj_tims[0]["timeline"])
+            == self.expected_unconsolidated_auto_timelines[0]
+        )
+        assert self.test_calculator.get_auto_timeline([]) == []
+
     def test_get_unconsolidated_auto_timelines(self):
         unconsolidated_auto_timelines = self.test_calculator.get_unconsolidated_auto_timelines(
             self.unconsolidated_obj_tims
         )
         assert unconsolidated_auto_timelines == (self.expected_unconsolidated_auto_timelines, 1)
+        # sim_precision documents can be given instead of queried
+        assert self.test_calculator.get_unconsolidated_auto_timelines(
+            self.unconsolidated_obj_tims, {("254", 42): self.sim_precisions[:1]}
+        ) == (self.expected_unconsolidated_auto_timelines, 0)
 
     def test_consolidate_timelines(self):
         consolidated_timeline = self.test_calculator.consolidate_timelines(
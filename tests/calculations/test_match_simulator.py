@@ -0,0 +1,222 @@
+from calculations import match_simulator
+import numpy as np
+import utils
+
+
+class TestMatchSimulator:
+    def setup_method(self):
+        self.win_chance_fields = {"avg_total_points": {"weight": 1, "sd": "sd_total_points"}}
+        self.endgame_fields = {
+            "onstage_rate": {"var": "stage_percent_success_all"},
+            "climb_after_rate": {"var": "climb_after_percent_success"},
+            "trap_rate": {"var": "trap_percent_success"},
+            "park_rate": {"var": "parked_percent"},
+        }
+        self.obj_team = [
+            {
+                "team_number": "1678",
+                "avg_total_points": 40,
+                "sd_total_points": 0,
+                "auto_avg_speaker": 3,
+                "auto_sd_speaker": 0,
+                "auto_avg_amp": 0,
+                "auto_sd_amp": 0,
+                "tele_avg_unamplified_speaker": 4,
+                "tele_sd_unamplified_speaker": 0,
+                "tele_avg_amplified": 2,
+                "tele_sd_amplified": 0,
+                "tele_avg_amp": 1,
+                "tele_sd_amp": 0,
+                "stage_percent_success_all": 1,
+                "climb_after_percent_success": 1,
+                "trap_percent_success": 0,
+                "parked_percent": 0,
+            },
+            {
+                "team_number": "254",
+                "avg_total_points": 30,
+                "sd_total_points": 0,
+                "auto_avg_speaker": 2,
+                "auto_sd_speaker": 0,
+                "auto_avg_amp": 1,
+                "auto_sd_amp": 0,
+                "tele_avg_unamplified_speaker": 3,
+                "tele_sd_unamplified_speaker": 0,
+                "tele_avg_amplified": 0,
+                "tele_sd_amplified": 0,
+                "tele_avg_amp": 2,
+                "tele_sd_amp": 0,
+                "stage_percent_success_all": 1,
+                "climb_after_percent_success": 0,
+                "trap_percent_success": 0,
+                "parked_percent": 0,
+            },
+            {
+                "team_number": "4414",
+                "avg_total_points": 20,
+                "sd_total_points": 10,
+                "auto_avg_speaker": 1,
+                "auto_sd_speaker": 1,
+                "auto_avg_amp": 0,
+                "auto_sd_amp": 0,
+                "tele_avg_unamplified_speaker": 2,
+                "tele_sd_unamplified_speaker": 2,
+                "tele_avg_amplified": 1,
+                "tele_sd_amplified": 1,
+                "tele_avg_amp": 0,
+                "tele_sd_amp": 0,
+                "stage_percent_success_all": 0,
+                "climb_after_percent_success": 0,
+                "trap_percent_success": 0.5,
+                "parked_percent": 1,
+            },
+        ]
+        self.simulator = match_simulator.MatchSimulator(
+            self.obj_team, self.win_chance_fields, self.endgame_fields, num_simulations=1000
+        )
+
+    def test___init__(self):
+        assert self.simulator.team_indexes == {"1678": 0, "254": 1, "4414": 2}
+        assert self.simulator.score_means.tolist() == [40, 30, 20, 0]
+        assert self.simulator.score_sds.tolist() == [0, 0, 10, 0]
+        assert self.simulator.note_means.tolist() == [10, 8, 4, 0]
+        assert utils.near(self.simulator.note_sds[2], 6**0.5)
+        assert self.simulator.stage_rates["park_rate"].tolist() == [0, 0, 1, 0]
+        assert self.simulator.tim_counts.tolist() == [0, 0, 0, 0]
+
+    def test_load_tims(self):
+        obj_tims = [
+            {
+                "team_number": "1678",
+                "match_number": match_number,
+                "total_points": total_points,
+                "auto_speaker": 1,
+                "auto_amp": 0,
+                "tele_unamplified_speaker": 2,
+                "tele_amplified": 0,
+                "tele_amp": 1,
+            }
+            for match_number, total_points in [(1, 20), (2, 35)]
+        ] + [
+            {
+                "team_number": "9999",
+                "match_number": 1,
+                "total_points": 100,
+                "auto_speaker": 5,
+                "auto_amp": 0,
+                "tele_unamplified_speaker": 10,
+                "tele_amplified": 0,
+                "tele_amp": 0,
+            }
+        ]
+        self.simulator.load_tims(obj_tims)
+        # Teams without obj_team data are ignored
+        assert self.simulator.tim_counts.tolist() == [2, 0, 0, 0]
+        assert self.simulator.tim_scores[0].tolist() == [20, 35]
+        assert self.simulator.tim_notes[0].tolist() == [4, 4]
+
+        # Bootstrapped scores are always one of the team's obj_tim scores
+        samples = self.simulator.sample_teams(
+            np.random.default_rng(0),
+            self.simulator.get_alliance_rows([["1678", "254"]]),
+            self.simulator.score_means,
+            self.simulator.score_sds,
+            self.simulator.tim_scores,
+        )
+        assert set(samples[0, 0].tolist()) == {20, 35}
+        assert set(samples[0, 1].tolist()) == {30}
+
+    def test_get_alliance_rows(self):
+        assert self.simulator.get_alliance_rows(
+            [["1678", "254", "4414"], ["4414", "9999", "1678"]]
+        ).tolist() == [[0, 1, 2], [2, 3, 0]]
+
+    def test_simulate_alliances(self):
+        rows = self.simulator.get_alliance_rows([["1678", "254", "9999"], ["254", "4414", "9999"]])
+        scores, melody, ensemble = self.simulator.simulate_alliances(np.random.default_rng(0), rows)
+        assert scores.shape == (2, 1000)
+        # The first alliance has no variation
+        assert (scores[0] == 70).all()
+        # 18 notes, and 2 teams onstage with a harmony is 8 stage points
+        assert melody[0].all()
+        assert not ensemble[0].any()
+        # Scores are never negative
+        assert (scores[1] >= 30).all()
+        # A trap gives the second alliance 3 + 1 + 5 stage points, which is not enough
+        assert not ensemble[1].any()
+
+    def test_simulate_matches(self):
+        red_rows = self.simulator.get_alliance_rows([["1678", "254"], ["4414", "9999"]])
+        blue_rows = self.simulator.get_alliance_rows([["4414", "9999"], ["4414", "9999"]])
+        results = self.simulator.simulate_matches(red_rows, blue_rows)
+        assert results["R"]["score_quantiles"].shape == (2, len(self.simulator.QUANTILES))
+        assert results["R"]["score_quantiles"][0].tolist() == [70] * 5
+        # 70 points is almost always more than 20 +- 10 points
+        assert results["R"]["win_chance"][0] == 1
+        assert results["B"]["win_chance"][0] == 0
+        # Identical alliances win about half of the time
+        assert abs(results["R"]["win_chance"][1] - 0.5) < 0.05
+        assert utils.near(results["R"]["win_chance"][1] + results["B"]["win_chance"][1], 1)
+        assert results["R"]["rp1_chance"][0] == 1
+        assert results["R"]["avg_rps"][0] == 3
+        # The same seed gives the same results
+        assert (
+            self.simulator.simulate_matches(red_rows, blue_rows)["R"]["score_quantiles"]
+            == results["R"]["score_quantiles"]
+        ).all()
+        # A match gives the same results alone and with other matches
+        alone = self.simulator.simulate_matches(red_rows[1:], blue_rows[1:], [1])
+        batch_rows = self.simulator.get_alliance_rows([["4414", "9999"]] * 3)
+        batch = self.simulator.simulate_matches(batch_rows, batch_rows, [0, 1, 2])
+        for color in ["R", "B"]:
+            for name, values in alone[color].items():
+                assert (values[0] == batch[color][name][1]).all()
+                assert (values[0] == results[color][name][1]).all()
+        # Different matches are drawn differently
+        assert batch["R"]["win_chance"][0] != batch["R"]["win_chance"][1]
+        # Chunks don't change the results
+        self.simulator.chunk_size = 1
+        assert (
+            self.simulator.simulate_matches(batch_rows, batch_rows, [0, 1, 2])["R"]["win_chance"]
+            == batch["R"]["win_chance"]
+        ).all()
+
+    def test_simulate_bracket(self):
+        obj_team = [
+            dict(self.obj_team[2], team_number=str(alliance_num), avg_total_points=alliance_num)
+            for alliance_num in range(1, 9)
+        ]
+        # Alliance 1 always wins
+        obj_team[0]["avg_total_points"] = 1000
+        simulator = match_simulator.MatchSimulator(
+            obj_team, self.win_chance_fields, self.endgame_fields
+        )
+        chances = simulator.simulate_bracket(
+            simulator.get_alliance_rows([[str(alliance_num)] for alliance_num in range(1, 9)]),
+            1000,
+        )
+        assert list(chances) == [
+            "round_1",
+            "round_2",
+            "round_3",
+            "round_4",
+            "round_5",
+            "finals",
+            "winner",
+        ]
+        assert chances["winner"][0] == 1
+        assert chances["finals"][0] == 1
+        # Every alliance plays at least 2 matches
+        assert (chances["round_2"] == 1).all()
+        # Number of alliances left in each stage
+        for stage, num_alliances in [
+            ("round_3", 6),
+            ("round_4", 4),
+            ("round_5", 3),
+            ("finals", 2),
+            ("winner", 1),
+        ]:
+            assert utils.near(chances[stage].sum(), num_alliances)
+        # Alliance 8 always loses to alliance 1 in the first round, so it can't win the upper bracket
+        assert chances["round_5"][7] < 1
+        assert (chances["winner"][1:] == 0).all()
@@ -3,7 +3,7 @@ import pytest
 from unittest.mock import patch
 from calculations import obj_team
 from server import Server
-from utils import dict_near_in, find_dict_near_index
+from utils import dict_near, dict_near_in, find_dict_near_index
 
 
 @pytest.mark.clouddb
@@ -3641,3 +3641,47 @@ class TestOBJTeamCalc:
             assert dict_near_in(document, expected_results)
             # Removes the matching expected result to protect against duplicates from the calculation
             expected_results.pop(find_dict_near_index(document, expected_results))
+
+    def test_run_incremental(self):
+        """Tests that TIMs added after a run update the running aggregates the same way as a full
+        recalculation"""
+        self.test_run()
+        new_tim = self.test_server.db.find("obj_tim")[0]
+        del new_tim["_id"]
+        new_tim["match_number"] = 99
+        new_tim["incap_time"] += 5
+        self.test_server.db.insert_documents("obj_tim", new_tim)
+        self.test_calc.run()
+        team = new_tim["team_number"]
+        assert len(self.test_calc.team_aggregates[team]["obj_tims"]) == len(
+            self.test_server.db.find("obj_tim", {"team_number": team})
+        )
+        document = self.test_server.db.find("obj_team", {"team_number": team})[0]
+        del document["_id"]
+        assert dict_near(document, self.test_calc.update_team_calcs([team])[0])
+        # Deleting a TIM rebuilds the team's aggregates
+        self.test_server.db.delete_data("obj_tim", {"team_number": team, "match_number": 99})
+        self.test_calc.run()
+        document = self.test_server.db.find("obj_team", {"team_number": team})[0]
+        del document["_id"]
+        assert dict_near(document, self.test_calc.update_team_calcs([team])[0])
+
+    def test_update_all_team_calcs(self):
+        """Tests that calculating every team at once with DataFrames matches calculating each team"""
+        self.test_run()
+        team_updates = self.test_calc.update_all_team_calcs()
+        teams = [update["team_number"] for update in team_updates]
+        assert sorted(teams) == sorted(
+            {tim["team_number"] for tim in self.test_server.db.find("obj_tim")}
+        )
+        for update, expected in zip(team_updates, self.test_calc.update_team_calcs(teams)):
+            assert update.keys() == expected.keys()
+            assert dict_near(update, expected)
+        # Updating all data uses the DataFrame calculations
+        self.test_calc.calc_all_data = True
+        self.test_calc.run()
+        result = self.test_server.db.find("obj_team")
+        assert len(result) == len(teams)
+        for document in result:
+            del document["_id"]
+            assert dict_near_in(document, team_updates)
@@ -610,6 +610,38 @@ class TestObjTIMCalcs:
         assert self.test_calculator.consolidate_bools([False, False, True]) == False
         assert self.test_calculator.consolidate_bools([False, False, False]) == False
 
+    def test_consolidate_num_arrays(self):
+        nums = [[3, 4, 2, 1, 5], [3, 4, 2, 1, 9], [3, 1, 7, 2, 7]]
+        assert self.test_calculator.consolidate_num_arrays(nums).tolist() == [3, 4, 2, 1, 7]
+        # Weighted averages close to a tie round the same way as they did one number at a time
+        assert self.test_calculator.consolidate_num_arrays([[1], [2], [5], [6]]).tolist() == [3]
+        assert self.test_calculator.consolidate_num_arrays([[3.6], [9.85]], True).tolist() == [6.73]
+        assert self.test_calculator.consolidate_num_arrays([[1, 1], [2, 1], [5, 4]]).tolist() == [
+            2,
+            1,
+        ]
+        assert self.test_calculator.consolidate_num_arrays([[1.234], [1.234]], True).tolist() == [
+            1.23
+        ]
+        # TIMs with fewer scouts are padded with NaN
+        stacked = self.test_calculator.stack_scout_arrays([[[1, 2], [1, 3], [4, 5]], [[2, 2]], []])
+        assert stacked.shape == (3, 3, 2)
+        assert self.test_calculator.consolidate_num_arrays(stacked).tolist() == [
+            [1, 3],
+            [2, 2],
+            [0, 0],
+        ]
+
+    def test_consolidate_bool_arrays(self):
+        bools = [[True, False, True], [True, False, False], [False, True, True]]
+        assert self.test_calculator.consolidate_bool_arrays(bools).tolist() == [True, False, True]
+        assert self.test_calculator.consolidate_bool_arrays([[True], [False]]).tolist() == [False]
+
+    def test_consolidate_category_arrays(self):
+        nan = float("nan")
+        indexes = [[0, 1, 2, nan], [0, 3, 1, nan], [2, 1, 0, 2]]
+        assert self.test_calculator.consolidate_category_arrays(indexes).tolist() == [0, 1, 1, 2]
+
     def test_filter_timeline_actions(self):
         actions = self.test_calculator.filter_timeline_actions(self.unconsolidated_tims[0])
         assert actions == [
@@ -887,6 +919,39 @@ class TestObjTIMCalcs:
         ]
         assert harmonized_teams == expected_result
 
+    def test_calculate_harmony_with_partners(self):
+        def stages(team_number, left, center, right, is_red=True):
+            return {
+                "team_number": team_number,
+                "match_number": 7,
+                "alliance_color_is_red": is_red,
+                "stage_level_left": left,
+                "stage_level_center": center,
+                "stage_level_right": right,
+            }
+
+        calculated_tims = [stages("254", "N", "N", "O"), {}, stages("1", "O", "N", "N", False)]
+        # Only the stored partner is on the same stage as 254
+        partner_tims = [stages("1678", "N", "N", "O"), stages("3", "O", "N", "N")]
+        assert self.test_calculator.calculate_harmony(calculated_tims) == []
+        assert self.test_calculator.calculate_harmony(calculated_tims, partner_tims) == [
+            {"team_number": "254", "match_number": 7}
+        ]
+
+    def test_get_harmony_partner_tims(self):
+        self.test_server.db.insert_documents(
+            "obj_tim",
+            [
+                {"team_number": "254", "match_number": 7, "alliance_color_is_red": True},
+                {"team_number": "1678", "match_number": 7, "alliance_color_is_red": True},
+                {"team_number": "3", "match_number": 7, "alliance_color_is_red": False},
+            ],
+        )
+        partner_tims = self.test_calculator.get_harmony_partner_tims(
+            [{"team_number": "254", "match_number": 7, "alliance_color_is_red": True}]
+        )
+        assert [tim["team_number"] for tim in partner_tims] == ["1678"]
+
     def test_calculate_tim_times(self):
         calculated_tim = self.test_calculator.calculate_tim_times(self.unconsolidated_tims)
         assert calculated_tim["incap_time"] == 0
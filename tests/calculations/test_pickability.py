@@ -70,6 +70,46 @@ class TestPickability:
         }
         assert test_calc.calculate_pickability("first_pickability", calc_data) is None
 
+    @staticmethod
+    def test_compile_calculations():
+        features, coefficients, uses = pickability.PickabilityCalc.compile_calculations(
+            FAKE_SCHEMA["calculations"]
+        )
+        assert features == [
+            ("test.datapoint1", "test.datapoint1"),
+            ("test.datapoint2",),
+            ("test2.datapoint1",),
+            ("test.datapoint1",),
+        ]
+        assert coefficients.tolist() == [[1, 0, 0], [1, 1, 1], [1, 4, 2], [0, 1, 5]]
+        assert uses.tolist() == [
+            [True, False, False],
+            [True, True, True],
+            [True, True, True],
+            [False, True, True],
+        ]
+
+    @staticmethod
+    @mock.patch("server.Server.ask_calc_all_data", return_value=False)
+    @mock.patch("utils.read_schema", return_value=FAKE_SCHEMA)
+    def test_sweep_pickability(mock, calc_all_data_mock):
+        test_calc = pickability.PickabilityCalc(Server())
+        team_data = {
+            "0": {"test": {"datapoint1": 2, "datapoint2": 1}, "test2": {"datapoint1": 3}},
+            "1": {"test": {"datapoint1": 4, "datapoint2": 0}},
+        }
+        weights = {
+            "first": {"test.datapoint1": 2},
+            "second": {"test.datapoint1": 0.5, "test2.datapoint1": "test.datapoint2"},
+        }
+        assert test_calc.sweep_pickability(weights, team_data) == {
+            "0": {"first": 4, "second": 4},
+            "1": {"first": 8, "second": None},
+        }
+        # Loads every team from the database if team_data isn't given
+        test_calc.server.db.insert_documents("test", {"team_number": "2", "datapoint1": 1})
+        assert test_calc.sweep_pickability(weights) == {"2": {"first": 2, "second": None}}
+
     @staticmethod
     @mock.patch("utils.read_schema", return_value=FAKE_SCHEMA)
     @mock.patch("server.Server.ask_calc_all_data", return_value=False)
@@ -719,6 +719,104 @@ class TestPredictedAimCalc:
             == self.filtered_aims_list
         )
 
+    def test_get_aim_pairs(self):
+        aims_list = self.aims_list + [
+            {"match_number": 4, "alliance_color": "R", "team_list": ["1678", "254", "4414"]}
+        ]
+        aim_pairs = self.test_calc.get_aim_pairs(aims_list)
+        # Match 4 has no opposing alliance
+        assert aim_pairs == [
+            (self.aims_list[index], self.aims_list[index + 1])
+            for index in range(0, len(self.aims_list), 2)
+        ]
+
+    def test_build_team_features(self):
+        team_indexes, columns, features = self.test_calc.build_team_features(self.obj_team)
+        assert team_indexes == {
+            team_data["team_number"]: index for index, team_data in enumerate(self.obj_team)
+        }
+        assert features.shape == (len(self.obj_team) + 1, len(columns))
+        # Teams without obj_team data use the last row
+        assert (features[-1] == 0).all()
+        team_data = self.obj_team[0]
+        assert features[0, columns["auto_speaker"]] == team_data["auto_avg_speaker"]
+        assert features[0, columns["tele_speaker_all"]] == (
+            team_data["tele_avg_unamplified_speaker"] + team_data["tele_avg_amplified"]
+        )
+        assert features[0, columns["avg_expected_notes"]] == team_data["avg_expected_notes"]
+
+        # Rows are only calculated again for teams with changed obj_team data
+        cached_row = self.test_calc.team_features["254"][1]
+        obj_team = [dict(team_data) for team_data in self.obj_team]
+        obj_team[0]["avg_expected_notes"] += 1
+        _, _, new_features = self.test_calc.build_team_features(obj_team)
+        assert self.test_calc.team_features["254"][1] is cached_row
+        assert new_features[0, columns["avg_expected_notes"]] == team_data["avg_expected_notes"] + 1
+        assert (new_features[1:] == features[1:]).all()
+
+    def test_load_team_documents(self):
+        self.test_server.db.delete_data("obj_team")
+        self.test_server.db.delete_data("tba_team")
+        self.test_server.db.insert_documents("obj_team", self.obj_team)
+        self.test_server.db.insert_documents("tba_team", self.tba_team)
+        teams = {team_data["team_number"] for team_data in self.obj_team + self.tba_team}
+        assert self.test_calc.load_team_documents() == teams
+        assert set(self.test_calc.team_documents["obj_team"]) == {
+            team_data["team_number"] for team_data in self.obj_team
+        }
+
+        # Teams that were updated without any changes aren't returned
+        self.test_server.db.update_document(
+            "obj_team", {"avg_expected_notes": 100}, {"team_number": "1678"}
+        )
+        assert self.test_calc.load_team_documents(["1678", "254"]) == {"1678"}
+        assert self.test_calc.team_documents["obj_team"]["1678"]["avg_expected_notes"] == 100
+
+        # Deleted documents are dropped from the cache
+        self.test_server.db.delete_data("obj_team", {"team_number": "254"})
+        assert self.test_calc.load_team_documents(["1678", "254"]) == {"254"}
+        assert "254" not in self.test_calc.team_documents["obj_team"]
+        assert "254" in self.test_calc.team_documents["tba_team"]
+
+    def test_predict_alliances(self):
+        """Tests that predicting every alliance at once matches predicting each alliance"""
+        team_indexes, columns, features = self.test_calc.build_team_features(self.obj_team)
+        team_lists = [aim["team_list"] for aim in self.filtered_aims_list]
+        predictions = self.test_calc.predict_alliances(
+            columns, features, self.test_calc.get_alliance_rows(team_indexes, team_lists)
+        )
+        for index, team_list in enumerate(team_lists):
+            predicted_values = self.test_calc.calc_alliance_score(
+                predicted_aim.PredictedAimScores(), self.obj_team, self.tba_team, team_list
+            )
+            for field, value in predicted_values.__dict__.items():
+                assert predictions[field][index] == value
+            assert utils.near(
+                predictions["predicted_score"][index],
+                self.test_calc.calc_alliance_auto_score(predicted_values)
+                + self.test_calc.calc_alliance_tele_score(
+                    predicted_values, self.obj_team, team_list
+                )
+                + self.test_calc.calc_alliance_stage_score(
+                    self.obj_team, team_list, predicted_values
+                ),
+            )
+            assert predictions["predicted_rp1"][index] == self.test_calc.calc_melody_rp(
+                predicted_values
+            )
+            assert predictions["predicted_rp2"][index] == self.test_calc.calc_ensemble_rp(
+                self.obj_team, team_list
+            )
+        # Win chances of the red alliances against the blue alliances
+        red_predictions, blue_predictions = [
+            {name: values[side::2] for name, values in predictions.items()} for side in [0, 1]
+        ]
+        win_chances = self.test_calc.calc_win_chances(red_predictions, blue_predictions)
+        for index in range(len(team_lists) // 2):
+            assert win_chances[index] == self.test_calc.calc_win_chance(
+                self.obj_team, {"R": team_lists[index * 2], "B": team_lists[index * 2 + 1]}
+            )
+
     def test_update_predicted_aim(self):
         self.test_server.db.delete_data("predicted_aim")
         with patch(
@@ -749,6 +847,42 @@ class TestPredictedAimCalc:
             print(self.test_calc.update_predicted_aim(self.aims_list))
             assert self.test_calc.update_predicted_aim(self.aims_list) == self.expected_updates
 
+    def test_update_simulated_aim(self):
+        self.test_server.db.delete_data("obj_team")
+        self.test_server.db.insert_documents("obj_team", self.obj_team)
+        updates = [
+            {
+                "match_number": 1,
+                "alliance_color_is_red": True,
+                "team_numbers": ["1678", "254", "4414"],
+            },
+            {
+                "match_number": 1,
+                "alliance_color_is_red": False,
+                "team_numbers": ["125", "1323", "5940"],
+            },
+            {
+                "match_number": 2,
+                "alliance_color_is_red": True,
+                "team_numbers": ["1678", "1323", "125"],
+            },
+        ]
+        result = self.test_calc.update_simulated_aim([dict(update) for update in updates])
+        # Match 2 has no opposing alliance, so it isn't simulated
+        assert "simulated_win_chance" not in result[2]
+        red_update, blue_update = result[:2]
+        assert utils.near(
+            red_update["simulated_win_chance"] + blue_update["simulated_win_chance"], 1
+        )
+        for update in result[:2]:
+            quantiles = [update[f"simulated_score_p{quantile}"] for quantile in [5, 25, 50, 75, 95]]
+            assert quantiles == sorted(quantiles)
+            for name in ["rp1_chance", "rp2_chance", "win_chance"]:
+                assert 0 <= update[f"simulated_{name}"] <= 1
+            assert 0 <= update["simulated_avg_rps"] <= 4
+        # The same seed gives the same results
+        assert self.test_calc.update_simulated_aim([dict(update) for update in updates]) == result
+
     def test_update_playoffs_alliances(self):
         """Test that we correctly calculate data for each of the playoff alliances"""
         self.test_server.db.delete_data("predicted_aim")
@@ -780,6 +914,23 @@ class TestPredictedAimCalc:
             print(self.test_calc.update_playoffs_alliances())
             assert self.test_calc.update_playoffs_alliances() == self.expected_playoffs_updates_2
 
+    def test_calc_playoffs_chances(self):
+        self.test_server.db.delete_data("obj_team")
+        self.test_server.db.insert_documents("obj_team", self.obj_team)
+        # The bracket isn't simulated until there are 8 alliances
+        assert self.test_calc.calc_playoffs_chances(self.expected_playoffs_alliances) == {}
+        playoffs_alliances = [
+            {"alliance_num": alliance_num, "picks": ["1678", "254", "4414"]}
+            for alliance_num in range(1, 9)
+        ] + [{"alliance_num": 9, "picks": ["1678", "254", "125"]}]
+        chances = self.test_calc.calc_playoffs_chances(playoffs_alliances)
+        # Backup alliances aren't in the bracket
+        assert list(chances) == list(range(1, 9))
+        assert utils.near(sum(chances[num]["winner_chance"] for num in chances), 1)
+        assert utils.near(sum(chances[num]["finals_chance"] for num in chances), 2)
+        for alliance_chances in chances.values():
+            assert alliance_chances["round_1_chance"] == 1
+
     def test_run(self):
         self.test_server.db.delete_data("obj_team")
         self.test_server.db.delete_data("tba_team")
@@ -801,6 +952,10 @@ class TestPredictedAimCalc:
 
         for document in result:
             del document["_id"]
+            # Simulated values are tested in test_update_simulated_aim
+            for field in list(document):
+                if field.startswith("simulated_"):
+                    del document[field]
 
         assert result == self.expected_results
 
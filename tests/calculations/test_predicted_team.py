@@ -1,5 +1,6 @@
 from calculations import predicted_team
 import server
+import utils
 
 from unittest import mock
 
@@ -289,6 +290,23 @@ class TestPredictedTeamCalc:
                 "current_avg_rps": 18 / 11,
             },
         ]
+        # The predicted_aim data has no simulated chances, so every simulation is the same
+        self.simulated_ranks = {
+            "1533": 1,
+            "1678": 2,
+            "7229": 3,
+            "254": 4,
+            "2056": 5,
+            "1114": 6,
+            "971": 7,
+            "1323": 8,
+            "7179": 9,
+        }
+        for result in self.expected_results:
+            rank = self.simulated_ranks[result["team_number"]]
+            result["simulated_rank_chances"] = [float(rank == other) for other in range(1, 10)]
+            result["simulated_avg_rank"] = rank
+            result["captain_chance"] = float(rank <= 8)
         self.teams = [
             "1678",
             "1533",
@@ -395,6 +413,75 @@ class TestPredictedTeamCalc:
                 if update["team_number"] == result["team_number"]:
                     assert update["predicted_rank"] == result["predicted_rank"]
 
+    def test_get_outcome_chances(self):
+        red_aim, blue_aim = self.predicted_aim[2:4]
+        assert self.test_calc.get_outcome_chances({"R": red_aim, "B": blue_aim}) == (
+            1.0,
+            0.0,
+            1.0,
+            1.0,
+            0.0,
+        )
+        red_aim = dict(red_aim, simulated_win_chance=0.3, simulated_rp1_chance=0.6)
+        assert self.test_calc.get_outcome_chances({"R": red_aim, "B": blue_aim}) == (
+            0.3,
+            0.6,
+            1.0,
+            1.0,
+            0.0,
+        )
+
+    def test_get_simulated_matches(self, caplog):
+        match_teams, match_rps = self.test_calc.get_simulated_matches(
+            self.aim_list, self.predicted_aim
+        )
+        # Match 1 has been played and match 4 is incomplete
+        assert ["Unable to simulate Match 4, incomplete AIM data"] == [
+            rec.message for rec in caplog.records if rec.levelname == "WARNING"
+        ]
+        assert match_teams == [
+            (["2056", "1114", "7179"], ["1678", "971", "7229"]),
+            (["2056", "254", "1323"], ["1533", "1114", "7179"]),
+        ]
+        assert match_rps.shape == (2, 2, self.test_calc.NUM_SIMULATIONS)
+        assert (match_rps[0, 0] == 3).all() and (match_rps[0, 1] == 1).all()
+        assert (match_rps[1, 0] == 2).all() and (match_rps[1, 1] == 3).all()
+        assert list(self.test_calc.simulated_matches) == [2, 3]
+
+        # Only matches with new outcome chances are drawn again
+        match_3_rps = self.test_calc.simulated_matches[3]["rps"]
+        self.predicted_aim[2]["simulated_win_chance"] = 0.5
+        match_teams, match_rps = self.test_calc.get_simulated_matches(
+            self.aim_list, self.predicted_aim
+        )
+        assert self.test_calc.simulated_matches[3]["rps"] is match_3_rps
+        assert 0 < (match_rps[0, 0] >= 3).mean() < 1
+
+    def test_calculate_simulated_ranks(self):
+        updates = self.test_calc.calculate_simulated_ranks(
+            [{"team_number": team} for team in self.teams],
+            self.aim_list,
+            self.ranking_data["rankings"],
+            self.predicted_aim,
+        )
+        for update in updates:
+            rank = self.simulated_ranks[update["team_number"]]
+            assert update["simulated_rank_chances"][rank - 1] == 1
+            assert update["simulated_avg_rank"] == rank
+            assert update["captain_chance"] == float(rank <= 8)
+
+        # Red wins match 3 half of the time, which moves 254 between rank 2 and rank 4
+        self.predicted_aim[4]["simulated_win_chance"] = 0.5
+        updates = self.test_calc.calculate_simulated_ranks(
+            [{"team_number": "254"}],
+            self.aim_list,
+            self.ranking_data["rankings"],
+            self.predicted_aim,
+        )
+        assert 0.4 < updates[0]["simulated_rank_chances"][1] < 0.6
+        assert utils.near(sum(updates[0]["simulated_rank_chances"]), 1)
+        assert updates[0]["captain_chance"] == 1
+
     def test_update_predicted_team(self):
         with mock.patch(
             "data_transfer.tba_communicator.tba_request", return_value=self.ranking_data
@@ -0,0 +1,80 @@
+import statistics
+
+import pytest
+
+from calculations import running_stats
+from utils import near
+
+
+class TestRunningStat:
+    def test_add(self):
+        stat = running_stats.RunningStat([4, 1, 3, 8])
+        assert stat.count == 4
+        assert stat.sum == 16
+        assert near(stat.mean, 4)
+        assert near(stat.pstdev(), statistics.pstdev([4, 1, 3, 8]))
+        assert stat.sorted_values == [1, 3, 4, 8]
+
+    def test_remove(self):
+        stat = running_stats.RunningStat([4, 1, 3, 8, 3])
+        stat.remove(8)
+        stat.remove(3)
+        assert stat.count == 3
+        assert near(stat.mean, statistics.mean([4, 1, 3]))
+        assert near(stat.pstdev(), statistics.pstdev([4, 1, 3]))
+        assert stat.sorted_values == [1, 3, 4]
+        with pytest.raises(ValueError):
+            stat.remove(8)
+        stat.remove(1)
+        stat.remove(3)
+        assert stat.mean == 4
+        assert stat.pstdev() == 0
+
+    def test_median(self):
+        stat = running_stats.RunningStat([0, 5, 0, 2, 9])
+        assert stat.median() == 2
+        assert stat.median(ignore=0) == 5
+        assert running_stats.RunningStat([0, 0]).median(ignore=0) is None
+
+
+class TestLastMatchesWindow:
+    def setup_method(self):
+        self.window = running_stats.LastMatchesWindow(3, ["points"], ["start"])
+        # Added out of order
+        for match_number, points, start in [(4, 10, "1"), (1, 2, "2"), (3, 6, "2"), (2, 4, "1")]:
+            self.window.add({"match_number": match_number, "points": points, "start": start})
+
+    def test_add(self):
+        assert len(self.window) == 3
+        assert [tim["match_number"] for tim in self.window.get_tims()] == [2, 3, 4]
+        assert self.window.stats["points"].sorted_values == [4, 6, 10]
+        assert self.window.categories["start"] == {"1": 2, "2": 1}
+        # Older than every match in the full window
+        self.window.add({"match_number": 1, "points": 2, "start": "2"})
+        assert [tim["match_number"] for tim in self.window.get_tims()] == [2, 3, 4]
+        # Replaces match 3
+        self.window.add({"match_number": 3, "points": 8, "start": "1"})
+        assert self.window.stats["points"].sorted_values == [4, 8, 10]
+        assert self.window.categories["start"] == {"1": 3}
+
+    def test_get_categories(self):
+        assert list(self.window.get_categories()["start"]) == ["1", "2"]
+
+    def test_remove(self):
+        self.window.remove(3)
+        assert self.window.stats["points"].sorted_values == [4, 10]
+        assert self.window.categories["start"] == {"1": 2}
+        self.window.remove(4, older_tim={"match_number": 1, "points": 2, "start": "2"})
+        assert [tim["match_number"] for tim in self.window.get_tims()] == [1, 2]
+        assert near(running_stats.mean(self.window.stats["points"]), 3)
+
+
+def test_functions():
+    values = [0, 5, 0, 2, 9, 4]
+    stat = running_stats.RunningStat(values)
+    for function in [running_stats.mean, running_stats.pstdev]:
+        assert near(function(stat), function(values))
+    assert running_stats.maximum(stat) == running_stats.maximum(values) == 9
+    assert running_stats.minimum(stat) == running_stats.minimum(values) == 0
+    assert running_stats.median(stat, 0) == running_stats.median(values, 0) == 4.5
+    assert running_stats.mean([]) == 0
@@ -353,6 +353,45 @@ class TestScoutPrecisionCalc:
             },
         ]
         assert self.test_calc.calc_ranks(test_data) == expected_output
+        # Ranks of scouts from previous calls are kept and updated
+        assert self.test_calc.calc_ranks([{"scout_name": "CYRUS BROWN", "scout_precision": 1}]) == [
+            {"scout_name": "REED WANG", "scout_precision": 0.39, "scout_precision_rank": 1},
+            {"scout_name": "CYRUS BROWN", "scout_precision": 1, "scout_precision_rank": 2},
+            {
+                "scout_name": "KATHY LI",
+                "scout_precision": 3.61111111111111,
+                "scout_precision_rank": 3,
+            },
+            {
+                "scout_name": "NATHAN MILLS",
+                "scout_precision": 4.111111111111111,
+                "scout_precision_rank": 4,
+            },
+            {
+                "scout_name": "ALISON LIN",
+                "scout_precision": 8.222222222222221,
+                "scout_precision_rank": 5,
+            },
+        ]
+
+    def test_get_scout_sims(self):
+        self.test_server.db.insert_documents(
+            "sim_precision",
+            [
+                {"scout_name": "KATHY LI", "match_number": 1, "sim_precision": 1},
+                {"scout_name": "KATHY LI", "match_number": 2, "sim_precision": 2},
+                {"scout_name": "REED WANG", "match_number": 1, "sim_precision": 3},
+            ],
+        )
+        scout_sims = self.test_calc.get_scout_sims(["KATHY LI", "CYRUS BROWN"])
+        assert list(scout_sims) == ["KATHY LI", "CYRUS BROWN"]
+        assert [sim["match_number"] for sim in scout_sims["KATHY LI"]] == [1, 2]
+        assert scout_sims["CYRUS BROWN"] == []
+        assert list(self.test_calc.get_scout_sims(["CYRUS BROWN"], all_scouts=True)) == [
+            "CYRUS BROWN",
+            "KATHY LI",
+            "REED WANG",
+        ]
 
     def test_update_scout_precision_calcs(self):
         with patch(
@@ -501,6 +540,8 @@ class TestScoutPrecisionCalc:
             },
         ]
         self.test_server.db.delete_data("unconsolidated_totals")
+        # Every scout in sim_precision is ranked on the first run
+        self.test_server.db.delete_data("sim_precision")
         self.test_calc.update_timestamp()
         self.test_server.db.insert_documents("unconsolidated_totals", self.scout_tim_test_data)
         with patch(
@@ -513,6 +554,7 @@ class TestScoutPrecisionCalc:
             ):
                 self.test_calc.run()
         scout_precision_result = self.test_server.db.find("scout_precision")
+        assert len(scout_precision_result) == len(expected_scout_precision)
         for document in scout_precision_result:
             document.pop("_id")
             assert document in expected_scout_precision
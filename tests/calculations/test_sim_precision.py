@@ -236,6 +236,34 @@ class TestSimPrecisionCalc:
         assert self.test_calc.get_scout_tim_score("NITHMI JAYASUNDARA", 1, required) == 23
         assert self.test_calc.get_scout_tim_score("NATHAN MILLS", 2, required) == 25
 
+    def test_load_scout_index(self):
+        self.test_server.db.delete_data("unconsolidated_totals")
+        self.test_server.db.insert_documents("unconsolidated_totals", self.scout_tim_test_data)
+        self.test_calc.load_scout_index()
+        assert set(self.test_calc.scout_index) == {1, 2}
+        assert set(self.test_calc.scout_index[1][True]["589"]) == {
+            "KATE UNGER",
+            "NITHMI JAYASUNDARA",
+            "RAY FABIONAR",
+        }
+        assert (
+            self.test_calc.scout_index[1][True]["1678"]["ALISON LIN"]["scores"]["sim_precision"]
+            == 31
+        )
+        required = self.test_calc.sim_schema["calculations"]["sim_precision"]["requires"]
+        # Scores are looked up in the index, even after the data is deleted
+        self.test_server.db.delete_data("unconsolidated_totals")
+        assert self.test_calc.get_scout_tim_score("NATHAN MILLS", 2, required) == 25
+        assert (
+            self.test_calc.get_scout_tim_score("NATHAN MILLS", 2, required, "sim_precision") == 25
+        )
+        assert self.test_calc.get_aim_scout_scores(2, False, required, "sim_precision") == {
+            "1678": {"NATHAN MILLS": 25},
+            "4414": {"KATHY LI": 34},
+            "589": {"KATE UNGER": 34},
+        }
+        assert self.test_calc.get_aim_scout_scores(3, False, required) == {}
+
     def test_get_aim_scout_scores(self):
         self.test_server.db.delete_data("unconsolidated_totals")
         self.test_server.db.insert_documents("unconsolidated_totals", self.scout_tim_test_data)
@@ -281,6 +309,35 @@ class TestSimPrecisionCalc:
             "RAY FABIONAR": 12.5,
         }
 
+    def test_get_aim_error_tensor(self):
+        aim_scout_scores = {
+            "1678": {"ALISON LIN": 31, "NATHAN MILLS": 6},
+            "4414": {"KATHY LI": 19},
+            "589": {"KATE UNGER": 23, "NITHMI JAYASUNDARA": 20, "RAY FABIONAR": 23},
+        }
+        assert self.test_calc.get_aim_error_tensor(aim_scout_scores, 73).tolist() == [
+            [[0, 3, 0]],
+            [[25, 28, 25]],
+        ]
+
+    def test_calc_aim_sim_precisions(self):
+        aim_scout_scores = {
+            "1678": {"ALISON LIN": 31, "NATHAN MILLS": 6},
+            "4414": {"KATHY LI": 19},
+            "589": {"KATE UNGER": 23, "NITHMI JAYASUNDARA": 23, "RAY FABIONAR": 23},
+        }
+        aim_scout_errors = self.test_calc.get_aim_scout_avg_errors(aim_scout_scores, 73, 1, True)
+        assert self.test_calc.calc_aim_sim_precisions(aim_scout_scores, {}, 73) == {}
+        precisions = self.test_calc.calc_aim_sim_precisions(aim_scout_scores, aim_scout_errors, 73)
+        expected_precisions = {
+            "1678": {"ALISON LIN": 25 / 3, "NATHAN MILLS": -50 / 3},
+            "4414": {"KATHY LI": -25 / 6},
+            "589": {"KATE UNGER": -25 / 6, "NITHMI JAYASUNDARA": -25 / 6, "RAY FABIONAR": -25 / 6},
+        }
+        assert list(precisions) == list(expected_precisions)
+        for team, team_precisions in expected_precisions.items():
+            assert dict_near(precisions[team], team_precisions)
+
     def test_calc_sim_precision(self):
         self.test_server.db.insert_documents("unconsolidated_totals", self.scout_tim_test_data)
         # with patch(
@@ -588,6 +645,54 @@ class TestSimPrecisionCalc:
 
         assert dict_near(sim_precision_result, {"sim_precision": -8.833333333333333})
 
+    def test_get_match_fingerprint(self):
+        self.test_server.db.insert_documents("unconsolidated_totals", self.scout_tim_test_data)
+        self.test_calc.load_scout_index()
+        fingerprint = self.test_calc.get_match_fingerprint(1, self.tba_test_data[0])
+        assert fingerprint == self.test_calc.get_match_fingerprint(1, self.tba_test_data[0])
+        assert fingerprint != self.test_calc.get_match_fingerprint(2, self.tba_test_data[0])
+        # Changing the TBA result changes the fingerprint
+        assert fingerprint != self.test_calc.get_match_fingerprint(1, self.tba_test_data[1])
+        # Changing a scout's data changes the fingerprint
+        self.test_server.db.update_document(
+            "unconsolidated_totals",
+            {"auto_speaker": 10},
+            {"match_number": 1, "scout_name": "ALISON LIN"},
+        )
+        self.test_calc.load_scout_index()
+        assert fingerprint != self.test_calc.get_match_fingerprint(1, self.tba_test_data[0])
+
+    def test_calc_match_results(self):
+        self.test_server.db.insert_documents("unconsolidated_totals", self.scout_tim_test_data)
+        self.test_calc.load_scout_index()
+        (
+            tba_aim_scores,
+            aim_errors,
+            aim_reported_values,
+            aim_precisions,
+        ) = self.test_calc.calc_match_results(1, self.tba_test_data[0])
+        calculations = self.test_calc.sim_schema["calculations"]
+        assert set(tba_aim_scores) == set(aim_errors) == set(calculations)
+        assert aim_reported_values["sim_precision"][True] == {
+            "1678": {"ALISON LIN": 31, "NATHAN MILLS": 6},
+            "4414": {"KATHY LI": 19},
+            "589": {"KATE UNGER": 23, "NITHMI JAYASUNDARA": 23, "RAY FABIONAR": 23},
+        }
+        assert tba_aim_scores["sim_precision"][True] == self.test_calc.get_tba_value(
+            self.tba_test_data,
+            calculations["sim_precision"]["tba_datapoints"],
+            1,
+            True,
+        )
+        # There is no blue alliance scout data for Match 1
+        assert aim_errors["sim_precision"][False] == {}
+        assert aim_precisions["sim_precision"][False] == {}
+        assert set(aim_precisions["sim_precision"][True]["589"]) == {
+            "KATE UNGER",
+            "NITHMI JAYASUNDARA",
+            "RAY FABIONAR",
+        }
+
     def test_update_sim_precision_calcs(self):
         self.test_server.db.insert_documents("unconsolidated_totals", self.scout_tim_test_data)
         expected_updates = [
@@ -618,6 +723,8 @@ class TestSimPrecisionCalc:
             # Remove timestamp field since it's difficult to test, figure out later
             updates[0].pop("timestamp")
             assert updates == expected_updates
+            # Intermediate results are kept for the next run
+            assert list(self.test_calc.match_results) == [1]
 
     def test_get_tba_value(self):
         required = {
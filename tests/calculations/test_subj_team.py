@@ -66,6 +66,42 @@ class TestSubjTeamCalcs:
             "2910",
         ]
 
+    def test_get_partner_matrix(self):
+        tims = [
+            {"match_number": 1, "team_number": "1678", "alliance_color_is_red": True},
+            {"match_number": 1, "team_number": "4414", "alliance_color_is_red": True},
+            {"match_number": 1, "team_number": "3", "alliance_color_is_red": False},
+            {"match_number": 2, "team_number": "1678", "alliance_color_is_red": False},
+            {"match_number": 2, "team_number": "4414", "alliance_color_is_red": False},
+            {"match_number": 2, "team_number": "2910", "alliance_color_is_red": False},
+        ]
+        team_indexes, partners = self.test_calcs.get_partner_matrix(tims)
+        assert team_indexes == {"1678": 0, "2910": 1, "3": 2, "4414": 3}
+        assert partners.tolist() == [
+            [2, 1, 0, 2],
+            [1, 1, 0, 1],
+            [0, 0, 1, 0],
+            [2, 1, 0, 2],
+        ]
+        # Loads subj_tims from the database if they aren't given
+        self.test_server.db.insert_documents("subj_tim", tims)
+        assert self.test_calcs.get_partner_matrix()[1].tolist() == partners.tolist()
+
+    def test_find_team_documents(self):
+        tims = [
+            {"match_number": 1, "team_number": "1678", "alliance_color_is_red": True},
+            {"match_number": 1, "team_number": "4414", "alliance_color_is_red": True},
+        ]
+        self.test_server.db.insert_documents("subj_tim", tims)
+        documents = self.test_calcs.find_team_documents("subj_tim", "1678")
+        assert len(documents) == 1
+        assert documents[0]["match_number"] == 1
+        # Loaded documents are used instead of the database
+        loaded = {"subj_tim": {"4414": [tims[1]]}}
+        assert self.test_calcs.find_team_documents("subj_tim", "4414", loaded) == [tims[1]]
+        assert self.test_calcs.find_team_documents("subj_tim", "1678", loaded) == []
+        assert self.test_calcs.find_team_documents("subj_team", "1678", loaded) == []
+
     def test_all_calcs(self):
         tims = [
             {
@@ -331,3 +331,51 @@ class TestTBATeamCalc:
         for document in result:
             del document["_id"]
             assert document in expected_results
+
+    def test_calculate_ccs(self):
+        tba_matches = [
+            {
+                "alliances": {
+                    "red": {"team_keys": ["frc973", "frc1678"]},
+                    "blue": {"team_keys": ["frc973", "frc3478"]},
+                },
+                "score_breakdown": {
+                    "red": {"foulPoints": 13, "autoPoints": 4, "coopertitionBonusAchieved": True},
+                    "blue": {"foulPoints": 10, "autoPoints": 6, "coopertitionBonusAchieved": True},
+                },
+            },
+            {
+                "alliances": {
+                    "red": {"team_keys": ["frc1678", "frc3478"]},
+                    "blue": {"team_keys": ["frc973", "frc1577"]},
+                },
+                "score_breakdown": {
+                    "red": {"foulPoints": 15, "autoPoints": 2, "coopertitionBonusAchieved": False},
+                    "blue": {"foulPoints": 7, "autoPoints": 8, "coopertitionBonusAchieved": True},
+                },
+            },
+            # Unplayed matches are skipped
+            {
+                "alliances": {
+                    "red": {"team_keys": ["frc1678", "frc973"]},
+                    "blue": {"team_keys": ["frc3478", "frc1577"]},
+                },
+                "score_breakdown": None,
+            },
+        ]
+        cc_events = self.test_calc.get_cc_events(tba_matches)
+        assert len(cc_events) == 4
+        # Booleans are not CC metrics, and fouls are given by the other alliance
+        assert cc_events[0] == {
+            "parties": ["973", "1678"],
+            "values": {"foulPoints": 13, "autoPoints": 4, "foul": 10},
+        }
+        ccs = self.test_calc.calculate_ccs(tba_matches)
+        assert ccs["973"] == {"foulPoints": 4.0, "autoPoints": 4.0, "foul": 8.0}
+        assert ccs["1678"]["foul"] == 2.0
+        assert ccs["3478"]["foul"] == 5.0
+        assert ccs["1577"]["foul"] == 7.0
+        assert self.test_calc.cc_solver.matches_full_solve()
+        # Matches that haven't changed are not added again
+        assert self.test_calc.calculate_ccs(tba_matches) == ccs
+        assert len(self.test_calc.cc_solver.events) == 4
@@ -246,6 +246,31 @@ class TestTBATimCalc:
                 assert isinstance(calc["leave"], bool)
                 assert isinstance(calc["spotlight"], bool)
 
+    def test_compile_schema(self):
+        slot_requirements = tba_tims.TBATIMCalc.compile_schema(
+            {
+                "leave": {"type": "bool", "autoLineRobot": "Yes"},
+                "coopertition": {"type": "bool", "coopertitionCriteriaMet": True},
+                "spotlight": {"type": "bool"},
+            }
+        )
+        assert list(slot_requirements) == [1, 2, 3]
+        assert slot_requirements[2] == [
+            ("leave", (("autoLineRobot2", "Yes"),)),
+            ("coopertition", (("coopertitionCriteriaMet", True),)),
+            ("spotlight", ()),
+        ]
+
+    def test_calculate_match_tims(self):
+        for match in TEST_DATA:
+            match_tims = self.test_calc.calculate_match_tims(match)
+            assert [tim["team_number"] for tim in match_tims] == (
+                self.test_calc.get_team_list_from_match(match)
+            )
+            for tim in match_tims:
+                assert tim == self.test_calc.calculate_tim(tim["team_number"], match)
+        assert self.test_calc.calculate_match_tims(dict(TEST_DATA[0], score_breakdown=None)) == []
+
     def test_run(self):
         entries = self.test_calc.entries_since_last()
         for entry in entries:
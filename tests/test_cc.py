@@ -1,4 +1,5 @@
-from cc import cc
+from cc import cc, cc_metrics, incidence_matrix, IncrementalCC
+import numpy as np
 
 
 def test_cc():
@@ -30,3 +31,84 @@ def test_cc_empty_input():
     result = cc(data)
     expected_result = {}
     assert result == expected_result
+
+
+def test_incidence_matrix():
+    parties, matrix = incidence_matrix([["B", "A"], ["A", "C"], ["C", "C"]])
+    assert parties == ["A", "B", "C"]
+    assert matrix.toarray().tolist() == [[1, 1, 0], [1, 0, 1], [0, 0, 1]]
+
+
+def test_cc_metrics():
+    data = [
+        {"parties": ["A", "B"], "values": {"value": 10.0, "double": 20.0}},
+        {"parties": ["A", "C"], "values": {"value": 5.0, "double": 10.0}},
+        {"parties": ["B", "C"], "values": {"value": 7.5}},
+    ]
+    result = cc_metrics(data)
+    assert result == {
+        "A": {"value": 3.75, "double": 15.0},
+        "B": {"value": 6.25, "double": 5.0},
+        "C": {"value": 1.25, "double": -5.0},
+    }
+    assert cc_metrics([]) == {}
+
+
+def test_cc_underdetermined():
+    # A and B are always together, so their contributions are split evenly
+    data = [
+        {"parties": ["A", "B"], "value": 10.0},
+        {"parties": ["A", "B", "C"], "value": 13.0},
+    ]
+    assert cc(data) == {"A": 5.0, "B": 5.0, "C": 3.0}
+
+
+def test_incremental_cc():
+    solver = IncrementalCC()
+    data = [
+        {"parties": ["A", "B"], "values": {"value": 10.0}},
+        {"parties": ["A", "C"], "values": {"value": 5.0}},
+        {"parties": ["B", "C"], "values": {"value": 7.5, "other": 1.0}},
+    ]
+    assert solver.solve() == {}
+    # Solved with least squares until there is a unique solution
+    assert solver.add_event(data[0])
+    assert solver.solve() == {"A": {"value": 5.0}, "B": {"value": 5.0}}
+    assert solver.is_underdetermined
+    solver.add_event(data[1])
+    solver.add_event(data[2])
+    assert solver.solve() == cc_metrics(data)
+    assert not solver.is_underdetermined
+    # New events update the cached factorization
+    factor = solver.factor
+    solver.add_event({"parties": ["A", "B", "C"], "values": {"value": 12.0}})
+    assert solver.factor is factor
+    assert np.allclose(factor.T @ factor, solver.left_side)
+    assert solver.matches_full_solve()
+
+
+def test_incremental_cc_replace_event():
+    solver = IncrementalCC()
+    solver.add_event({"parties": ["A", "B"], "values": {"value": 10.0}}, key="qm1")
+    solver.add_event({"parties": ["A", "C"], "values": {"value": 5.0}}, key="qm2")
+    solver.add_event({"parties": ["B", "C"], "values": {"value": 7.5}}, key="qm3")
+    assert not solver.add_event({"parties": ["B", "C"], "values": {"value": 7.5}}, key="qm3")
+    assert solver.add_event({"parties": ["B", "C"], "values": {"value": 9.5}}, key="qm3")
+    assert len(solver.events) == 3
+    assert solver.solve() == {"A": {"value": 2.75}, "B": {"value": 7.25}, "C": {"value": 2.25}}
+    assert solver.matches_full_solve()
+
+
+def test_incremental_cc_remove_party():
+    solver = IncrementalCC()
+    solver.add_event({"parties": ["A", "B"], "values": {"value": 10.0}}, key="qm1")
+    solver.add_event({"parties": ["A", "C"], "values": {"value": 5.0}}, key="qm2")
+    solver.add_event({"parties": ["B", "D"], "values": {"value": 7.5, "other": 1.0}}, key="qm3")
+    solver.add_event({"parties": ["C", "D"], "values": {"value": 3.0}}, key="qm4")
+    # D and the other metric are no longer in any event
+    solver.add_event({"parties": ["B", "C"], "values": {"value": 7.5}}, key="qm3")
+    solver.add_event({"parties": ["A", "B", "C"], "values": {"value": 12.0}}, key="qm4")
+    assert solver.parties == ["A", "B", "C"]
+    assert solver.metrics == ["value"]
+    assert solver.solve() == cc_metrics(list(solver.events.values()))
+    assert not solver.is_underdetermined
@@ -1,5 +1,6 @@
-from predict_alliance import predict_alliance
+from predict_alliance import evaluate_alliance_combinations, predict_alliance
 from unittest.mock import patch
+import itertools
 import server
 import pytest
 
@@ -98,3 +99,74 @@ def test_predict_alliance():
         )
         == expected_return
     )
+
+
+def test_evaluate_alliance_combinations():
+    with patch("server.Server.ask_calc_all_data", return_value=False):
+        test_server = server.Server()
+    teams = ["1678", "254", "4414", "971", "1323"]
+    obj_team_data = [
+        {
+            "team_number": team,
+            "auto_avg_amp": 1,
+            "auto_sd_amp": 0,
+            "auto_avg_speaker": num,
+            "auto_sd_speaker": 1,
+            "tele_avg_amp": 4 - num,
+            "tele_sd_amp": 2,
+            "tele_avg_unamplified_speaker": num % 2,
+            "tele_sd_unamplified_speaker": 0,
+            "tele_avg_amplified": 2 * num,
+            "tele_sd_amplified": 4,
+            "stage_percent_success_all": num / 4,
+            "parked_percent": 0.33,
+            "trap_percent_success": 1 - num / 4,
+            "endgame_avg_total_points": 5,
+            "endgame_sd_total_points": 1.14,
+            "avg_expected_notes": 10 + num,
+            "climb_after_percent_success": 0,
+        }
+        for num, team in enumerate(teams)
+    ]
+    tba_team_data = [{"team_number": team, "leave_successes": 3} for team in teams]
+    # Every alliance with 1678, best first
+    expected_alliances = sorted(
+        [["1678", *others] for others in itertools.combinations(teams[1:], 2)],
+        key=lambda alliance: -predict_alliance(
+            *alliance, test_server, obj_team_data, tba_team_data
+        )["predicted_score"],
+    )
+
+    result = evaluate_alliance_combinations(
+        test_server,
+        teams,
+        fixed_teams=["1678"],
+        top_k=3,
+        chunk_size=2,
+        obj_team_data=obj_team_data,
+    )
+    assert [alliance["team_numbers"] for alliance in result] == expected_alliances[:3]
+    for alliance in result:
+        assert alliance["predicted_score"] == pytest.approx(
+            predict_alliance(*alliance["team_numbers"], test_server, obj_team_data, tba_team_data)[
+                "predicted_score"
+            ]
+        )
+
+    result = evaluate_alliance_combinations(
+        test_server,
+        teams,
+        fixed_teams=["1678"],
+        opponents=[["254", "4414", "971"]],
+        sort_by="win_chance",
+        top_k=10,
+        obj_team_data=obj_team_data,
+    )
+    assert len(result) == 6
+    win_chances = [alliance["win_chance"] for alliance in result]
+    assert win_chances == sorted(win_chances, reverse=True)
+
+    with pytest.raises(ValueError):
+        evaluate_alliance_combinations(
+            test_server, teams, sort_by="win_chance", obj_team_data=obj_team_data
+        )